@@ -0,0 +1,478 @@
+"""Cross-user approximate nearest-neighbour index over CLIP embeddings.
+
+An IVF (inverted file) index in plain NumPy, persisted under a root
+directory and memory-mapped read-only, so every worker process on a host
+shares one copy through the page cache:
+
+    <root>/CURRENT                 name of the active version directory
+    <root>/lock                    flock() guard for appends and version swaps
+    <root>/<version>/meta.json     dim, nlist, count, build time
+    <root>/<version>/centroids.npy (nlist, dim) float32, unit norm
+    <root>/<version>/list_offsets.npy (nlist + 1,) int64
+    <root>/<version>/vectors.npy   (count, dim) float32, grouped by list
+    <root>/<version>/doc_ids.npy   (count,) S24
+    <root>/<version>/user_ids.npy  (count,) S64
+    <root>/<version>/delta.bin     append-only records inserted since the build
+
+Inserts append fixed-size records to ``delta.bin``; every process maps the
+file again when it grows and scans it exactly. ``rebuild`` re-clusters
+every embedding stored in MongoDB into a fresh version, carries over delta
+records the snapshot missed, and swaps CURRENT atomically. Nothing runs it
+automatically: schedule it (e.g. nightly cron). Once the delta log passes
+``delta_warn_records``, the next insert logs a warning (once per version and
+process) and ``stats()`` reports ``rebuild_recommended``.
+
+Usage:
+    python ann_index.py rebuild [--nlist N]     # offline rebuild from MongoDB
+    python ann_index.py bench [--n 200000]      # recall vs latency against exact search
+"""
+import argparse
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_INDEX_DIR = os.path.join(BASE_DIR, "ann_data")
+EMBEDDING_DIM = 512
+DOC_ID_DTYPE = "S24"
+USER_ID_DTYPE = "S64"
+# ~100 MB of delta vectors: past this, exact delta scans dominate query time
+DEFAULT_DELTA_WARN_RECORDS = 50000
+
+
+def delta_record_dtype(dim):
+    return np.dtype([("doc_id", DOC_ID_DTYPE), ("user_id", USER_ID_DTYPE), ("vector", "<f4", (dim,))])
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+@contextmanager
+def index_lock(root):
+    """Exclusive inter-process lock on the index root"""
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, "lock"), "a+") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def read_current(root):
+    try:
+        with open(os.path.join(root, "CURRENT")) as handle:
+            return handle.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_current(root, version):
+    tmp_path = os.path.join(root, f"CURRENT.tmp-{os.getpid()}")
+    with open(tmp_path, "w") as handle:
+        handle.write(version)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp_path, os.path.join(root, "CURRENT"))
+
+
+# ==================== K-MEANS ====================
+
+def assign_to_centroids(vectors, centroids, chunk_size=65536):
+    """Index of the most similar centroid for every row (cosine / dot product)"""
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+        assignments[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+
+def train_kmeans(vectors, nlist, iterations=15, max_train=100000, seed=0):
+    """Spherical k-means on a sample of the vectors"""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > max_train:
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), max_train, replace=False))], dtype=np.float32)
+    else:
+        sample = np.asarray(vectors, dtype=np.float32)
+    nlist = max(1, min(nlist, len(sample)))
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign_to_centroids(sample, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=nlist)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        sums = np.zeros_like(centroids)
+        nonempty = counts > 0
+        sums[nonempty] = np.add.reduceat(sample[order], starts[nonempty], axis=0)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+def default_nlist(count):
+    return int(max(1, min(65536, 4 * np.sqrt(max(count, 1)))))
+
+
+# ==================== BUILD ====================
+
+def build_index(root, doc_ids, user_ids, vectors, nlist=None, iterations=15, carry_over_delta=True):
+    """Build a new index version from arrays and make it CURRENT.
+
+    Records appended to the previous version's delta log that are not part
+    of the new build are carried over, so inserts racing a rebuild survive.
+    """
+    vectors = normalize_rows(vectors)
+    doc_ids = np.asarray(doc_ids, dtype=DOC_ID_DTYPE)
+    user_ids = np.asarray(user_ids, dtype=USER_ID_DTYPE)
+    count, dim = vectors.shape if vectors.ndim == 2 else (0, EMBEDDING_DIM)
+    nlist = nlist or default_nlist(count)
+
+    if count:
+        centroids = train_kmeans(vectors, nlist, iterations=iterations)
+        assignments = assign_to_centroids(vectors, centroids)
+        order = np.argsort(assignments, kind="stable")
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignments, minlength=len(centroids)))
+        vectors, doc_ids, user_ids = vectors[order], doc_ids[order], user_ids[order]
+    else:
+        centroids = np.zeros((0, dim), dtype=np.float32)
+        offsets = np.zeros(1, dtype=np.int64)
+        vectors = np.zeros((0, dim), dtype=np.float32)
+
+    os.makedirs(root, exist_ok=True)
+    version = datetime.utcnow().strftime("v%Y%m%d%H%M%S%f")
+    version_dir = os.path.join(root, version)
+    os.makedirs(version_dir)
+    np.save(os.path.join(version_dir, "centroids.npy"), centroids)
+    np.save(os.path.join(version_dir, "list_offsets.npy"), offsets)
+    np.save(os.path.join(version_dir, "vectors.npy"), vectors)
+    np.save(os.path.join(version_dir, "doc_ids.npy"), doc_ids)
+    np.save(os.path.join(version_dir, "user_ids.npy"), user_ids)
+    with open(os.path.join(version_dir, "meta.json"), "w") as handle:
+        json.dump({
+            "dim": int(dim),
+            "nlist": int(len(centroids)),
+            "count": int(count),
+            "built_at": datetime.utcnow().isoformat()
+        }, handle)
+
+    with index_lock(root):
+        previous = read_current(root)
+        new_delta_path = os.path.join(version_dir, "delta.bin")
+        with open(new_delta_path, "ab"):
+            pass
+        if carry_over_delta and previous:
+            old_delta_path = os.path.join(root, previous, "delta.bin")
+            if os.path.exists(old_delta_path):
+                old_records = np.fromfile(old_delta_path, dtype=delta_record_dtype(dim))
+                keep = old_records[~np.isin(old_records["doc_id"], doc_ids)]
+                if len(keep):
+                    keep.tofile(new_delta_path)
+        write_current(root, version)
+    return version
+
+
+def prune_old_versions(root, keep=2):
+    """Delete all but the newest ``keep`` versions (never the current one)"""
+    current = read_current(root)
+    versions = sorted(name for name in os.listdir(root) if name.startswith("v") and os.path.isdir(os.path.join(root, name)))
+    for name in versions[:-keep]:
+        if name == current:
+            continue
+        version_dir = os.path.join(root, name)
+        for filename in os.listdir(version_dir):
+            os.remove(os.path.join(version_dir, filename))
+        os.rmdir(version_dir)
+
+
+# ==================== SEARCH ====================
+
+class IVFIndex:
+    """Read-mostly handle on a persisted IVF index, shared via mmap across processes"""
+
+    def __init__(self, root=DEFAULT_INDEX_DIR, dim=EMBEDDING_DIM, nprobe=8, refresh_interval=2.0,
+                 delta_warn_records=DEFAULT_DELTA_WARN_RECORDS):
+        self.root = root
+        self.dim = dim
+        self.nprobe = nprobe
+        self.refresh_interval = refresh_interval
+        self.delta_warn_records = delta_warn_records
+        self._warned_version = None
+        self._record_dtype = delta_record_dtype(dim)
+        self._lock = threading.Lock()
+        self._next_refresh = 0.0
+        self._version = None
+        self._base = None
+        self._delta = None
+        self._delta_size = -1
+
+    # ---------------- loading ----------------
+
+    def _load_version(self, version):
+        version_dir = os.path.join(self.root, version)
+        with open(os.path.join(version_dir, "meta.json")) as handle:
+            meta = json.load(handle)
+        if meta["dim"] != self.dim:
+            raise ValueError(f"ANN index dim {meta['dim']} != {self.dim}")
+        return {
+            "meta": meta,
+            "centroids": np.load(os.path.join(version_dir, "centroids.npy")),
+            "offsets": np.load(os.path.join(version_dir, "list_offsets.npy")),
+            "vectors": np.load(os.path.join(version_dir, "vectors.npy"), mmap_mode="r"),
+            "doc_ids": np.load(os.path.join(version_dir, "doc_ids.npy"), mmap_mode="r"),
+            "user_ids": np.load(os.path.join(version_dir, "user_ids.npy"), mmap_mode="r"),
+        }
+
+    def _map_delta(self):
+        path = os.path.join(self.root, self._version, "delta.bin")
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            size = 0
+        if size == self._delta_size:
+            return
+        # A concurrent writer may have a partial record at the tail; ignore it
+        records = size // self._record_dtype.itemsize
+        self._delta = np.memmap(path, dtype=self._record_dtype, mode="r", shape=(records,)) if records else None
+        self._delta_size = size
+
+    def refresh(self, force=False):
+        """Pick up a new CURRENT version and any records appended to the delta log"""
+        now = time.monotonic()
+        if not force and now < self._next_refresh:
+            return
+        with self._lock:
+            self._next_refresh = now + self.refresh_interval
+            version = read_current(self.root)
+            if version is None:
+                self._version, self._base, self._delta, self._delta_size = None, None, None, -1
+                return
+            if version != self._version:
+                self._base = self._load_version(version)
+                self._version = version
+                self._delta, self._delta_size = None, -1
+            self._map_delta()
+
+    # ---------------- writes ----------------
+
+    def add(self, doc_id, user_id, embedding):
+        """Append one embedding to the shared delta log"""
+        vector = normalize_rows(np.asarray(embedding, dtype=np.float32).reshape(1, -1))[0]
+        if vector.shape[0] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dim embedding, got {vector.shape[0]}")
+        record = np.zeros(1, dtype=self._record_dtype)
+        record["doc_id"] = str(doc_id).encode()[:24]
+        record["user_id"] = str(user_id).encode()[:64]
+        record["vector"] = vector
+
+        if read_current(self.root) is None:
+            # First insert on a host without a built index: start an empty version
+            build_index(self.root, [], [], np.zeros((0, self.dim), dtype=np.float32))
+        with index_lock(self.root):
+            version = read_current(self.root)
+            fd = os.open(os.path.join(self.root, version, "delta.bin"), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, record.tobytes())
+            finally:
+                os.close(fd)
+        self.refresh(force=True)
+        self._check_delta_size()
+
+    def _check_delta_size(self):
+        delta, version = self._delta, self._version
+        count = len(delta) if delta is not None else 0
+        if self.delta_warn_records and count >= self.delta_warn_records and self._warned_version != version:
+            self._warned_version = version
+            print(f"Warning: ANN delta log of {self.root}/{version} has {count} records "
+                  f"(>= {self.delta_warn_records}), all scanned exactly on every query; "
+                  f"run 'python ann_index.py rebuild'")
+
+    # ---------------- queries ----------------
+
+    def search(self, embedding, k=10, nprobe=None, exclude_user=None):
+        """Top-k most similar stored embeddings as dicts {score, doc_id, user_id}"""
+        self.refresh()
+        query = normalize_rows(np.asarray(embedding, dtype=np.float32).reshape(1, -1))[0]
+        base, delta = self._base, self._delta
+        nprobe = nprobe or self.nprobe
+
+        scores, doc_ids, user_ids = [], [], []
+        if base is not None and base["meta"]["count"]:
+            centroids, offsets = base["centroids"], base["offsets"]
+            probe = min(nprobe, len(centroids))
+            lists = np.argpartition(-(centroids @ query), probe - 1)[:probe]
+            for list_id in lists:
+                start, end = offsets[list_id], offsets[list_id + 1]
+                if start == end:
+                    continue
+                scores.append(base["vectors"][start:end] @ query)
+                doc_ids.append(base["doc_ids"][start:end])
+                user_ids.append(base["user_ids"][start:end])
+        if delta is not None and len(delta):
+            scores.append(delta["vector"] @ query)
+            doc_ids.append(delta["doc_id"])
+            user_ids.append(delta["user_id"])
+        if not scores:
+            return []
+
+        scores = np.concatenate(scores)
+        doc_ids = np.concatenate(doc_ids)
+        user_ids = np.concatenate(user_ids)
+        if exclude_user is not None:
+            keep = user_ids != str(exclude_user).encode()[:64]
+            scores, doc_ids, user_ids = scores[keep], doc_ids[keep], user_ids[keep]
+        if not len(scores):
+            return []
+
+        top = min(k, len(scores))
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best])]
+        return [
+            {"score": float(scores[i]), "doc_id": doc_ids[i].decode(), "user_id": user_ids[i].decode()}
+            for i in best
+        ]
+
+    def stats(self):
+        self.refresh()
+        base, delta = self._base, self._delta
+        return {
+            "version": self._version,
+            "base_count": base["meta"]["count"] if base else 0,
+            "nlist": base["meta"]["nlist"] if base else 0,
+            "delta_count": len(delta) if delta is not None else 0,
+            "rebuild_recommended": bool(self.delta_warn_records) and delta is not None
+                                   and len(delta) >= self.delta_warn_records,
+            "nprobe": self.nprobe,
+        }
+
+
+# ==================== OFFLINE COMMANDS ====================
+
+def load_embeddings_from_mongo(batch_size=5000):
+    """Read every active stored CLIP embedding from MongoDB"""
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+
+    from embedding_codec import EMBEDDING_FIELDS, decode_embedding
+
+    load_dotenv()
+    mongodb_uri = os.getenv("MONGODB_URI")
+    if not mongodb_uri:
+        raise RuntimeError("MONGODB_URI environment variable not set")
+    collection = MongoClient(mongodb_uri)["bingo_app"]["user_images"]
+
+    doc_ids, user_ids, chunks, chunk = [], [], [], []
+    cursor = collection.find(
+        {"status": "active", "clip_embedding": {"$exists": True}},
+        {"_id": 1, "user_id": 1, **EMBEDDING_FIELDS}
+    ).batch_size(batch_size)
+    for doc in cursor:
+        vector = decode_embedding(doc)
+        if vector is None or vector.shape[0] != EMBEDDING_DIM:
+            continue
+        doc_ids.append(str(doc["_id"]))
+        user_ids.append(str(doc.get("user_id")))
+        chunk.append(vector)
+        if len(chunk) >= batch_size:
+            chunks.append(np.stack(chunk))
+            chunk = []
+    if chunk:
+        chunks.append(np.stack(chunk))
+    vectors = np.concatenate(chunks) if chunks else np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+    return doc_ids, user_ids, vectors
+
+
+def command_rebuild(args):
+    start = time.time()
+    doc_ids, user_ids, vectors = load_embeddings_from_mongo()
+    print(f"Loaded {len(doc_ids)} embeddings in {time.time() - start:.1f}s")
+    version = build_index(args.index_dir, doc_ids, user_ids, vectors, nlist=args.nlist, iterations=args.iterations)
+    prune_old_versions(args.index_dir, keep=args.keep)
+    print(f"Built {version} in {time.time() - start:.1f}s")
+
+
+def synthetic_embeddings(n, dim=EMBEDDING_DIM, clusters=1000, spread=0.6, seed=0):
+    """Clustered unit vectors, closer to real CLIP embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centers = normalize_rows(rng.standard_normal((clusters, dim)))
+    labels = rng.integers(0, clusters, n)
+    vectors = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 65536):
+        end = min(n, start + 65536)
+        noise = rng.standard_normal((end - start, dim)).astype(np.float32) * (spread / np.sqrt(dim))
+        vectors[start:end] = normalize_rows(centers[labels[start:end]] + noise)
+    return vectors
+
+
+def command_bench(args):
+    rng = np.random.default_rng(1)
+    vectors = synthetic_embeddings(args.n, seed=0)
+    # Queries are near-duplicates of stored images, the case the index exists for
+    picks = rng.choice(args.n, args.queries, replace=False)
+    queries = normalize_rows(vectors[picks] + rng.standard_normal((args.queries, EMBEDDING_DIM)).astype(np.float32) * 0.01)
+
+    root = args.index_dir
+    start = time.perf_counter()
+    build_index(root, [f"{i:024x}" for i in range(args.n)], ["bench"] * args.n, vectors, nlist=args.nlist)
+    build_time = time.perf_counter() - start
+    index = IVFIndex(root)
+    print(f"n={args.n} nlist={index.stats()['nlist']} build={build_time:.1f}s")
+
+    exact_times, exact_top = [], []
+    for query in queries:
+        t = time.perf_counter()
+        scores = vectors @ query
+        top = np.argpartition(-scores, args.k - 1)[:args.k]
+        exact_times.append(time.perf_counter() - t)
+        exact_top.append({f"{i:024x}" for i in top})
+    print(f"exact     p50={np.percentile(exact_times, 50) * 1000:.2f}ms p99={np.percentile(exact_times, 99) * 1000:.2f}ms recall@{args.k}=1.000")
+
+    for nprobe in args.nprobe:
+        times, recalls = [], []
+        for query, truth in zip(queries, exact_top):
+            t = time.perf_counter()
+            found = index.search(query, k=args.k, nprobe=nprobe)
+            times.append(time.perf_counter() - t)
+            recalls.append(len(truth & {hit["doc_id"] for hit in found}) / args.k)
+        print(f"nprobe={nprobe:<4d} p50={np.percentile(times, 50) * 1000:.2f}ms p99={np.percentile(times, 99) * 1000:.2f}ms recall@{args.k}={np.mean(recalls):.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross-user CLIP embedding ANN index")
+    parser.add_argument("--index-dir", default=os.getenv("ANN_INDEX_DIR", DEFAULT_INDEX_DIR))
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = sub.add_parser("rebuild", help="Rebuild the index from MongoDB")
+    rebuild.add_argument("--nlist", type=int, default=None)
+    rebuild.add_argument("--iterations", type=int, default=15)
+    rebuild.add_argument("--keep", type=int, default=2, help="Index versions to keep on disk")
+    rebuild.set_defaults(func=command_rebuild)
+
+    bench = sub.add_parser("bench", help="Recall vs latency against exact search on synthetic data")
+    bench.add_argument("--n", type=int, default=200000)
+    bench.add_argument("--queries", type=int, default=200)
+    bench.add_argument("--k", type=int, default=10)
+    bench.add_argument("--nlist", type=int, default=None)
+    bench.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    bench.set_defaults(func=command_bench)
+
+    args = parser.parse_args()
+    if args.command == "bench" and args.index_dir == DEFAULT_INDEX_DIR:
+        args.index_dir = os.path.join(BASE_DIR, "ann_bench")
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,105 +1,189 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response, stream_with_context
 from flask_cors import CORS
 from ultralytics import YOLO
 import torch
-from transformers import CLIPProcessor, CLIPModel
+from transformers import CLIPProcessor
 from PIL import Image
 import requests
 import imagehash
 import io, os
 from pymongo import MongoClient
+from pymongo.errors import ConnectionFailure as MongoConnectionFailure
 from datetime import datetime, timedelta
 import numpy as np
 from bson import ObjectId
 import cv2
-from deepface import DeepFace
 import uuid
+import hashlib
 import warnings
 from dotenv import load_dotenv
 from functools import lru_cache
 import threading
-from concurrent.futures import ThreadPoolExecutor
+import functools
+import gc
+import itertools
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import json
 import asyncio
 import time
+from micro_batcher import MicroBatcher
+from duplicate_index import DuplicateIndexCache
+from ann_index import IVFIndex, DEFAULT_DELTA_WARN_RECORDS, DEFAULT_INDEX_DIR
+from phash_index import PHashIndex, load_from_collection as load_phash_index
+from result_cache import ResultCache, content_key
+from image_fetch import ImageFetcher
+from counting_executor import CountingThreadPoolExecutor
+from http_cache import DiskHttpCache
+from image_pyramid import ImagePyramid, decode_reduced
+from face_verification import FaceVerifier, FACE_DISTANCE_THRESHOLD
+from model_registry import ModelRegistry, ModelUnavailableError
+from metrics import MetricsRegistry
+from inference_scheduler import InferenceScheduler, available_cpus, parse_partitions
+from image_writer import WRITE_MODES, ImageWriter
+from job_queue import DEFAULT_DB_PATH as DEFAULT_JOB_DB_PATH, JobQueue, JobWorkerPool
+from text_embedding_cache import DEFAULT_CACHE_DIR as DEFAULT_TEXT_EMBEDDING_DIR, TextEmbeddingCache, file_fingerprint, model_revision
+from clip_engine import AI_PROMPTS, DEFAULT_ONNX_DIR, DUSTBIN_CLASSES, ENGINES as CLIP_ENGINES, REAL_PROMPTS, load_clip_engine
+from embedding_codec import EMBEDDING_FIELDS, EMBEDDING_FORMATS, encode_embedding
 
 warnings.filterwarnings('ignore')
 
 app = Flask(__name__)
 CORS(app)
 
+# Prometheus-format metrics at /metrics; METRICS_ENABLED=false makes every
+# timer / counter below a no-op
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+metrics = MetricsRegistry(enabled=METRICS_ENABLED, prefix="bingo_")
+STAGE_SECONDS = metrics.histogram("stage_seconds", "Latency of one verification step", ("stage",))
+REQUEST_SECONDS = metrics.histogram("request_seconds", "Request latency by endpoint and status", ("endpoint", "status"))
+REJECTIONS = metrics.counter("rejections_total", "Rejected submissions by reason", ("reason",))
+BATCH_SIZE = metrics.histogram("batch_size", "Images per model call", ("model",), buckets=(1, 2, 4, 8, 16, 32, 64))
+
 # MongoDB setup
 load_dotenv()
 MONGODB_URI = os.getenv('MONGODB_URI')
 if not MONGODB_URI:
     raise RuntimeError("MONGODB_URI environment variable not set")
 
-client = MongoClient(MONGODB_URI)
-db = client['bingo_app']
-user_images_collection = db['user_images']
-user_images_collection.create_index([("user_id", 1), ("created_at", -1)])
+# MONGODB_URI=mongomock:// runs against an in-process stand-in (requirements-dev.txt)
+# for offline load tests (benchmarks/load_test.py); pre-fork workers don't share it
+def connect_mongo():
+    if MONGODB_URI.startswith("mongomock://"):
+        import mongomock
 
-# Global models - load once
-print("Loading models...")
-clip_model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-clip_processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+        return mongomock.MongoClient()
+    return MongoClient(MONGODB_URI)
 
-print("Loading YOLO model for object detection...")
+client = connect_mongo()
+db = client['bingo_app']
+user_images_collection = db['user_images']
 try:
-    yolo_model = YOLO('yolov8n.pt')  # Using nano version for speed
-    print("YOLO model loaded successfully!")
+    user_images_collection.create_index([("user_id", 1), ("created_at", -1)])
 except Exception as e:
-    print(f"Warning: Could not load YOLO model: {e}")
-    yolo_model = None
-
-# Pre-compute CLIP text embeddings for AI detection (one-time cost)
-AI_PROMPTS = [
-    "artificial intelligence generated image", "computer generated artwork",
-    "digital art created by AI", "synthetic image", "AI rendered picture"
-]
-REAL_PROMPTS = [
-    "real photograph", "natural photography", "authentic image",
-    "camera captured photo", "genuine photograph"
-]
-
-DUSTBIN_CLASSES = [
-    'trash can', 'garbage bin', 'waste basket', 'recycle bin', 
-    'dustbin', 'rubbish bin', 'bin', 'container'
-]
-
-print("Pre-computing CLIP text embeddings...")
-all_prompts = AI_PROMPTS + REAL_PROMPTS
-text_inputs = clip_processor(text=all_prompts, return_tensors="pt", padding=True)
-with torch.no_grad():
-    PRECOMPUTED_TEXT_EMBEDDINGS = clip_model.get_text_features(**text_inputs)
-    PRECOMPUTED_TEXT_EMBEDDINGS = PRECOMPUTED_TEXT_EMBEDDINGS / PRECOMPUTED_TEXT_EMBEDDINGS.norm(p=2, dim=-1, keepdim=True)
-
-print("Pre-computing dustbin detection embeddings...")
-dustbin_inputs = clip_processor(text=DUSTBIN_CLASSES, return_tensors="pt", padding=True)
-with torch.no_grad():
-    DUSTBIN_TEXT_EMBEDDINGS = clip_model.get_text_features(**dustbin_inputs)
-    DUSTBIN_TEXT_EMBEDDINGS = DUSTBIN_TEXT_EMBEDDINGS / DUSTBIN_TEXT_EMBEDDINGS.norm(p=2, dim=-1, keepdim=True)
-
-print("Models loaded successfully!")
-
-# Thread pool for concurrent processing
-executor = ThreadPoolExecutor(max_workers=4)
+    # Don't block startup on the database; /health reports it until it's reachable
+    print(f"Warning: could not ensure MongoDB indexes: {e}")
+
+# Global models - loaded in the background (see MODEL LOADING below)
+CLIP_MODEL_NAME = "openai/clip-vit-base-patch32"
+# torch (eager), onnx or onnx-int8; ONNX graphs come from `python clip_engine.py export`
+CLIP_ENGINE = os.getenv("CLIP_ENGINE", "torch")
+CLIP_ONNX_DIR = os.getenv("CLIP_ONNX_DIR", DEFAULT_ONNX_DIR)
+if CLIP_ENGINE not in CLIP_ENGINES:
+    raise RuntimeError(f"CLIP_ENGINE must be one of {CLIP_ENGINES}")
+
+# background: load + warm up on a thread while the server binds; eager: block at import
+MODEL_LOADING = os.getenv("MODEL_LOADING", "background")
+MODEL_LOAD_TIMEOUT = float(os.getenv("MODEL_LOAD_TIMEOUT", "300"))
+# Models loaded by each pre-fork worker instead of the parent (see gunicorn.conf.py)
+MODEL_WORKER_ONLY = [name for name in os.getenv("MODEL_WORKER_ONLY", "").split(",") if name]
+text_embedding_cache = TextEmbeddingCache(os.getenv("TEXT_EMBEDDING_CACHE_DIR", DEFAULT_TEXT_EMBEDDING_DIR))
+model_registry = ModelRegistry()
+
+# Every CLIP / YOLO / face forward pass runs in its model's CPU partition:
+# max concurrent calls and optional core pinning per model, plus an intra-op
+# thread budget for ONNX Runtime CLIP sessions, e.g.
+# INFERENCE_PARTITIONS="clip:threads=8,cores=0-7;yolo:concurrency=2,cores=8-11"
+# (see inference_scheduler.py). Unlisted models share INFERENCE_CPU_BUDGET
+# (default: every usable core; gunicorn.conf.py splits it across workers).
+# torch's own thread count is process-wide and isn't set per partition.
+INFERENCE_SCHEDULER_ENABLED = os.getenv("INFERENCE_SCHEDULER", "true").lower() == "true"
+
+def build_inference_scheduler():
+    budget = int(os.getenv("INFERENCE_CPU_BUDGET", "0")) or available_cpus()
+    return InferenceScheduler(
+        parse_partitions(os.getenv("INFERENCE_PARTITIONS", ""), budget),
+        enabled=INFERENCE_SCHEDULER_ENABLED
+    )
+
+inference_scheduler = build_inference_scheduler()
+
+def run_inference(model, fn, *args, **kwargs):
+    return inference_scheduler.run(model, fn, *args, **kwargs)
+
+# Long-lived thread pool for concurrent stages (shared by all requests)
+STAGE_EXECUTOR_WORKERS = int(os.getenv("STAGE_EXECUTOR_WORKERS", "4"))
+executor = CountingThreadPoolExecutor(max_workers=STAGE_EXECUTOR_WORKERS, thread_name_prefix="stage")
+
+# Micro-batching for CLIP image inference shared by all request threads
+CLIP_BATCH_MAX_SIZE = int(os.getenv("CLIP_BATCH_MAX_SIZE", "16"))
+CLIP_BATCH_MAX_WAIT_MS = float(os.getenv("CLIP_BATCH_MAX_WAIT_MS", "5"))
+CLIP_BATCH_MAX_QUEUE = int(os.getenv("CLIP_BATCH_MAX_QUEUE", "256"))
+
+# Pooled, size-capped downloads for URL-based endpoints, through a disk cache of
+# fetched bytes shared by every worker process (ETag / Last-Modified revalidation)
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "true").lower() == "true"
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "image_cache"))
+IMAGE_CACHE_MAX_MB = float(os.getenv("IMAGE_CACHE_MAX_MB", "1024"))
+IMAGE_CACHE_FRESH_SECONDS = float(os.getenv("IMAGE_CACHE_FRESH_SECONDS", "60"))
+
+def build_image_fetcher():
+    cache = DiskHttpCache(
+        IMAGE_CACHE_DIR, max_bytes=int(IMAGE_CACHE_MAX_MB * 1024 * 1024), fresh_seconds=IMAGE_CACHE_FRESH_SECONDS
+    ) if IMAGE_CACHE_ENABLED else None
+    return ImageFetcher(
+        max_bytes=int(os.getenv("IMAGE_FETCH_MAX_BYTES", str(20 * 1024 * 1024))),
+        timeout=float(os.getenv("IMAGE_FETCH_TIMEOUT", "10")),
+        pool_maxsize=int(os.getenv("IMAGE_FETCH_POOL_SIZE", "32")),
+        max_workers=int(os.getenv("IMAGE_FETCH_WORKERS", "8")),
+        cache=cache
+    )
+
+image_fetcher = build_image_fetcher()
 
 # ==================== OPTIMIZED UTILITY FUNCTIONS ====================
 
+def read_image_bytes(source):
+    """Raw bytes of an uploaded file, URL or local path"""
+    if hasattr(source, 'save'):  # FileStorage
+        return source.read()
+    elif isinstance(source, str):
+        if source.startswith(("http://", "https://")):
+            with STAGE_SECONDS.time(stage="download"):
+                return image_fetcher.fetch(source)
+        else:
+            with open(source, "rb") as f:
+                return f.read()
+    else:
+        raise ValueError("Invalid image source")
+
+def decode_image(data):
+    """Decode image bytes to an RGB PIL image, reduced on decode to what the stages need"""
+    with STAGE_SECONDS.time(stage="decode"):
+        return decode_reduced(data)
+
 def load_image_fast(source):
     """Optimized image loading with caching"""
     try:
-        if hasattr(source, 'save'):  # FileStorage
-            return Image.open(source).convert("RGB")
-        elif isinstance(source, str):
-            if source.startswith(("http://", "https://")):
-                response = requests.get(source, timeout=10, stream=True)
-                response.raise_for_status()
-                return Image.open(io.BytesIO(response.content)).convert("RGB")
-            else:
-                return Image.open(source).convert("RGB")
-        else:
-            raise ValueError("Invalid image source")
+        return decode_image(read_image_bytes(source))
+    except Exception as e:
+        print(f"Error loading image: {str(e)}")
+        raise
+
+def load_image_features(source):
+    """Load an image into a feature context keyed on its bytes for the result cache"""
+    try:
+        data = read_image_bytes(source)
+        return ImageFeatures(decode_image(data), cache_key=content_key(data, VERIFICATION_VERSION))
     except Exception as e:
         print(f"Error loading image: {str(e)}")
         raise
@@ -110,12 +194,10 @@ def get_clip_embedding_cached(image_hash):
     pass
 
 def get_clip_embedding_fast(pil_image):
-    """Optimized CLIP embedding"""
+    """Optimized CLIP embedding, batched with concurrent requests"""
     try:
-        inputs = clip_processor(images=pil_image, return_tensors="pt")
-        with torch.no_grad():
-            embedding = clip_model.get_image_features(**inputs)
-        return embedding / embedding.norm(p=2)
+        embedding = clip_batcher.run(pil_image)
+        return embedding.unsqueeze(0)
     except Exception as e:
         print(f"Error getting CLIP embedding: {str(e)}")
         raise
@@ -123,103 +205,208 @@ def get_clip_embedding_fast(pil_image):
 def get_image_features_batch(images):
     """Process multiple images in batch for efficiency"""
     try:
-        inputs = clip_processor(images=images, return_tensors="pt")
-        with torch.no_grad():
-            embeddings = clip_model.get_image_features(**inputs)
+        clip_engine, clip_processor = model_registry.get("clip", MODEL_LOAD_TIMEOUT)
+        BATCH_SIZE.observe(len(images), model="clip")
+        with STAGE_SECONDS.time(stage="clip"):
+            inputs = clip_processor(images=images, return_tensors="pt")
+            embeddings = run_inference("clip", clip_engine.image_features, inputs["pixel_values"])
         return embeddings / embeddings.norm(p=2, dim=-1, keepdim=True)
     except Exception as e:
         print(f"Error in batch processing: {str(e)}")
         raise
 
+# Concurrent get_clip_embedding_fast calls share one forward pass per batch
+clip_batcher = MicroBatcher(
+    get_image_features_batch,
+    max_batch_size=CLIP_BATCH_MAX_SIZE,
+    max_wait_ms=CLIP_BATCH_MAX_WAIT_MS,
+    max_queue_size=CLIP_BATCH_MAX_QUEUE,
+    name="clip-batcher"
+)
+
+# ==================== PER-REQUEST FEATURE CONTEXT ====================
+
+class ImageFeatures:
+    """Per-request feature context shared by every verification stage.
+
+    The CLIP vision tower runs at most once per image; the normalized
+    embedding is reused for the duplicate check, dustbin scoring and
+    AI-prompt scoring.
+    """
+
+    def __init__(self, pil_image, embedding=None, cache_key=None, pyramid=None):
+        self.image = pil_image
+        self.pyramid = pyramid or ImagePyramid(pil_image)
+        self.cache_key = cache_key
+        self._embedding = embedding
+        self._phash = None
+        self._embedding_lock = threading.Lock()
+        self._phash_lock = threading.Lock()
+
+    @property
+    def embedding(self):
+        """Normalized CLIP image embedding of shape (1, 512)"""
+        if self._embedding is None:
+            with self._embedding_lock:
+                if self._embedding is None:
+                    self._embedding = self.cached("embedding", lambda: get_clip_embedding_fast(self.pyramid.clip))
+        return self._embedding
+
+    @property
+    def phash(self):
+        """Perceptual hash as a hex string"""
+        if self._phash is None:
+            with self._phash_lock:
+                if self._phash is None:
+                    self._phash = self.cached("phash", self._compute_phash)
+        return self._phash
+
+    def _compute_phash(self):
+        with STAGE_SECONDS.time(stage="phash"):
+            return str(imagehash.phash(self.pyramid.phash_gray))
+
+    def text_similarities(self, text_embeddings):
+        """Cosine similarity against pre-normalized text embeddings"""
+        return (self.embedding @ text_embeddings.T).squeeze(0)
+
+    def cached(self, stage, compute, should_cache=None):
+        """Stage result from the content-addressed cache when the image bytes are known"""
+        if self.cache_key is None:
+            return compute()
+        return result_cache.get_or_compute(self.cache_key, stage, compute, should_cache)
+
+    def ai_result(self):
+        """AI-generation verdict, shared by every request for the same bytes"""
+        return self.cached("ai", lambda: detect_ai_generated_fast(self.image, self), is_cacheable_result)
+
+    def dustbin_result(self):
+        """Dustbin detection result, shared by every request for the same bytes"""
+        return self.cached("dustbin", lambda: detect_dustbin_fast(self.image, self), is_cacheable_result)
+
 # ==================== DUSTBIN DETECTION ====================
 
-def detect_dustbin_fast(pil_image):
-    """Optimized dustbin detection using YOLO + CLIP"""
-    try:
-        results = {
-            "dustbin_detected": False,
-            "confidence": 0.0,
-            "method": "none",
-            "details": {}
-        }
-        
-        # Method 1: YOLO object detection (primary)
-        if yolo_model is not None:
-            try:
-                # Convert PIL to numpy array for YOLO
-                img_array = np.array(pil_image)
-                
-                # Run YOLO detection
-                detections = yolo_model(img_array, verbose=False)[0]
-                
-                # Check for relevant object classes
-                dustbin_classes_yolo = [39, 73]  # bottle, book (closest matches in COCO)
-                # Note: COCO doesn't have direct dustbin class, so we check for containers
-                
-                max_conf = 0.0
-                for detection in detections.boxes.data:
-                    class_id = int(detection[5])
-                    confidence = float(detection[4])
-                    
-                    # Check for container-like objects with high confidence
-                    if class_id in dustbin_classes_yolo and confidence > 0.3:
-                        max_conf = max(max_conf, confidence)
-                
-                if max_conf > 0.3:
-                    results.update({
+DUSTBIN_YOLO_THRESHOLD = 0.3
+DUSTBIN_CLIP_THRESHOLD = 0.25  # Adjust threshold as needed
+
+# COCO doesn't have a dustbin class, so we check for containers
+YOLO_DUSTBIN_CLASSES = [39, 73]  # bottle, book (closest matches in COCO)
+YOLO_FULL_IMGSZ = 640
+YOLO_BATCH_SIZE = int(os.getenv("YOLO_BATCH_SIZE", "16"))
+# Adaptive mode: detect at YOLO_FAST_IMGSZ first and only re-run at full
+# resolution when the best confidence lands in the borderline band. Off by
+# default: an image scoring below YOLO_BORDERLINE_LOW at the fast size is
+# never re-run, so small or distant bins that only show up at full resolution
+# are missed. Measure agreement with the full-resolution verdicts on real
+# submissions before turning it on.
+YOLO_ADAPTIVE = os.getenv("YOLO_ADAPTIVE", "false").lower() == "true"
+YOLO_FAST_IMGSZ = int(os.getenv("YOLO_FAST_IMGSZ", "320"))
+YOLO_BORDERLINE_LOW = float(os.getenv("YOLO_BORDERLINE_LOW", "0.1"))
+YOLO_BORDERLINE_HIGH = float(os.getenv("YOLO_BORDERLINE_HIGH", "0.5"))
+
+yolo_stats_lock = threading.Lock()
+yolo_stats = {"calls": 0, "images": 0, "full_resolution_reruns": 0}
+
+def yolo_max_confidences(img_arrays, imgsz):
+    """Best dustbin-class confidence per image from batched YOLO calls"""
+    yolo_model = model_registry.get("yolo", MODEL_LOAD_TIMEOUT)
+    confidences = []
+    for start in range(0, len(img_arrays), YOLO_BATCH_SIZE):
+        chunk = img_arrays[start:start + YOLO_BATCH_SIZE]
+        BATCH_SIZE.observe(len(chunk), model="yolo")
+        with STAGE_SECONDS.time(stage="yolo"):
+            detections = run_inference(
+                "yolo", yolo_model, chunk,
+                imgsz=imgsz, conf=min(YOLO_BORDERLINE_LOW, DUSTBIN_YOLO_THRESHOLD), verbose=False
+            )
+        for result in detections:
+            boxes = result.boxes
+            if boxes is None or len(boxes) == 0:
+                confidences.append(0.0)
+                continue
+            wanted = torch.isin(boxes.cls.long(), torch.tensor(YOLO_DUSTBIN_CLASSES, device=boxes.cls.device))
+            confidences.append(boxes.conf[wanted].max().item() if wanted.any() else 0.0)
+        with yolo_stats_lock:
+            yolo_stats["calls"] += 1
+            yolo_stats["images"] += len(chunk)
+    return confidences
+
+def detect_dustbin_yolo_batch(img_arrays):
+    """(confidence, imgsz) per image, with adaptive full-resolution re-runs"""
+    if not YOLO_ADAPTIVE:
+        return [(conf, YOLO_FULL_IMGSZ) for conf in yolo_max_confidences(img_arrays, YOLO_FULL_IMGSZ)]
+
+    outcomes = [(conf, YOLO_FAST_IMGSZ) for conf in yolo_max_confidences(img_arrays, YOLO_FAST_IMGSZ)]
+    borderline = [i for i, (conf, _) in enumerate(outcomes) if YOLO_BORDERLINE_LOW <= conf <= YOLO_BORDERLINE_HIGH]
+    if borderline:
+        rerun = yolo_max_confidences([img_arrays[i] for i in borderline], YOLO_FULL_IMGSZ)
+        for i, conf in zip(borderline, rerun):
+            outcomes[i] = (conf, YOLO_FULL_IMGSZ)
+        with yolo_stats_lock:
+            yolo_stats["full_resolution_reruns"] += len(borderline)
+    return outcomes
+
+@metrics.timed(STAGE_SECONDS, stage="dustbin")
+def detect_dustbin_batch(features_list):
+    """Dustbin detection for many images: one batched YOLO pass, CLIP fallback per image"""
+    results = [{
+        "dustbin_detected": False,
+        "confidence": 0.0,
+        "method": "none",
+        "details": {}
+    } for _ in features_list]
+
+    # Method 1: YOLO object detection (primary)
+    pending = list(range(len(features_list)))
+    if features_list and model_registry.get("yolo", MODEL_LOAD_TIMEOUT) is not None:
+        try:
+            outcomes = detect_dustbin_yolo_batch([np.array(f.pyramid.detect) for f in features_list])
+            pending = []
+            for i, (max_conf, imgsz) in enumerate(outcomes):
+                if max_conf > DUSTBIN_YOLO_THRESHOLD:
+                    results[i].update({
                         "dustbin_detected": True,
                         "confidence": max_conf,
                         "method": "yolo",
-                        "details": {"yolo_confidence": max_conf}
+                        "details": {"yolo_confidence": max_conf, "yolo_imgsz": imgsz}
                     })
-                    return results
-                    
-                results["details"]["yolo_confidence"] = max_conf
-                
-            except Exception as e:
-                print(f"YOLO detection error: {e}")
-                results["details"]["yolo_error"] = str(e)
-        
-        # Method 2: CLIP-based detection (fallback)
+                else:
+                    results[i]["details"].update({"yolo_confidence": max_conf, "yolo_imgsz": imgsz})
+                    pending.append(i)
+        except Exception as e:
+            print(f"YOLO detection error: {e}")
+            for result in results:
+                result["details"]["yolo_error"] = str(e)
+
+    # Method 2: CLIP-based detection (fallback), reusing the shared embeddings
+    for i in pending:
         try:
-            # Get image embedding
-            image_inputs = clip_processor(images=pil_image, return_tensors="pt")
-            with torch.no_grad():
-                image_features = clip_model.get_image_features(**image_inputs)
-                image_features = image_features / image_features.norm(p=2)
-            
-            # Compare with dustbin text embeddings
-            similarities = torch.nn.functional.cosine_similarity(
-                image_features.unsqueeze(1), DUSTBIN_TEXT_EMBEDDINGS.unsqueeze(0), dim=2
-            ).squeeze()
-            
+            similarities = features_list[i].text_similarities(text_embeddings("dustbin"))
             max_similarity = torch.max(similarities).item()
-            best_match_idx = torch.argmax(similarities).item()
-            
+            best_match = DUSTBIN_CLASSES[torch.argmax(similarities).item()]
+
+            results[i]["details"].update({
+                "clip_confidence": max_similarity,
+                "best_match": best_match
+            })
             # Threshold for dustbin detection
-            if max_similarity > 0.25:  # Adjust threshold as needed
-                results.update({
+            if max_similarity > DUSTBIN_CLIP_THRESHOLD:
+                results[i].update({
                     "dustbin_detected": True,
                     "confidence": max_similarity,
-                    "method": "clip",
-                    "details": {
-                        "clip_confidence": max_similarity,
-                        "best_match": DUSTBIN_CLASSES[best_match_idx]
-                    }
+                    "method": "clip"
                 })
-                return results
-            
-            results["details"].update({
-                "clip_confidence": max_similarity,
-                "best_match": DUSTBIN_CLASSES[best_match_idx]
-            })
-            
         except Exception as e:
             print(f"CLIP dustbin detection error: {e}")
-            results["details"]["clip_error"] = str(e)
-        
-        return results
-        
+            results[i]["details"]["clip_error"] = str(e)
+
+    return results
+
+def detect_dustbin_fast(pil_image, features=None):
+    """Optimized dustbin detection using YOLO + CLIP"""
+    try:
+        if features is None:
+            features = ImageFeatures(pil_image)
+        return detect_dustbin_batch([features])[0]
     except Exception as e:
         return {
             "dustbin_detected": False,
@@ -229,40 +416,362 @@ def detect_dustbin_fast(pil_image):
         }
 
 # ==================== OPTIMIZED AI DETECTION ====================
-# ...existing code for analyze_statistical_properties_fast, analyze_frequency_domain_fast, clip_based_ai_detection_fast, detect_ai_generated_fast...
+
+AI_ANALYSIS_SIZE = 256
+AI_CLIP_WEIGHT = 0.6
+AI_STATISTICAL_WEIGHT = 0.2
+AI_FREQUENCY_WEIGHT = 0.2
+CLIP_LOGIT_SCALE = 100.0
+
+# Distance of every FFT bin from the (shifted) spectrum centre
+_fft_axis = np.arange(AI_ANALYSIS_SIZE) - AI_ANALYSIS_SIZE // 2
+FFT_RADIUS = np.sqrt(_fft_axis[:, None] ** 2 + _fft_axis[None, :] ** 2)
+FFT_HIGH_FREQ_MASK = FFT_RADIUS > AI_ANALYSIS_SIZE // 4
+
+# Histogram bin of each 8-bit gray level, exactly as np.histogram(bins=64,
+# range=(0, 1)) assigns level / 255, so batch histograms are one bincount
+_gray_levels = np.arange(256, dtype=np.float32) / 255.0
+AI_HIST_BINS = 64
+HIST_BIN_OF_LEVEL = np.array([
+    np.histogram(_gray_levels[level:level + 1], bins=AI_HIST_BINS, range=(0.0, 1.0))[0].argmax()
+    for level in range(256)
+])
+
+def analysis_levels_batch(pil_images):
+    """(N, size, size) uint8 grayscale levels used by the statistical and FFT checks"""
+    return np.stack([
+        np.asarray(pil_image.convert("L").resize((AI_ANALYSIS_SIZE, AI_ANALYSIS_SIZE)), dtype=np.uint8)
+        for pil_image in pil_images
+    ])
+
+def to_analysis_gray(pil_image):
+    """Downsampled grayscale float array used by the statistical and FFT checks"""
+    return analysis_levels_batch([pil_image])[0].astype(np.float32) / 255.0
+
+def analyze_statistical_properties_batch(levels):
+    """Sensor-noise and histogram statistics for (N, size, size) uint8 levels; renders tend to be over-smooth"""
+    size = AI_ANALYSIS_SIZE
+    count = len(levels)
+
+    # High-pass residual: image minus its 3x3 box blur. Per image, like the FFT
+    # check: the stacked blur temporaries fall out of cache and ran slower.
+    # float64 from here on, as the per-image scores were computed on Python floats
+    noise_std = np.empty(count, dtype=np.float64)
+    for i, image in enumerate(levels):
+        gray = image.astype(np.float32) / 255.0
+        padded = np.pad(gray, 1, mode="edge")
+        blurred = sum(padded[dy:dy + size, dx:dx + size] for dy in range(3) for dx in range(3)) / 9.0
+        noise_std[i] = np.std(gray - blurred)
+
+    bins = HIST_BIN_OF_LEVEL[levels.reshape(count, -1)] + AI_HIST_BINS * np.arange(count)[:, None]
+    hists = np.bincount(bins.ravel(), minlength=AI_HIST_BINS * count).reshape(count, AI_HIST_BINS) / (size * size)
+    # Summed over non-empty bins only, like the per-image reduction always was
+    entropy = np.array([-np.sum(hist[hist > 0] * np.log2(hist[hist > 0])) for hist in hists])
+
+    noise_score = np.clip((0.02 - noise_std) / 0.02, 0.0, 1.0)
+    entropy_score = np.clip((4.5 - entropy) / 4.5, 0.0, 1.0)
+    return [
+        {
+            "score": 0.7 * float(noise_score[i]) + 0.3 * float(entropy_score[i]),
+            "noise_std": float(noise_std[i]),
+            "histogram_entropy": float(entropy[i])
+        }
+        for i in range(count)
+    ]
+
+def analyze_frequency_domain_batch(levels):
+    """Share of spectral energy at high frequencies for (N, size, size) uint8 levels; low for generated images"""
+    gray = levels.astype(np.float32) / 255.0
+    centered = gray - gray.mean(axis=(1, 2), keepdims=True)
+    # One image at a time from here: a stacked (N, 256, 256) complex spectrum
+    # falls out of cache and measured ~1.5x slower than per-image transforms
+    high_freq_ratio = np.empty(len(levels), dtype=np.float64)
+    for i, image in enumerate(centered):
+        spectrum = np.abs(np.fft.fftshift(np.fft.fft2(image)))
+        high_freq_ratio[i] = spectrum[FFT_HIGH_FREQ_MASK].sum() / (spectrum.sum() + 1e-8)
+    scores = np.clip((0.40 - high_freq_ratio) / 0.20, 0.0, 1.0)
+    return [
+        {"score": float(score), "high_freq_ratio": float(ratio)}
+        for score, ratio in zip(scores, high_freq_ratio)
+    ]
+
+def analyze_statistical_properties_fast(pil_image):
+    """Sensor-noise and histogram statistics; renders tend to be over-smooth"""
+    return analyze_statistical_properties_batch(analysis_levels_batch([pil_image]))[0]
+
+def analyze_frequency_domain_fast(pil_image):
+    """Share of spectral energy at high frequencies; low for generated images"""
+    return analyze_frequency_domain_batch(analysis_levels_batch([pil_image]))[0]
+
+def clip_based_ai_detection_batch(image_features):
+    """Score (N, 512) normalized CLIP embeddings against the precomputed AI/real prompts in one matmul"""
+    similarities = image_features @ text_embeddings("ai").T
+    ai_similarity = similarities[:, :len(AI_PROMPTS)].mean(dim=1)
+    real_similarity = similarities[:, len(AI_PROMPTS):].mean(dim=1)
+    probs = torch.softmax(torch.stack([ai_similarity, real_similarity], dim=1) * CLIP_LOGIT_SCALE, dim=1)
+    return [
+        {"score": score, "ai_similarity": ai, "real_similarity": real}
+        for score, ai, real in zip(probs[:, 0].tolist(), ai_similarity.tolist(), real_similarity.tolist())
+    ]
+
+def clip_based_ai_detection_fast(image_features):
+    """Score a normalized CLIP embedding against the precomputed AI/real prompts"""
+    return clip_based_ai_detection_batch(image_features)[0]
+
+def ai_detection_error(e):
+    print(f"AI detection error: {e}")
+    return {
+        "is_ai_generated": False,
+        "confidence": 0.0,
+        "error": str(e)
+    }
+
+@metrics.timed(STAGE_SECONDS, stage="ai_detection")
+def detect_ai_generated_batch(features_list):
+    """Combined statistical, frequency-domain and CLIP AI-generation check for a batch of ImageFeatures.
+
+    One vectorized pass over the stacked grayscale levels and one matmul for
+    the CLIP scores; the single-image check is this with N=1. If the batch
+    fails, each image is retried alone so one bad image can't fail the rest.
+    """
+    if not features_list:
+        return []
+    try:
+        BATCH_SIZE.observe(len(features_list), model="ai_detection")
+        levels = analysis_levels_batch([features.pyramid.analysis_gray for features in features_list])
+        statistical = analyze_statistical_properties_batch(levels)
+        frequency = analyze_frequency_domain_batch(levels)
+        clip_results = clip_based_ai_detection_batch(torch.cat([features.embedding for features in features_list]))
+    except Exception as e:
+        if len(features_list) == 1:
+            return [ai_detection_error(e)]
+        return [detect_ai_generated_batch([features])[0] for features in features_list]
+
+    results = []
+    for clip_result, statistical_result, frequency_result in zip(clip_results, statistical, frequency):
+        confidence = (
+            AI_CLIP_WEIGHT * clip_result["score"]
+            + AI_STATISTICAL_WEIGHT * statistical_result["score"]
+            + AI_FREQUENCY_WEIGHT * frequency_result["score"]
+        )
+        results.append({
+            "is_ai_generated": confidence > 0.5,
+            "confidence": confidence,
+            "details": {
+                "clip": clip_result,
+                "statistical": statistical_result,
+                "frequency": frequency_result
+            }
+        })
+    return results
+
+def detect_ai_generated_fast(pil_image, features=None):
+    """Combined statistical, frequency-domain and CLIP AI-generation check"""
+    try:
+        if features is None:
+            features = ImageFeatures(pil_image)
+        return detect_ai_generated_batch([features])[0]
+    except Exception as e:
+        return ai_detection_error(e)
+
+# ==================== VERIFICATION RESULT CACHE ====================
+
+# Bump whenever models or thresholds change so stale verdicts are never served
+VERIFICATION_VERSION = "v1:" + hashlib.sha256(repr((
+    CLIP_MODEL_NAME, CLIP_ENGINE, "yolov8n.pt",
+    AI_CLIP_WEIGHT, AI_STATISTICAL_WEIGHT, AI_FREQUENCY_WEIGHT, AI_ANALYSIS_SIZE,
+    DUSTBIN_YOLO_THRESHOLD, DUSTBIN_CLIP_THRESHOLD,
+    YOLO_ADAPTIVE, YOLO_FAST_IMGSZ, YOLO_BORDERLINE_LOW, YOLO_BORDERLINE_HIGH
+)).encode()).hexdigest()[:12]
+
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "2048"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "3600"))
+result_cache = ResultCache(max_entries=RESULT_CACHE_MAX_ENTRIES, ttl_seconds=RESULT_CACHE_TTL_SECONDS)
+
+def is_cacheable_result(result):
+    """Don't cache detector failures, so a retry gets a fresh attempt"""
+    return "error" not in result
 
 # ==================== OPTIMIZED DUPLICATE DETECTION ====================
-# ...existing code for is_duplicate_fast...
+
+PHASH_DUPLICATE_THRESHOLD = int(os.getenv("PHASH_DUPLICATE_THRESHOLD", "5"))
+CLIP_DUPLICATE_THRESHOLD = float(os.getenv("CLIP_DUPLICATE_THRESHOLD", "0.93"))
+DUPLICATE_INDEX_MAX_USERS = int(os.getenv("DUPLICATE_INDEX_MAX_USERS", "2048"))
+
+# Top resident users up from MongoDB on every check; needed when several
+# processes write (pre-fork serving), where one worker's saves are invisible
+# to the other workers' in-memory indexes
+DUPLICATE_INDEX_SYNC = os.getenv("DUPLICATE_INDEX_SYNC", "false").lower() == "true"
+# Re-read this far behind the newest held document: created_at is stamped before
+# the insert commits, and ids already held are skipped anyway
+DUPLICATE_SYNC_OVERLAP = timedelta(seconds=5)
+
+def load_user_duplicate_records(user_id, since=None):
+    """Stream every active image of a user for the duplicate index (raises on DB errors)"""
+    query = {"user_id": user_id, "status": "active"}
+    if since is not None:
+        query["created_at"] = {"$gte": since - DUPLICATE_SYNC_OVERLAP}
+    # Snapshot the write-behind buffer first: a record flushed meanwhile is then
+    # in the query result instead (doc ids already held are skipped)
+    pending = image_writer.pending(user_id)
+    cursor = user_images_collection.find(
+        query,
+        {"phash": 1, "image_url": 1, "created_at": 1, **EMBEDDING_FIELDS}
+    )
+    return itertools.chain(pending, cursor)
+
+# Per-user embedding matrix + packed pHashes, LRU-evicted by user
+duplicate_index = DuplicateIndexCache(
+    load_user_duplicate_records,
+    max_users=DUPLICATE_INDEX_MAX_USERS,
+    phash_threshold=PHASH_DUPLICATE_THRESHOLD,
+    clip_threshold=CLIP_DUPLICATE_THRESHOLD,
+    refresher=load_user_duplicate_records if DUPLICATE_INDEX_SYNC else None
+)
+
+@metrics.timed(STAGE_SECONDS, stage="duplicate_check")
+def is_duplicate_fast(user_id, phash, embedding):
+    """Vectorized duplicate check against all of a user's approved images.
+
+    Returns (is_duplicate, method, score, matched_image_url).
+    """
+    return duplicate_index.check(user_id, embedding, phash)
+
+# Cross-user ANN index, memory-mapped and shared by all worker processes.
+# CROSS_USER_CHECK_ENABLED=true rejects any submission within the duplicate
+# thresholds of another user's image ("cross_user_duplicate"). Off by
+# default: that is a policy change, and across a whole corpus a pHash
+# distance <= 5 also matches unrelated photos. While it is off, saves don't
+# touch the index at all. To turn it on, run `python ann_index.py rebuild`
+# first (the pHash index reloads itself from Mongo at startup), and schedule
+# the rebuild from then on: saves append to a delta log that every query
+# scans exactly, and past ANN_DELTA_WARN_RECORDS a warning is logged.
+CROSS_USER_CHECK_ENABLED = os.getenv("CROSS_USER_CHECK_ENABLED", "false").lower() == "true"
+ANN_INDEX_DIR = os.getenv("ANN_INDEX_DIR", DEFAULT_INDEX_DIR)
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+ANN_DELTA_WARN_RECORDS = int(os.getenv("ANN_DELTA_WARN_RECORDS", str(DEFAULT_DELTA_WARN_RECORDS)))
+ann_index = IVFIndex(ANN_INDEX_DIR, nprobe=ANN_NPROBE, delta_warn_records=ANN_DELTA_WARN_RECORDS)
+if CROSS_USER_CHECK_ENABLED and ann_index.stats()["version"] is None:
+    print(f"Warning: cross-user check is on but {ANN_INDEX_DIR} has no index; "
+          f"run 'python ann_index.py rebuild' or earlier images are never matched by CLIP")
+
+# Corpus-wide pHash index, bulk-loaded in the background at startup
+phash_index = PHashIndex()
+
+def bulk_load_phash_index():
+    try:
+        started = time.time()
+        count = load_phash_index(phash_index, user_images_collection)
+        print(f"pHash index loaded: {count} hashes in {time.time() - started:.1f}s")
+    except Exception as e:
+        print(f"pHash index load error: {e}")
+
+if CROSS_USER_CHECK_ENABLED:
+    threading.Thread(target=bulk_load_phash_index, name="phash-index-load", daemon=True).start()
+
+@metrics.timed(STAGE_SECONDS, stage="cross_user_check")
+def find_cross_user_duplicate(user_id, phash, embedding):
+    """Closest duplicate among other users' images as {method, score, doc_id}, or None"""
+    if not CROSS_USER_CHECK_ENABLED:
+        return None
+    try:
+        hits = phash_index.search(phash, PHASH_DUPLICATE_THRESHOLD, exclude_user=user_id, limit=1) if phash is not None else []
+        if hits:
+            return {
+                "method": "phash",
+                "score": 1.0 - hits[0]["distance"] / 64,
+                "doc_id": hits[0]["doc_id"]
+            }
+        if embedding is None:
+            return None
+        hits = ann_index.search(np.asarray(embedding, dtype=np.float32), k=1, exclude_user=user_id)
+        if hits and hits[0]["score"] > CLIP_DUPLICATE_THRESHOLD:
+            return {"method": "clip_ann", "score": hits[0]["score"], "doc_id": hits[0]["doc_id"]}
+    except Exception as e:
+        print(f"Cross-user search error: {e}")
+    return None
 
 # ==================== OPTIMIZED DATABASE OPERATIONS ====================
 
+# "list" (BSON array, default), "float16" or "int8" (compact BSON Binary)
+EMBEDDING_STORAGE_FORMAT = os.getenv("EMBEDDING_STORAGE_FORMAT", "list")
+if EMBEDDING_STORAGE_FORMAT not in EMBEDDING_FORMATS:
+    raise RuntimeError(f"EMBEDDING_STORAGE_FORMAT must be one of {EMBEDDING_FORMATS}")
+
+# "sync" inserts before a save returns; "buffered" queues approved records and
+# flushes them with insert_many every IMAGE_WRITE_FLUSH_MS or IMAGE_WRITE_BATCH
+# records (faster responses, but a crash loses the unflushed buffer). Records
+# are indexed for duplicate checks as soon as they are saved or queued.
+IMAGE_WRITE_MODE = os.getenv("IMAGE_WRITE_MODE", "sync")
+if IMAGE_WRITE_MODE not in WRITE_MODES:
+    raise RuntimeError(f"IMAGE_WRITE_MODE must be one of {WRITE_MODES}")
+IMAGE_WRITE_BATCH = int(os.getenv("IMAGE_WRITE_BATCH", "64"))
+IMAGE_WRITE_FLUSH_MS = float(os.getenv("IMAGE_WRITE_FLUSH_MS", "200"))
+
+image_writer = ImageWriter(
+    lambda: user_images_collection, mode=IMAGE_WRITE_MODE,
+    max_batch=IMAGE_WRITE_BATCH, flush_interval=IMAGE_WRITE_FLUSH_MS / 1000
+)
+
+def build_image_doc(user_id, image_url, mission_id, phash, clip_embedding, ai_result=None, dustbin_result=None):
+    """Approved image record, with its id assigned up front"""
+    return {
+        "_id": ObjectId(),
+        "user_id": user_id,
+        "image_url": image_url,
+        "mission_id": mission_id,
+        "phash": phash,
+        **encode_embedding(clip_embedding, EMBEDDING_STORAGE_FORMAT),
+        "ai_detection": ai_result,
+        "dustbin_detection": dustbin_result,  # New field
+        "created_at": datetime.utcnow(),
+        "status": "active"
+    }
+
+def index_image_doc(doc, clip_embedding):
+    """Make a saved (or queued) image visible to the per-user and cross-user duplicate checks"""
+    duplicate_index.add(doc["user_id"], clip_embedding, doc["phash"], doc["image_url"], doc["_id"], doc["created_at"])
+    if not CROSS_USER_CHECK_ENABLED:
+        return
+    phash_index.add(doc["phash"], doc["_id"], doc["user_id"])
+    try:
+        ann_index.add(doc["_id"], doc["user_id"], np.asarray(clip_embedding, dtype=np.float32))
+    except Exception as e:
+        print(f"ANN index insert error: {e}")
+
+@metrics.timed(STAGE_SECONDS, stage="mongo_save")
 def save_user_image_fast(user_id, image_url, mission_id, phash, clip_embedding, ai_result=None, dustbin_result=None):
     """Optimized database save with dustbin info"""
     try:
-        doc = {
-            "user_id": user_id,
-            "image_url": image_url,
-            "mission_id": mission_id,
-            "phash": phash,
-            "clip_embedding": clip_embedding.squeeze().tolist() if hasattr(clip_embedding, 'squeeze') else clip_embedding,
-            "ai_detection": ai_result,
-            "dustbin_detection": dustbin_result,  # New field
-            "created_at": datetime.utcnow(),
-            "status": "active"
-        }
-        
-        result = user_images_collection.insert_one(doc)
-        return str(result.inserted_id)
+        doc = build_image_doc(user_id, image_url, mission_id, phash, clip_embedding, ai_result, dustbin_result)
+        image_writer.write(doc)
+        index_image_doc(doc, clip_embedding)
+        return str(doc["_id"])
     except Exception as e:
         print(f"Database save error: {str(e)}")
         raise
 
+@metrics.timed(STAGE_SECONDS, stage="mongo_save_batch")
+def save_user_images_batch(entries):
+    """Save [(doc, clip_embedding)] in one insert_many; returns {position: error} for failed records"""
+    docs = [doc for doc, _ in entries]
+    try:
+        errors = image_writer.write_many(docs)
+    except Exception as e:
+        print(f"Database batch save error: {str(e)}")
+        errors = {i: str(e) for i in range(len(docs))}
+    for i, (doc, clip_embedding) in enumerate(entries):
+        if i not in errors:
+            index_image_doc(doc, clip_embedding)
+    return errors
+
+@metrics.timed(STAGE_SECONDS, stage="mongo_query")
 def get_user_images_fast(user_id, limit=100):
     """Optimized user image retrieval"""
     try:
         cursor = user_images_collection.find(
             {"user_id": user_id, "status": "active"},
-            {"phash": 1, "clip_embedding": 1, "image_url": 1, "created_at": 1}
+            {"phash": 1, "image_url": 1, "created_at": 1, **EMBEDDING_FIELDS}
         ).sort("created_at", -1).limit(limit)
         return list(cursor)
     except Exception as e:
@@ -270,10 +779,397 @@ def get_user_images_fast(user_id, limit=100):
         return []
 
 # ==================== OPTIMIZED FACE VERIFICATION ====================
-# ...existing code for verify_faces_fast...
+
+FACE_PROFILE_CACHE_MAX_USERS = int(os.getenv("FACE_PROFILE_CACHE_MAX_USERS", "1024"))
+# Profile URLs seen again within this window are not re-downloaded
+FACE_PROFILE_SOURCE_TTL_SECONDS = float(os.getenv("FACE_PROFILE_SOURCE_TTL_SECONDS", "600"))
+FACE_DISTANCE_THRESHOLD = float(os.getenv("FACE_DISTANCE_THRESHOLD", str(FACE_DISTANCE_THRESHOLD)))
+
+face_verifier = FaceVerifier(
+    read_bytes=read_image_bytes,
+    decode=decode_image,
+    max_users=FACE_PROFILE_CACHE_MAX_USERS,
+    source_ttl=FACE_PROFILE_SOURCE_TTL_SECONDS,
+    threshold=FACE_DISTANCE_THRESHOLD,
+    run_model=functools.partial(run_inference, "face")
+)
+
+@metrics.timed(STAGE_SECONDS, stage="face_verify")
+def verify_faces_fast(pil_image, profile_embedding):
+    """
+    Fast face verification using DeepFace embeddings, entirely in memory.
+    Returns a dict with 'verified' key.
+    """
+    try:
+        model_registry.get("face", MODEL_LOAD_TIMEOUT)
+        return face_verifier.verify(pil_image, profile_embedding)
+    except Exception as e:
+        print(f"DeepFace verification error: {e}")
+        return {"verified": False, "error": str(e)}
+
+@metrics.timed(STAGE_SECONDS, stage="face_profile")
+def load_profile_embedding(user_id, source):
+    """Cached profile face embedding, once the face model is warm"""
+    model_registry.get("face", MODEL_LOAD_TIMEOUT)
+    return face_verifier.profile_embedding(user_id, source)
+
+# ==================== MODEL LOADING ====================
+
+def clip_text_cache_key():
+    """Everything the prompt embeddings depend on besides the prompts"""
+    key = {"model": CLIP_MODEL_NAME, "revision": model_revision(CLIP_MODEL_NAME), "engine": CLIP_ENGINE}
+    if CLIP_ENGINE != "torch":
+        graph = "text_int8.onnx" if CLIP_ENGINE == "onnx-int8" else "text.onnx"
+        key["graph"] = file_fingerprint(os.path.join(CLIP_ONNX_DIR, graph))
+    return key
+
+def compute_text_embeddings(prompts):
+    """Normalized CLIP text embeddings (runs the text tower)"""
+    clip_engine, clip_processor = model_registry.get("clip", MODEL_LOAD_TIMEOUT)
+    inputs = clip_processor(text=prompts, return_tensors="pt", padding=True)
+    with torch.no_grad():
+        embeddings = clip_engine.text_features(inputs["input_ids"], inputs["attention_mask"])
+        embeddings = embeddings / embeddings.norm(p=2, dim=-1, keepdim=True)
+    return embeddings.numpy()
+
+def load_text_embeddings():
+    key = clip_text_cache_key()
+    return {
+        group: torch.from_numpy(text_embedding_cache.load_or_compute(key, prompts, compute_text_embeddings))
+        for group, prompts in (("ai", AI_PROMPTS + REAL_PROMPTS), ("dustbin", DUSTBIN_CLASSES))
+    }
+
+def text_embeddings(group):
+    """Pre-normalized prompt embeddings: "ai" (AI_PROMPTS + REAL_PROMPTS) or "dustbin" """
+    return model_registry.get("text_embeddings", MODEL_LOAD_TIMEOUT)[group]
+
+def load_clip():
+    # ONNX Runtime sizes its own intra-op pool: give it the CLIP partition's threads
+    engine = load_clip_engine(
+        CLIP_ENGINE, CLIP_MODEL_NAME, CLIP_ONNX_DIR,
+        intra_op_threads=inference_scheduler.partitions["clip"]["threads"]
+    )
+    return engine, CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+
+def warm_up_clip(clip):
+    clip_engine, clip_processor = clip
+    inputs = clip_processor(images=[Image.new("RGB", (224, 224))], return_tensors="pt")
+    clip_engine.image_features(inputs["pixel_values"])
+
+def warm_up_yolo(yolo_model):
+    blank = np.zeros((YOLO_FULL_IMGSZ, YOLO_FULL_IMGSZ, 3), dtype=np.uint8)
+    for imgsz in {YOLO_FAST_IMGSZ, YOLO_FULL_IMGSZ} if YOLO_ADAPTIVE else {YOLO_FULL_IMGSZ}:
+        yolo_model([blank], imgsz=imgsz, verbose=False)
+
+def load_face_model():
+    # DeepFace builds and caches the model on first use; one inference loads and warms it
+    face_verifier.embed(Image.new("RGB", (224, 224)))
+    return face_verifier
+
+# Text embeddings first: a disk hit makes them ready without the text tower
+model_registry.register("text_embeddings", load_text_embeddings)
+model_registry.register("clip", load_clip, warm_up_clip)
+model_registry.register("yolo", lambda: YOLO('yolov8n.pt'), warm_up_yolo, required=False)  # Using nano version for speed
+model_registry.register("face", load_face_model)
+
+print(f"Loading models ({MODEL_LOADING}, CLIP engine: {CLIP_ENGINE})...")
+model_registry.start(background=MODEL_LOADING != "eager", skip=MODEL_WORKER_ONLY)
+
+# ==================== PRE-FORK SERVING ====================
+# gunicorn.conf.py preloads this module in the master, calls prepare_for_fork()
+# once, then reinit_after_fork() in every worker. Model weights, text embeddings
+# and the pHash index are inherited copy-on-write; threads, thread pools and
+# sockets don't survive fork() and are rebuilt per worker.
+
+PHASH_PRELOAD_TIMEOUT = float(os.getenv("PHASH_PRELOAD_TIMEOUT", "600"))
+
+def prepare_for_fork():
+    """Finish parent-side loading so every worker inherits it, then freeze the heap"""
+    for name in model_registry.status():
+        if name not in MODEL_WORKER_ONLY:
+            model_registry.get(name, MODEL_LOAD_TIMEOUT)
+    if CROSS_USER_CHECK_ENABLED and not phash_index.ready.wait(PHASH_PRELOAD_TIMEOUT):
+        print("Warning: pHash index still loading at fork; workers start with a partial index")
+    # Keep the collector from writing to (and so un-sharing) inherited objects
+    gc.collect()
+    gc.freeze()
+
+def reinit_after_fork():
+    """Rebuild per-process state in a freshly forked worker"""
+    global client, db, user_images_collection, image_fetcher, executor, batch_stream_executor, inference_scheduler
+    client = connect_mongo()
+    db = client['bingo_app']
+    user_images_collection = db['user_images']
+    image_fetcher = build_image_fetcher()
+    executor = CountingThreadPoolExecutor(max_workers=STAGE_EXECUTOR_WORKERS, thread_name_prefix="stage")
+    batch_stream_executor = ThreadPoolExecutor(max_workers=BATCH_STREAM_WORKERS, thread_name_prefix="batch-stream")
+    # Re-read the CPU budget post_fork gave this worker
+    inference_scheduler = build_inference_scheduler()
+    if CLIP_ENGINE != "torch":
+        # ONNX Runtime sessions own thread pools that don't survive fork()
+        model_registry.reset("clip")
+    model_registry.start(background=True)
+    start_job_workers()
+
+# ==================== VERIFICATION CASCADE ====================
+# Checks run cheapest / most selective first and stop at the first rejection:
+#   phash_duplicate  pHash (32x32 DCT) against the user's images and the corpus
+#   ai               CLIP forward pass + statistical / FFT analysis
+#   clip_duplicate   embedding against the user's images and the ANN index
+#   dustbin          YOLO (+ CLIP fallback)
+#   face             DeepFace embedding vs the cached profile embedding
+# With CASCADE_OVERLAP_DUSTBIN, YOLO starts on the shared executor alongside the
+# CLIP stages (it's the long pole); an earlier rejection cancels it if it hasn't
+# started yet, otherwise its result is discarded and counted as wasted.
+
+CASCADE_STAGES = ("phash_duplicate", "ai", "clip_duplicate", "dustbin", "face")
+CASCADE_OVERLAP_DUSTBIN = os.getenv("CASCADE_OVERLAP_DUSTBIN", "true").lower() == "true"
+AI_REJECT_CONFIDENCE = 0.7
+
+cascade_stats_lock = threading.Lock()
+cascade_stats = {
+    "requests": 0,
+    "approved": 0,
+    "rejected_by": {stage: 0 for stage in CASCADE_STAGES},
+    "skipped": {stage: 0 for stage in CASCADE_STAGES},
+    "wasted": {stage: 0 for stage in CASCADE_STAGES},
+}
+
+def record_cascade(rejected_by=None, skipped=(), wasted=()):
+    with cascade_stats_lock:
+        cascade_stats["requests"] += 1
+        if rejected_by is None:
+            cascade_stats["approved"] += 1
+        else:
+            cascade_stats["rejected_by"][rejected_by] += 1
+        for stage in skipped:
+            cascade_stats["skipped"][stage] += 1
+        for stage in wasted:
+            cascade_stats["wasted"][stage] += 1
+
+def cascade_snapshot():
+    with cascade_stats_lock:
+        return {key: dict(value) if isinstance(value, dict) else value for key, value in cascade_stats.items()}
+
+def duplicate_rejection(user_id, phash, embedding):
+    """Rejection payload for a per-user or cross-user duplicate, or None"""
+    is_dup, method, score, matched_image = is_duplicate_fast(user_id, phash, embedding)
+    if is_dup:
+        return {
+            "reason": "duplicate",
+            "duplicate": True,
+            "method": method,
+            "score": score,
+            "matched_image": matched_image
+        }
+    # Same photo submitted from another account
+    cross_match = find_cross_user_duplicate(user_id, phash, embedding)
+    if cross_match:
+        return {
+            "reason": "cross_user_duplicate",
+            "duplicate": True,
+            "method": cross_match["method"],
+            "score": cross_match["score"],
+            "matched_image_id": cross_match["doc_id"]
+        }
+    return None
+
+def run_verification_cascade(user_id, features, profile_future=None):
+    """Run the checks in cost order.
+
+    Returns (rejection, results): ``rejection`` is the rejection payload or
+    None when every check passed; ``results`` holds whatever was computed
+    (phash, embedding, ai_result, dustbin_result, face_result).
+    """
+    stages = [stage for stage in CASCADE_STAGES if stage != "face" or profile_future is not None]
+    results = {"phash": None, "embedding": None, "ai_result": None, "dustbin_result": None, "face_result": None}
+    dustbin_future = None
+
+    def reject(stage, payload):
+        remaining = stages[stages.index(stage) + 1:]
+        wasted = []
+        if dustbin_future is not None and "dustbin" in remaining and not dustbin_future.cancel():
+            wasted.append("dustbin")
+        if profile_future is not None:
+            profile_future.cancel()
+        record_cascade(stage, [s for s in remaining if s not in wasted], wasted)
+        REJECTIONS.inc(reason=payload["reason"])
+        return dict(payload, status="rejected"), results
+
+    # 1. pHash duplicates
+    results["phash"] = features.phash
+    rejection = duplicate_rejection(user_id, results["phash"], None)
+    if rejection:
+        return reject("phash_duplicate", rejection)
+
+    if CASCADE_OVERLAP_DUSTBIN:
+        dustbin_future = executor.submit(features.dustbin_result)
+
+    # 2. AI generation (runs the shared CLIP forward pass)
+    ai_result = results["ai_result"] = features.ai_result()
+    if ai_result["is_ai_generated"] and ai_result["confidence"] > AI_REJECT_CONFIDENCE:
+        return reject("ai", {
+            "reason": "ai_generated",
+            "ai_generated": True,
+            "ai_confidence": ai_result["confidence"]
+        })
+
+    # 3. Embedding duplicates
+    results["embedding"] = features.embedding
+    rejection = duplicate_rejection(user_id, None, results["embedding"])
+    if rejection:
+        return reject("clip_duplicate", rejection)
+
+    # 4. Dustbin
+    dustbin_result = results["dustbin_result"] = dustbin_future.result() if dustbin_future else features.dustbin_result()
+    if not dustbin_result["dustbin_detected"]:
+        return reject("dustbin", {
+            "reason": "no_dustbin_detected",
+            "dustbin_detected": False,
+            "dustbin_confidence": dustbin_result["confidence"],
+            "dustbin_method": dustbin_result["method"]
+        })
+
+    # 5. Face
+    if profile_future is not None:
+        try:
+            profile_embedding = profile_future.result()
+        except Exception as e:
+            # No face in the profile, face model unavailable, download error:
+            # a failed match, as when verify_faces_fast itself errors
+            print(f"Profile face embedding error: {e}")
+            face_result = {"verified": False, "error": str(e)}
+        else:
+            face_result = verify_faces_fast(features.image, profile_embedding)
+        results["face_result"] = face_result
+        if not face_result.get("verified", False):
+            return reject("face", {
+                "reason": "face_mismatch",
+                "face_verified": False,
+                "face_distance": face_result.get("distance")
+            })
+
+    record_cascade()
+    return None, results
+
+# ==================== METRICS ====================
+
+if METRICS_ENABLED:
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        started = getattr(g, "request_started", None)
+        if started is not None:
+            REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                    endpoint=request.endpoint or "unknown", status=response.status_code)
+        return response
+
+# Read at scrape time from the stats the components already keep
+metrics.callback("result_cache_requests_total", "Result cache lookups by outcome",
+                 lambda: {(key,): result_cache.stats()[key] for key in ("hits", "misses", "coalesced")},
+                 kind="counter", labelnames=("result",))
+metrics.callback("duplicate_index_requests_total", "Per-user duplicate index lookups by outcome",
+                 lambda: {(key,): duplicate_index.stats()[key] for key in ("hits", "misses")},
+                 kind="counter", labelnames=("result",))
+metrics.callback("face_profile_requests_total", "Profile face embedding lookups by outcome",
+                 lambda: {(key,): face_verifier.stats()[key] for key in ("source_hits", "content_hits", "misses")},
+                 kind="counter", labelnames=("result",))
+metrics.callback("clip_batcher_queue_depth", "Images waiting for the CLIP micro-batcher",
+                 lambda: clip_batcher.stats()["queue_depth"])
+metrics.callback("clip_batcher_batches_total", "CLIP micro-batches run", lambda: clip_batcher.stats()["batches"], kind="counter")
+metrics.callback("stage_executor_queue_depth", "Tasks waiting for the shared stage executor",
+                 lambda: executor.queue_depth())
+metrics.callback("image_cache_requests_total", "Image downloads by disk cache outcome",
+                 lambda: {(key,): image_fetcher.cache.stats()[key] for key in ("hits", "revalidated", "misses")}
+                 if image_fetcher.cache else {}, kind="counter", labelnames=("result",))
+metrics.callback("image_fetch_queue_depth", "Downloads waiting for a fetch worker", lambda: image_fetcher.queue_depth())
+metrics.callback("cascade_stage_skipped_total", "Cascade stages never run because an earlier check rejected",
+                 lambda: {(stage,): count for stage, count in cascade_snapshot()["skipped"].items()},
+                 kind="counter", labelnames=("stage",))
+metrics.callback("cascade_stage_wasted_total", "Speculative cascade stages whose result was discarded",
+                 lambda: {(stage,): count for stage, count in cascade_snapshot()["wasted"].items()},
+                 kind="counter", labelnames=("stage",))
+metrics.callback("ann_index_delta_records", "Cross-user ANN inserts since the last rebuild, scanned exactly per query",
+                 lambda: ann_index.stats()["delta_count"])
+metrics.callback("image_write_pending", "Approved image records waiting in the write-behind buffer",
+                 lambda: image_writer.stats()["pending"])
+metrics.callback("inference_queue_depth", "Model calls waiting for their CPU partition",
+                 lambda: {(model,): inference_scheduler.queue_depth(model) for model in inference_scheduler.partitions},
+                 labelnames=("model",))
+metrics.callback("inference_wait_seconds_total", "Time model calls spent queued for their CPU partition",
+                 lambda: {(model,): info["wait_seconds"] for model, info in inference_scheduler.stats()["models"].items()},
+                 kind="counter", labelnames=("model",))
+metrics.callback("yolo_full_resolution_reruns_total", "Adaptive YOLO re-runs at full resolution",
+                 lambda: yolo_stats["full_resolution_reruns"], kind="counter")
+metrics.callback("model_ready", "1 once the model is loaded and warmed up",
+                 lambda: {(name,): int(info["state"] == "ready") for name, info in model_registry.status().items()},
+                 labelnames=("model",))
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus scrape endpoint (per process)"""
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return app.response_class(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 # ==================== MAIN API ENDPOINTS ====================
 
+def verify_submission(user_id, image_source, profile_source=None, mission_id="unknown", image_url=None):
+    """Run the full verification and save an approved image; returns the response payload"""
+    start_time = time.time()
+
+    # Profile embedding (usually cached) overlaps with the submission download
+    profile_future = image_fetcher.submit(load_profile_embedding, user_id, profile_source) if profile_source else None
+    features = load_image_features(image_source)
+
+    print(f"Processing for user: {user_id}")
+
+    # Cost-ordered checks, stopping at the first rejection; all stages share one
+    # CLIP forward pass and identical bytes (client retries) reuse cached results
+    rejection, results = run_verification_cascade(user_id, features, profile_future)
+    if rejection:
+        rejection["processing_time"] = time.time() - start_time
+        return rejection
+
+    current_phash = results["phash"]
+    current_embedding = results["embedding"]
+    ai_result = results["ai_result"]
+    dustbin_result = results["dustbin_result"]
+    face_result = results["face_result"]
+
+    # Save approved image
+    try:
+        image_url_to_save = image_url or f"uploaded_{uuid.uuid4().hex}"
+        saved_id = save_user_image_fast(
+            user_id, image_url_to_save, mission_id, 
+            current_phash, current_embedding, ai_result, dustbin_result
+        )
+        
+        return {
+            "status": "approved",
+            "message": "All checks passed",
+            "saved_id": saved_id,
+            "ai_generated": ai_result["is_ai_generated"],
+            "ai_confidence": ai_result["confidence"],
+            "dustbin_detected": dustbin_result["dustbin_detected"],
+            "dustbin_confidence": dustbin_result["confidence"],
+            "dustbin_method": dustbin_result["method"],
+            "duplicate": False,
+            "face_verified": face_result.get("verified") if face_result else None,
+            "processing_time": time.time() - start_time
+        }
+        
+    except Exception as save_error:
+        return {
+            "status": "approved",
+            "message": "Checks passed but save failed",
+            "error": str(save_error),
+            "processing_time": time.time() - start_time
+        }
+
 @app.route("/comprehensive_check", methods=["POST"])
 def comprehensive_check():
     """Optimized comprehensive verification"""
@@ -291,8 +1187,7 @@ def comprehensive_check():
             if not image_url or not user_id:
                 return jsonify({"error": "Missing image_url or user_id"}), 400
             
-            current_img = load_image_fast(image_url)
-            profile_img = load_image_fast(profile_image_url) if profile_image_url else None
+            return jsonify(verify_submission(user_id, image_url, profile_image_url, mission_id, image_url))
         else:
             image_file = request.files.get("image")
             profile_file = request.files.get("profile_image")
@@ -302,130 +1197,136 @@ def comprehensive_check():
             if not image_file or not user_id:
                 return jsonify({"error": "Missing image file or user_id"}), 400
             
-            current_img = load_image_fast(image_file)
-            profile_img = load_image_fast(profile_file) if profile_file else None
+            return jsonify(verify_submission(user_id, image_file, profile_file, mission_id))
 
-        print(f"Processing for user: {user_id}")
+    except Exception as e:
+        print(f"Comprehensive check error: {str(e)}")
+        return jsonify({
+            "error": f"Internal server error: {str(e)}",
+            "processing_time": time.time() - start_time
+        }), 500
 
-        # Parallel processing of image features
-        with ThreadPoolExecutor(max_workers=4) as executor:  # Changed from 3 to 4
-            future_ai = executor.submit(detect_ai_generated_fast, current_img)
-            future_phash = executor.submit(lambda: str(imagehash.phash(current_img)))
-            future_clip = executor.submit(get_clip_embedding_fast, current_img)
-            future_dustbin = executor.submit(detect_dustbin_fast, current_img)  # New
-            
-            ai_result = future_ai.result()
-            current_phash = future_phash.result()
-            current_embedding = future_clip.result()
-            dustbin_result = future_dustbin.result()  # New
+# ==================== VERIFICATION JOBS ====================
+# POST /jobs queues a comprehensive check in a local SQLite database and returns
+# 202 at once; GET /jobs/<id> polls it, and an optional callback_url is POSTed
+# the final status. JOB_WORKERS threads per process claim up to JOB_CLAIM_BATCH
+# jobs at a time and run them concurrently (their CLIP passes coalesce in the
+# micro-batcher). Bursts grow the queue instead of tying up request threads;
+# jobs that hit a transient error (network, 5xx, timeout, models still loading)
+# are retried with backoff, anything else (4xx image URL, oversized or
+# undecodable image, bad payload) fails at once. Jobs of a crashed worker are
+# reclaimed once their lease expires (or failed, on attempt JOB_MAX_ATTEMPTS).
+# Pre-fork workers share the database file, so any worker can answer a poll.
+# Workers start with the server (__main__, gunicorn's post_fork, or the first
+# POST /jobs under another server), not on import, so tools that import this
+# module don't create the database or start polling.
 
-        # Early AI rejection (keep existing code)
-        if ai_result["is_ai_generated"] and ai_result["confidence"] > 0.7:
-            return jsonify({
-                "status": "rejected",
-                "reason": "ai_generated",
-                "ai_generated": True,
-                "ai_confidence": ai_result["confidence"],
-                "processing_time": time.time() - start_time
-            })
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", DEFAULT_JOB_DB_PATH)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_CLAIM_BATCH = int(os.getenv("JOB_CLAIM_BATCH", "4"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+JOB_CALLBACK_TIMEOUT = float(os.getenv("JOB_CALLBACK_TIMEOUT", "5"))
 
-        # Add dustbin check after AI check
-        if not dustbin_result["dustbin_detected"]:
-            return jsonify({
-                "status": "rejected",
-                "reason": "no_dustbin_detected",
-                "dustbin_detected": False,
-                "dustbin_confidence": dustbin_result["confidence"],
-                "dustbin_method": dustbin_result["method"],
-                "processing_time": time.time() - start_time
-            })
+JOB_QUEUE_WAIT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+JOBS_SUBMITTED = metrics.counter("jobs_submitted_total", "Verification jobs queued")
+JOBS_FINISHED = metrics.counter("jobs_finished_total", "Verification job attempts by outcome", ("outcome",))
+JOB_QUEUE_WAIT_SECONDS = metrics.histogram("job_queue_wait_seconds", "Time a job waited before a worker claimed it",
+                                           buckets=JOB_QUEUE_WAIT_BUCKETS)
+JOB_RUN_SECONDS = metrics.histogram("job_run_seconds", "Time to run one verification job")
 
-        # Optimized duplicate check
-        previous_images = get_user_images_fast(user_id)
-        
-        for prev_img in previous_images:
-            is_dup, method, score = is_duplicate_fast(
-                current_phash, prev_img.get("phash"),
-                current_embedding, prev_img.get("clip_embedding")
-            )
-            
-            if is_dup:
-                return jsonify({
-                    "status": "rejected",
-                    "reason": "duplicate",
-                    "duplicate": True,
-                    "method": method,
-                    "score": score,
-                    "matched_image": prev_img.get("image_url"),
-                    "processing_time": time.time() - start_time
-                })
+job_queue = JobQueue(JOB_DB_PATH, lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS)
 
-        # Face verification (if needed)
-        face_result = None
-        if profile_img:
-            temp_files = []
-            try:
-                temp1 = f"temp_current_{uuid.uuid4().hex}.jpg"
-                temp2 = f"temp_profile_{uuid.uuid4().hex}.jpg"
-                temp_files = [temp1, temp2]
-                
-                current_img.save(temp1)
-                profile_img.save(temp2)
-                
-                face_result = verify_faces_fast(temp1, temp2)
-                
-                if not face_result.get("verified", False):
-                    return jsonify({
-                        "status": "rejected",
-                        "reason": "face_mismatch",
-                        "face_verified": False,
-                        "processing_time": time.time() - start_time
-                    })
-                        
-            finally:
-                for temp_file in temp_files:
-                    if os.path.exists(temp_file):
-                        try:
-                            os.remove(temp_file)
-                        except:
-                            pass
-
-        # Save approved image
+def run_verification_job(payload):
+    return to_native(verify_submission(
+        payload["user_id"], payload["image_url"], payload.get("profile_image_url"),
+        payload.get("mission_id", "unknown"), payload["image_url"]
+    ))
+
+# Rate limiting and request timeouts are the only 4xx worth retrying
+RETRYABLE_HTTP_STATUSES = {408, 429}
+
+def is_retryable_job_error(error):
+    """Transport errors, timeouts, 5xx and models still loading; the rest would fail the same way again"""
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else None
+        return status is None or status >= 500 or status in RETRYABLE_HTTP_STATUSES
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.RetryError,
+                              requests.exceptions.ChunkedEncodingError, MongoConnectionFailure,
+                              ModelUnavailableError))
+
+def job_view(job):
+    view = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "created_at": datetime.utcfromtimestamp(job["created_at"]).isoformat(),
+        "queue_wait_seconds": job["started_at"] - job["created_at"] if job["started_at"] else None,
+        "run_seconds": job["finished_at"] - job["started_at"] if job["finished_at"] and job["started_at"] else None,
+    }
+    if job["status"] == "done":
+        view["result"] = job["result"]
+    elif job["error"]:
+        view["error"] = job["error"]
+    return view
+
+def on_job_finished(job, result, error, retried):
+    JOB_QUEUE_WAIT_SECONDS.observe(job["started_at"] - job["available_at"])
+    JOB_RUN_SECONDS.observe(time.time() - job["started_at"])
+    JOBS_FINISHED.inc(outcome="retried" if retried else ("failed" if error else "done"))
+    if retried:
+        print(f"Job {job['id']} attempt {job['attempts']} failed, retrying: {error}")
+    elif job["callback_url"]:
         try:
-            image_url_to_save = image_url if 'image_url' in locals() else f"uploaded_{uuid.uuid4().hex}"
-            saved_id = save_user_image_fast(
-                user_id, image_url_to_save, mission_id, 
-                current_phash, current_embedding, ai_result, dustbin_result
-            )
-            
-            return jsonify({
-                "status": "approved",
-                "message": "All checks passed",
-                "saved_id": saved_id,
-                "ai_generated": ai_result["is_ai_generated"],
-                "ai_confidence": ai_result["confidence"],
-                "dustbin_detected": dustbin_result["dustbin_detected"],
-                "dustbin_confidence": dustbin_result["confidence"],
-                "dustbin_method": dustbin_result["method"],
-                "duplicate": False,
-                "face_verified": face_result.get("verified") if face_result else None,
-                "processing_time": time.time() - start_time
-            })
-            
-        except Exception as save_error:
-            return jsonify({
-                "status": "approved",
-                "message": "Checks passed but save failed",
-                "error": str(save_error),
-                "processing_time": time.time() - start_time
-            })
+            requests.post(job["callback_url"], json=job_view(job_queue.get(job["id"])), timeout=JOB_CALLBACK_TIMEOUT)
+        except requests.RequestException as e:
+            print(f"Job {job['id']} callback failed: {e}")
+
+job_workers = JobWorkerPool(
+    job_queue, run_verification_job, workers=JOB_WORKERS, batch_size=JOB_CLAIM_BATCH,
+    on_finished=on_job_finished, retention_seconds=JOB_RETENTION_SECONDS, retryable=is_retryable_job_error
+)
 
+def start_job_workers():
+    if JOB_WORKERS > 0:
+        job_workers.start()
+
+metrics.callback("jobs", "Verification jobs by status", lambda: {(status,): n for status, n in job_queue.counts().items()},
+                 labelnames=("status",))
+metrics.callback("job_oldest_queued_seconds", "Age of the oldest queued job", job_queue.oldest_queued_age)
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """Queue a comprehensive check; poll GET /jobs/<job_id> or pass callback_url"""
+    try:
+        data = request.json or {}
+        image_url = data.get("image_url")
+        user_id = data.get("user_id")
+        if not image_url or not user_id:
+            return jsonify({"error": "Missing image_url or user_id"}), 400
+
+        payload = {
+            "image_url": image_url,
+            "user_id": user_id,
+            "profile_image_url": data.get("profile_image_url"),
+            "mission_id": data.get("mission_id", "unknown"),
+        }
+        job_id = job_queue.submit(payload, callback_url=data.get("callback_url"))
+        JOBS_SUBMITTED.inc()
+        start_job_workers()
+        job_workers.notify()
+        return jsonify({"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}), 202
     except Exception as e:
-        print(f"Comprehensive check error: {str(e)}")
-        return jsonify({
-            "error": f"Internal server error: {str(e)}",
-            "processing_time": time.time() - start_time
-        }), 500
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """Status of a queued job, with the comprehensive check result once done"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job_view(job))
 
 @app.route("/detect_dustbin", methods=["POST"])
 def detect_dustbin_endpoint():
@@ -437,17 +1338,88 @@ def detect_dustbin_endpoint():
         if not image_url:
             return jsonify({"error": "Missing image_url"}), 400
         
-        current_img = load_image_fast(image_url)
-        dustbin_result = detect_dustbin_fast(current_img)
+        features = load_image_features(image_url)
+        dustbin_result = features.dustbin_result()
         
         return jsonify(dustbin_result)
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# ==================== STREAMING BATCH CHECK ====================
+# /batch_check?stream=1 runs each image through the verification cascade on its
+# own thread, with at most BATCH_STREAM_WINDOW images of a request in flight,
+# and writes one NDJSON line per image as soon as it is decided. Concurrent
+# images still share CLIP forward passes through the micro-batcher.
+
+BATCH_STREAM_WINDOW = int(os.getenv("BATCH_STREAM_WINDOW", "8"))
+BATCH_STREAM_WORKERS = int(os.getenv("BATCH_STREAM_WORKERS", "16"))
+# Separate from `executor`: the cascade waits on tasks it submits there
+batch_stream_executor = ThreadPoolExecutor(max_workers=BATCH_STREAM_WORKERS, thread_name_prefix="batch-stream")
+
+def check_batch_image(user_id, idx, img_data, save_lock):
+    """Decide one image of a streamed batch; never raises"""
+    try:
+        image_url = img_data.get("image_url")
+        features = load_image_features(image_url)
+        rejection, results = run_verification_cascade(user_id, features)
+        if rejection:
+            return {"index": idx, **rejection}
+
+        # Images of this batch run concurrently: re-check against anything a
+        # sibling saved since our duplicate stages, then save atomically
+        with save_lock:
+            rejection = duplicate_rejection(user_id, results["phash"], results["embedding"])
+            if rejection:
+                REJECTIONS.inc(reason=rejection["reason"])
+                return {"index": idx, "status": "rejected", **rejection}
+            saved_id = save_user_image_fast(
+                user_id, image_url, img_data.get("mission_id", f"batch_{idx}"),
+                results["phash"], results["embedding"], results["ai_result"], results["dustbin_result"]
+            )
+        return {"index": idx, "status": "approved", "saved_id": saved_id}
+    except Exception as e:
+        return {"index": idx, "status": "error", "error": str(e)}
+
+def stream_batch_results(user_id, images, window=BATCH_STREAM_WINDOW):
+    """Yield one result per image in completion order, keeping at most ``window`` in flight"""
+    save_lock = threading.Lock()
+    queued = iter(enumerate(images))
+    pending = set()
+
+    def fill():
+        for idx, img_data in queued:
+            pending.add(batch_stream_executor.submit(check_batch_image, user_id, idx, img_data, save_lock))
+            if len(pending) >= window:
+                return
+
+    try:
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                yield future.result()
+            fill()
+    finally:
+        # Client went away: drop images that haven't started
+        for future in pending:
+            future.cancel()
+
+def stream_batch_response(user_id, images):
+    def generate():
+        summary = {"total": 0, "approved": 0, "rejected": 0, "errors": 0}
+        for result in stream_batch_results(user_id, images):
+            summary["total"] += 1
+            summary["errors" if result["status"] == "error" else result["status"]] += 1
+            yield json.dumps(to_native(result)) + "\n"
+        yield json.dumps({"summary": summary}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
 @app.route("/batch_check", methods=["POST"])
 def batch_check_optimized():
-    """Optimized batch processing"""
+    """Optimized batch processing; ?stream=1 streams NDJSON results as images are decided"""
     try:
         data = request.json
         images = data.get("images", [])
@@ -455,33 +1427,52 @@ def batch_check_optimized():
         
         if not user_id or not images:
             return jsonify({"error": "Missing user_id or images"}), 400
+
+        if request.args.get("stream", "").lower() in ("1", "true") or data.get("stream"):
+            return stream_batch_response(user_id, images)
         
-        # Load all images first
+        # Download all images concurrently; each decodes as soon as its bytes arrive
+        futures = image_fetcher.fetch_many(
+            [img_data.get("image_url") for img_data in images],
+            decode=decode_image, fetch=read_image_bytes
+        )
         loaded_images = []
-        for idx, img_data in enumerate(images):
+        for idx, (img_data, future) in enumerate(zip(images, futures)):
             try:
-                img = load_image_fast(img_data.get("image_url"))
-                loaded_images.append((idx, img, img_data))
+                loaded_images.append((idx, future.result(), img_data, None))
             except Exception as e:
                 loaded_images.append((idx, None, img_data, str(e)))
         
         # Batch process image features
-        valid_images = [(idx, img, data) for idx, img, data in loaded_images if img is not None]
+        valid_images = [(idx, img, data) for idx, img, data, _ in loaded_images if img is not None]
+        results = []
+        approved_entries = []
         
         if valid_images:
             # Batch CLIP processing
-            batch_images = [img for _, img, _ in valid_images]
-            batch_embeddings = get_image_features_batch(batch_images)
+            batch_pyramids = [ImagePyramid(img) for _, img, _ in valid_images]
+            batch_embeddings = get_image_features_batch([pyramid.clip for pyramid in batch_pyramids])
             
+            batch_features = [
+                ImageFeatures(img, embedding=batch_embeddings[i:i + 1], pyramid=batch_pyramids[i])
+                for i, (_, img, _) in enumerate(valid_images)
+            ]
+
+            # AI detection first, so YOLO only sees images that survive it
+            ai_results = detect_ai_generated_batch(batch_features)
+            needs_dustbin = [i for i, ai_result in enumerate(ai_results)
+                             if not (ai_result["is_ai_generated"] and ai_result["confidence"] > AI_REJECT_CONFIDENCE)]
+
+            # Dustbin detection for the survivors in one batched YOLO pass
+            dustbin_results = dict(zip(needs_dustbin, detect_dustbin_batch([batch_features[i] for i in needs_dustbin])))
+
             # Process each image
-            results = []
-            previous_images = get_user_images_fast(user_id)
-            
             for i, (idx, img, img_data) in enumerate(valid_images):
                 try:
-                    # AI detection
-                    ai_result = detect_ai_generated_fast(img)
-                    if ai_result["is_ai_generated"] and ai_result["confidence"] > 0.7:
+                    features = batch_features[i]
+
+                    ai_result = ai_results[i]
+                    if i not in dustbin_results:
                         results.append({
                             "index": idx,
                             "status": "rejected",
@@ -489,8 +1480,7 @@ def batch_check_optimized():
                         })
                         continue
                     
-                    # Dustbin detection
-                    dustbin_result = detect_dustbin_fast(img)
+                    dustbin_result = dustbin_results[i]
                     if not dustbin_result["dustbin_detected"]:
                         results.append({
                             "index": idx,
@@ -501,19 +1491,11 @@ def batch_check_optimized():
                         continue
 
                     # Duplicate check
-                    current_phash = str(imagehash.phash(img))
-                    current_embedding = batch_embeddings[i]
-                    
-                    is_duplicate = False
-                    for prev_img in previous_images:
-                        is_dup, _, _ = is_duplicate_fast(
-                            current_phash, prev_img.get("phash"),
-                            current_embedding, prev_img.get("clip_embedding")
-                        )
-                        if is_dup:
-                            is_duplicate = True
-                            break
+                    current_phash = features.phash
+                    current_embedding = features.embedding
                     
+                    # Images approved earlier in this batch are already in the index
+                    is_duplicate, _, _, _ = is_duplicate_fast(user_id, current_phash, current_embedding)
                     if is_duplicate:
                         results.append({
                             "index": idx,
@@ -521,18 +1503,28 @@ def batch_check_optimized():
                             "reason": "duplicate"
                         })
                         continue
+
+                    if find_cross_user_duplicate(user_id, current_phash, current_embedding):
+                        results.append({
+                            "index": idx,
+                            "status": "rejected",
+                            "reason": "cross_user_duplicate"
+                        })
+                        continue
                     
-                    # Save approved image
-                    saved_id = save_user_image_fast(
+                    # Approved: saved with the rest of the batch below, but indexed
+                    # now so later images of this batch are checked against it
+                    doc = build_image_doc(
                         user_id, img_data.get("image_url"),
                         img_data.get("mission_id", f"batch_{idx}"),
                         current_phash, current_embedding, ai_result, dustbin_result
                     )
-                    
+                    duplicate_index.add(user_id, current_embedding, current_phash, doc["image_url"], doc["_id"], doc["created_at"])
+                    approved_entries.append((doc, current_embedding))
                     results.append({
                         "index": idx,
                         "status": "approved",
-                        "saved_id": saved_id
+                        "saved_id": str(doc["_id"])
                     })
                     
                 except Exception as e:
@@ -542,8 +1534,19 @@ def batch_check_optimized():
                         "error": str(e)
                     })
         
+        # One unordered insert_many for every approved image
+        if approved_entries:
+            save_errors = save_user_images_batch(approved_entries)
+            if save_errors:
+                # Drop the unsaved records from the per-user index: reload from MongoDB
+                duplicate_index.invalidate(user_id)
+                failed_ids = {str(approved_entries[i][0]["_id"]): error for i, error in save_errors.items()}
+                for r in results:
+                    if r.get("saved_id") in failed_ids:
+                        r.update(status="error", error=failed_ids[r.pop("saved_id")])
+
         # Handle failed image loads
-        for idx, img, data, error in [item for item in loaded_images if len(item) == 4]:
+        for idx, img, data, error in [item for item in loaded_images if item[1] is None]:
             results.append({
                 "index": idx,
                 "status": "error",
@@ -551,6 +1554,9 @@ def batch_check_optimized():
             })
         
         # Summary
+        for r in results:
+            if r["status"] == "rejected":
+                REJECTIONS.inc(reason=r["reason"])
         approved = len([r for r in results if r["status"] == "approved"])
         rejected = len([r for r in results if r["status"] == "rejected"])
         errors = len([r for r in results if r["status"] == "error"])
@@ -569,29 +1575,6 @@ def batch_check_optimized():
         return jsonify({"error": str(e)}), 500
 
 
-
-def verify_faces_fast(img1_path, img2_path):
-    """
-    Fast face verification using DeepFace.
-    Returns a dict with 'verified' key.
-    """
-    try:
-        result = DeepFace.verify(
-            img1_path=img1_path,
-            img2_path=img2_path,
-            model_name="VGG-Face",
-            detector_backend="opencv",
-            enforce_detection=False
-        )
-        return {
-            "verified": result.get("verified", False),
-            "distance": result.get("distance"),
-            "threshold": result.get("threshold")
-        }
-    except Exception as e:
-        print(f"DeepFace verification error: {e}")
-        return {"verified": False, "error": str(e)}
-
 # ==================== SIMPLIFIED UTILITY ENDPOINTS ====================
 def to_native(obj):
     """Recursively convert numpy types to native Python types."""
@@ -613,28 +1596,14 @@ def verify_faces():
     if not file1 or not file2:
         return jsonify({"error": "Missing image files"}), 400
 
-    temp_files = []
     try:
-        temp1 = f"temp1_{uuid.uuid4().hex}.jpg"
-        temp2 = f"temp2_{uuid.uuid4().hex}.jpg"
-        temp_files = [temp1, temp2]
-        
-        file1.save(temp1)
-        file2.save(temp2)
-        
-        result = verify_faces_fast(temp1, temp2)
+        model_registry.get("face", MODEL_LOAD_TIMEOUT)
+        result = face_verifier.verify_images(load_image_fast(file1), load_image_fast(file2))
         result_native = to_native(result)  # <-- Convert all numpy types
         return jsonify(result_native)
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    finally:
-        for temp_file in temp_files:
-            if os.path.exists(temp_file):
-                try:
-                    os.remove(temp_file)
-                except:
-                    pass
 
 @app.route("/analyze_ai_only", methods=["POST"])
 def analyze_ai_only():
@@ -646,8 +1615,8 @@ def analyze_ai_only():
         if not image_url:
             return jsonify({"error": "Missing image_url"}), 400
         
-        current_img = load_image_fast(image_url)
-        ai_result = detect_ai_generated_fast(current_img)
+        features = load_image_features(image_url)
+        ai_result = features.ai_result()
         
         return jsonify(ai_result)
         
@@ -656,21 +1625,48 @@ def analyze_ai_only():
 
 @app.route("/health", methods=["GET"])
 def health_check():
-    """Health check endpoint"""
+    """Readiness: 200 only once the database answers and every required model is warm"""
     try:
-        db.command('ping')
+        ready = model_registry.ready()
+        try:
+            db.command('ping')
+            database = "connected"
+        except Exception as e:
+            database = f"unavailable: {e}"
+            ready = False
+        failed = model_registry.failed()
         return jsonify({
-            "status": "healthy",
-            "database": "connected",
-            "models": "loaded",
+            "status": "healthy" if ready else ("unhealthy" if failed else "starting"),
+            "ready": ready,
+            "database": database,
+            "models": model_registry.status(),
+            "uptime_seconds": time.monotonic() - model_registry.started_at,
+            "text_embedding_cache": text_embedding_cache.stats(),
+            "clip_batcher": clip_batcher.stats(),
+            "duplicate_index": duplicate_index.stats(),
+            "ann_index": ann_index.stats(),
+            "phash_index": phash_index.stats(),
+            "result_cache": result_cache.stats(),
+            "face_profiles": face_verifier.stats(),
+            "cascade": cascade_snapshot(),
+            "yolo": dict(yolo_stats, adaptive=YOLO_ADAPTIVE, fast_imgsz=YOLO_FAST_IMGSZ),
+            "image_writer": image_writer.stats(),
+            "image_cache": image_fetcher.cache.stats() if image_fetcher.cache else None,
+            "inference": inference_scheduler.stats(),
+            "jobs": dict(job_workers.stats(), counts=job_queue.counts(), oldest_queued_seconds=job_queue.oldest_queued_age()),
             "timestamp": datetime.utcnow().isoformat()
-        })
+        }), 200 if ready else 503
     except Exception as e:
         return jsonify({
             "status": "unhealthy",
             "error": str(e)
         }), 500
 
+@app.route("/health/live", methods=["GET"])
+def liveness_check():
+    """Liveness: the process is up and serving, models may still be loading"""
+    return jsonify({"status": "alive", "ready": model_registry.ready()})
+
 # ==================== LEGACY ENDPOINTS (simplified) ====================
 
 @app.route("/check_duplicate", methods=["POST"])
@@ -684,33 +1680,30 @@ def check_duplicate():
         if not image_url or not user_id:
             return jsonify({"error": "Missing image_url or user_id"}), 400
 
-        current_img = load_image_fast(image_url)
+        features = load_image_features(image_url)
         
         # Quick checks
-        ai_result = detect_ai_generated_fast(current_img)
-        if ai_result["is_ai_generated"] and ai_result["confidence"] > 0.7:
+        ai_result = features.ai_result()
+        if ai_result["is_ai_generated"] and ai_result["confidence"] > AI_REJECT_CONFIDENCE:
+            REJECTIONS.inc(reason="ai_generated")
             return jsonify({
                 "duplicate": False,
                 "ai_generated": True,
                 "rejected": True
             })
 
-        current_phash = str(imagehash.phash(current_img))
-        current_embedding = get_clip_embedding_fast(current_img)
+        current_phash = features.phash
+        current_embedding = features.embedding
         
         # Check duplicates
-        previous_images = get_user_images_fast(user_id)
-        for prev_img in previous_images:
-            is_dup, method, score = is_duplicate_fast(
-                current_phash, prev_img.get("phash"),
-                current_embedding, prev_img.get("clip_embedding")
-            )
-            if is_dup:
-                return jsonify({
-                    "duplicate": True,
-                    "method": method,
-                    "score": score
-                })
+        is_dup, method, score, _ = is_duplicate_fast(user_id, current_phash, current_embedding)
+        if is_dup:
+            REJECTIONS.inc(reason="duplicate")
+            return jsonify({
+                "duplicate": True,
+                "method": method,
+                "score": score
+            })
 
         # Save and return
         saved_id = save_user_image_fast(user_id, image_url, "legacy", current_phash, current_embedding, ai_result)
@@ -728,11 +1721,14 @@ if __name__ == "__main__":
     print("OPTIMIZED Image Verification Service")
     print("="*50)
     print("✓ Parallel processing enabled")
-    print("✓ Pre-computed CLIP text embeddings")
+    print("✓ Pre-computed CLIP text embeddings (cached on disk)")
+    print("✓ Background model loading + warm-up (readiness at /health, liveness at /health/live)")
     print("✓ Optimized AI detection pipeline")
     print("✓ Fast duplicate detection")
     print("✓ Batch processing support")
+    print(f"✓ CLIP micro-batching (max {CLIP_BATCH_MAX_SIZE} images / {CLIP_BATCH_MAX_WAIT_MS} ms)")
     print("✓ Efficient database operations")
     print("="*50)
-    
+
+    start_job_workers()
     app.run(debug=False, port=5000, host='0.0.0.0', threaded=True)
\ No newline at end of file
@@ -0,0 +1,144 @@
+"""Decode latency and peak RSS: full-resolution decode vs reduced decode + pyramid.
+
+"before" decodes every image at native resolution and derives each stage's
+input (YOLO 640, CLIP 224, analysis 256 gray, pHash 32 gray) from the full
+bitmap; "after" uses decode_reduced + ImagePyramid. Each (mode, image) runs
+in a fresh subprocess so peak RSS is per request, reported relative to the
+interpreter's RSS after imports.
+
+Usage:
+    python benchmarks/decode_report.py [--repeat 20] [--synthetic 4032x3024] [--json]
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+TEST_IMAGE_DIR = os.path.join(BACKEND_DIR, "..", "client", "ai_backend", "test")
+
+
+def stage_inputs_before(data):
+    from PIL import Image
+    from image_pyramid import ANALYSIS_SIZE, CLIP_SIZE, DETECT_SIZE, PHASH_SIZE
+
+    image = Image.open(io.BytesIO(data)).convert("RGB")
+    width, height = image.size
+    scale = DETECT_SIZE / max(width, height)
+    image.resize((round(width * scale), round(height * scale)), Image.BILINEAR)
+    scale = CLIP_SIZE / min(width, height)
+    image.resize((round(width * scale), round(height * scale)), Image.BICUBIC)
+    image.convert("L").resize((ANALYSIS_SIZE, ANALYSIS_SIZE))
+    image.convert("L").resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS)
+    return image.size
+
+
+def stage_inputs_after(data):
+    from image_pyramid import ImagePyramid, decode_reduced
+
+    pyramid = ImagePyramid(decode_reduced(data))
+    pyramid.detect, pyramid.clip, pyramid.analysis_gray, pyramid.phash_gray
+    return pyramid.base.size
+
+
+def peak_rss_kb():
+    """Peak RSS of this process (VmHWM; ru_maxrss on Linux carries over from the parent across exec)"""
+    try:
+        with open("/proc/self/status") as handle:
+            for line in handle:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_child(mode, path, repeat):
+    """Runs inside the subprocess: time ``repeat`` decodes, report peak RSS growth"""
+    import PIL.Image  # noqa: F401  (import cost excluded from the RSS baseline)
+    import image_pyramid  # noqa: F401
+
+    with open(path, "rb") as handle:
+        data = handle.read()
+    baseline_kb = peak_rss_kb()
+    work = stage_inputs_before if mode == "before" else stage_inputs_after
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        decoded_size = work(data)
+        times.append(time.perf_counter() - started)
+    peak_kb = peak_rss_kb()
+    print(json.dumps({
+        "decoded_size": list(decoded_size),
+        "p50_ms": statistics.median(times) * 1000,
+        "min_ms": min(times) * 1000,
+        "peak_rss_delta_mb": (peak_kb - baseline_kb) / 1024
+    }))
+
+
+def write_synthetic(size, directory):
+    """Noisy JPEG at phone-camera resolution"""
+    import numpy as np
+    from PIL import Image
+
+    width, height = size
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    pixels = np.clip(gradient + rng.normal(0, 25, (height, width, 3)), 0, 255).astype(np.uint8)
+    path = os.path.join(directory, f"synthetic_{width}x{height}.jpg")
+    Image.fromarray(pixels).save(path, quality=90)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--synthetic", default="4032x3024", help="Extra JPEG WxH to generate ('' to skip)")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child[0], args.child[1], args.repeat)
+        return
+
+    paths = sorted(glob.glob(os.path.join(TEST_IMAGE_DIR, "*")))
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.synthetic:
+            paths.append(write_synthetic(tuple(int(v) for v in args.synthetic.split("x")), tmp))
+
+        rows = []
+        for path in paths:
+            row = {"image": os.path.basename(path)}
+            for mode in ("before", "after"):
+                output = subprocess.check_output(
+                    [sys.executable, os.path.abspath(__file__), "--repeat", str(args.repeat), "--child", mode, path]
+                )
+                row[mode] = json.loads(output)
+            rows.append(row)
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    print(f"{'image':<44} {'decoded':>11} {'p50 ms':>8} {'RSS MB':>7}   {'decoded':>11} {'p50 ms':>8} {'RSS MB':>7}")
+    print(f"{'':<44} {'--- before ---':>28}   {'--- after ---':>28}")
+    for row in rows:
+        before, after = row["before"], row["after"]
+        print(
+            f"{row['image'][:44]:<44} "
+            f"{'x'.join(map(str, before['decoded_size'])):>11} {before['p50_ms']:>8.2f} {before['peak_rss_delta_mb']:>7.1f}   "
+            f"{'x'.join(map(str, after['decoded_size'])):>11} {after['p50_ms']:>8.2f} {after['peak_rss_delta_mb']:>7.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
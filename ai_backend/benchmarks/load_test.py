@@ -0,0 +1,313 @@
+"""End-to-end load generator with no external services.
+
+Starts the app (Flask's threaded server, or gunicorn with --server gunicorn)
+against an in-process MongoDB stand-in (MONGODB_URI=mongomock://; install it
+with ``pip install -r requirements-dev.txt``), serves client/ai_backend/test
+from a local HTTP server, and drives /comprehensive_check or /batch_check:
+
+  closed  each of --concurrency clients sends its next request as soon as
+          the previous one returns (throughput at a fixed concurrency)
+  open    requests arrive as a Poisson process at --rate per second,
+          whatever the server's speed; latency counts from the scheduled
+          arrival, so a backed-up server shows up in p99 instead of
+          silently slowing the load (no coordinated omission)
+
+Every request uses a fresh user id and image bytes made unique by a random
+trailer, so the per-user duplicate check and the result cache never short
+circuit it. The cross-user check stays off (the app's default) for the
+same reason; --cross-user turns it on. Caches, the ANN index and the job
+database go to a temporary directory.
+
+Output is JSON on stdout: one row per load level with throughput, p50/p95/p99
+latency, error rate, status / verdict counts, and the server's RSS (peak and
+final, summed over the master and its workers).
+
+    python benchmarks/load_test.py --endpoint comprehensive --mode closed --concurrency 1,4,16 --duration 30
+    python benchmarks/load_test.py --endpoint batch --batch-size 8 --mode open --rate 0.5,1,2
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from prefork_report import BACKEND_DIR, TEST_IMAGE_DIR, child_pids, memory_kb, serve_images, wait_ready
+
+
+def start_server(args, workdir):
+    env = dict(
+        os.environ,
+        MONGODB_URI="mongomock://",
+        CROSS_USER_CHECK_ENABLED="true" if args.cross_user else "false",
+        JOB_WORKERS="0",
+        JOB_DB_PATH=os.path.join(workdir, "jobs.sqlite3"),
+        ANN_INDEX_DIR=os.path.join(workdir, "ann"),
+        IMAGE_CACHE_DIR=os.path.join(workdir, "image_cache"),
+        MODEL_LOADING="eager",
+    )
+    if args.server == "gunicorn":
+        env.update(GUNICORN_BIND=f"127.0.0.1:{args.port}", GUNICORN_WORKERS=str(args.workers))
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"]
+    else:
+        command = [sys.executable, "-c",
+                   f"import app; app.app.run(host='127.0.0.1', port={args.port}, threaded=True)"]
+    log = open(os.path.join(workdir, "server.log"), "wb")
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+class RssSampler:
+    """Peak and latest RSS of the server process tree, sampled in the background"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = 0
+        self.last_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self):
+        total = 0
+        for pid in [self.pid] + child_pids(self.pid):
+            try:
+                total += memory_kb(pid)["rss"]
+            except OSError:
+                pass
+        self.last_kb = total
+        self.peak_kb = max(self.peak_kb, total)
+        return total
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.peak_kb = 0
+        self.sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._stop.clear()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+class RequestFactory:
+    """Unique users and image URLs for every request"""
+
+    def __init__(self, base_url, image_base, image_count, endpoint, batch_size, with_face):
+        self.base_url = base_url
+        self.image_base = image_base
+        self.image_count = image_count
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.with_face = with_face
+        self._counter = iter(range(10 ** 12))
+        self._lock = threading.Lock()
+
+    def _next(self):
+        with self._lock:
+            return next(self._counter)
+
+    def _image_url(self, n):
+        return f"{self.image_base}/{n % self.image_count}?n={n}"
+
+    def build(self):
+        n = self._next()
+        user_id = f"load-{os.getpid()}-{n}"
+        if self.endpoint == "batch":
+            images = [{"image_url": self._image_url(n * self.batch_size + i)} for i in range(self.batch_size)]
+            return f"{self.base_url}/batch_check", {"user_id": user_id, "images": images}
+        payload = {"user_id": user_id, "image_url": self._image_url(n), "mission_id": f"load-{n}"}
+        if self.with_face:
+            # Same profile URL for everyone: the profile embedding is cached after the first request
+            payload["profile_image_url"] = f"{self.image_base}/0"
+        return f"{self.base_url}/comprehensive_check", payload
+
+
+def send(session, factory, timeout):
+    """(ok, status label, verdicts) for one request"""
+    url, payload = factory.build()
+    try:
+        response = session.post(url, json=payload, timeout=timeout)
+    except requests.RequestException as e:
+        return False, type(e).__name__, []
+    if response.status_code != 200:
+        return False, str(response.status_code), []
+    body = response.json()
+    if "results" in body:
+        verdicts = [result.get("reason") or result["status"] for result in body["results"]]
+    else:
+        verdicts = [body.get("reason") or body.get("status", "unknown")]
+    return True, "200", verdicts
+
+
+def summarize(latencies, outcomes, verdicts, wall, sampler):
+    ordered = sorted(latencies)
+    percentile = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000 if ordered else None
+    total = len(latencies)
+    errors = sum(1 for ok, _ in outcomes if not ok)
+    return {
+        "requests": total,
+        "errors": errors,
+        "error_rate": errors / total if total else 0.0,
+        "throughput_rps": total / wall if wall else 0.0,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": ordered[-1] * 1000 if ordered else None,
+        "status_codes": dict(Counter(status for _, status in outcomes)),
+        "verdicts": dict(Counter(verdicts)),
+        "rss_peak_mb": sampler.peak_kb / 1024,
+        "rss_final_mb": sampler.last_kb / 1024,
+    }
+
+
+def run_closed(factory, concurrency, duration, timeout, sampler):
+    latencies, outcomes, verdicts = [], [], []
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client():
+        session = requests.Session()
+        while time.time() < deadline:
+            started = time.perf_counter()
+            ok, status, request_verdicts = send(session, factory, timeout)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                outcomes.append((ok, status))
+                verdicts.extend(request_verdicts)
+
+    with sampler:
+        started = time.time()
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.time() - started
+    return summarize(latencies, outcomes, verdicts, wall, sampler)
+
+
+def run_open(factory, rate, duration, timeout, max_inflight, sampler, seed=0):
+    latencies, outcomes, verdicts = [], [], []
+    lock = threading.Lock()
+    sessions = threading.local()
+    rng = random.Random(seed)
+
+    def request(scheduled):
+        session = getattr(sessions, "session", None) or requests.Session()
+        sessions.session = session
+        ok, status, request_verdicts = send(session, factory, timeout)
+        # From the scheduled arrival: includes time queued behind --max-inflight
+        elapsed = time.perf_counter() - scheduled
+        with lock:
+            latencies.append(elapsed)
+            outcomes.append((ok, status))
+            verdicts.extend(request_verdicts)
+
+    with sampler, ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        started = time.perf_counter()
+        arrival = started
+        while arrival - started < duration:
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(request, arrival)
+            arrival += rng.expovariate(rate)
+        pool.shutdown(wait=True)
+        wall = time.perf_counter() - started
+    return summarize(latencies, outcomes, verdicts, wall, sampler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--endpoint", choices=["comprehensive", "batch"], default="comprehensive")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--concurrency", default="1,4,16", help="Closed loop: comma-separated client counts")
+    parser.add_argument("--rate", default="1,2,4", help="Open loop: comma-separated arrival rates (requests/s)")
+    parser.add_argument("--max-inflight", type=int, default=256, help="Open loop: cap on concurrent connections")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=int, default=3, help="Requests sent before measuring")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--with-face", action="store_true", help="Send a profile_image_url (face stage)")
+    parser.add_argument("--cross-user", action="store_true", help="Turn the cross-user duplicate check on")
+    parser.add_argument("--server", choices=["flask", "gunicorn"], default="flask")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--port", type=int, default=5056)
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds")
+    parser.add_argument("--ready-timeout", type=float, default=600)
+    parser.add_argument("--images", default=TEST_IMAGE_DIR)
+    parser.add_argument("--output", help="Also write the JSON report here")
+    args = parser.parse_args()
+
+    image_server, image_count = serve_images(sorted(glob.glob(os.path.join(args.images, "*"))))
+    image_base = f"http://127.0.0.1:{image_server.server_address[1]}"
+    base_url = f"http://127.0.0.1:{args.port}"
+    workdir = tempfile.mkdtemp(prefix="bingo-load-")
+    server = start_server(args, workdir)
+    try:
+        if not wait_ready(base_url, args.ready_timeout):
+            raise RuntimeError(f"Server not ready after {args.ready_timeout}s; see {workdir}/server.log")
+        factory = RequestFactory(base_url, image_base, image_count, args.endpoint, args.batch_size, args.with_face)
+        session = requests.Session()
+        for _ in range(args.warmup):
+            send(session, factory, args.timeout)
+
+        sampler = RssSampler(server.pid)
+        rows = []
+        if args.mode == "closed":
+            for concurrency in (int(value) for value in args.concurrency.split(",")):
+                row = run_closed(factory, concurrency, args.duration, args.timeout, sampler)
+                rows.append({"concurrency": concurrency, **row})
+                print(f"closed c={concurrency}: {row['throughput_rps']:.2f} req/s, p99 {row['p99_ms'] or 0:.0f} ms",
+                      file=sys.stderr)
+        else:
+            for rate in (float(value) for value in args.rate.split(",")):
+                row = run_open(factory, rate, args.duration, args.timeout, args.max_inflight, sampler)
+                rows.append({"rate": rate, **row})
+                print(f"open rate={rate}: {row['throughput_rps']:.2f} req/s, p99 {row['p99_ms'] or 0:.0f} ms",
+                      file=sys.stderr)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        image_server.shutdown()
+
+    report = {
+        "endpoint": args.endpoint,
+        "mode": args.mode,
+        "server": args.server,
+        "workers": args.workers if args.server == "gunicorn" else 1,
+        "batch_size": args.batch_size if args.endpoint == "batch" else None,
+        "duration_s": args.duration,
+        "cpus": os.cpu_count(),
+        "results": rows,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(text + "\n")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Throughput / latency of inference CPU partitions under concurrent load.
+
+Each client thread loops over the test images doing what one comprehensive
+check does on the models: CLIP embedding, then the AI detector and YOLO
+dustbin detection side by side on the shared stage executor (as the
+cascade's dustbin overlap does), optionally plus a face embedding. The
+same load runs once per partition spec and client count, so the curves
+show where oversubscription starts and what a given split buys.
+
+Specs are INFERENCE_PARTITIONS strings (see inference_scheduler.py), plus
+"off" for no scheduler (calls run on the request threads, unbounded). The
+default set compares off, the automatic split (one call per model at a
+time), two concurrent calls per model, and a pinned split of this machine's
+cores. Partition threads only reach CLIP on ONNX Runtime; run with
+CLIP_ENGINE=onnx to compare them.
+
+    python benchmarks/partition_report.py [--clients 1,4,16] [--duration 20] [--with-face]
+    python benchmarks/partition_report.py --spec "clip:threads=8,cores=0-7;yolo:threads=8,cores=8-15" --json
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+
+# run_benchmarks puts the backend directory on sys.path
+from run_benchmarks import DEFAULT_SYNTHETIC, TEST_IMAGE_DIR, load_app, load_inputs
+from inference_scheduler import InferenceScheduler, available_cpus, parse_partitions
+
+
+def default_specs(cpus):
+    half, quarter = max(1, cpus // 2), max(1, cpus // 4)
+    specs = ["off", "", "clip:concurrency=2;yolo:concurrency=2;face:concurrency=2"]
+    if cpus >= 4:
+        specs.append(
+            f"clip:threads={half},cores=0-{half - 1};"
+            f"yolo:cores={half}-{half + quarter - 1};"
+            f"face:cores={half + quarter}-{cpus - 1}"
+        )
+    return specs
+
+
+def install_scheduler(app, spec, budget):
+    app.inference_scheduler.shutdown()
+    app.inference_scheduler = InferenceScheduler(
+        parse_partitions("" if spec == "off" else spec, budget),
+        enabled=spec != "off"
+    )
+    if app.CLIP_ENGINE != "torch":
+        # ONNX Runtime takes the CLIP partition's threads when the session is created
+        app.model_registry.reset("clip")
+        app.model_registry.get("clip", app.MODEL_LOAD_TIMEOUT)
+
+
+def check_once(app, item, with_face):
+    import numpy as np
+
+    features = app.ImageFeatures(item.image, pyramid=item.pyramid)
+    features.embedding
+    dustbin = app.executor.submit(app.detect_dustbin_yolo_batch, [np.array(item.pyramid.detect)])
+    app.detect_ai_generated_fast(item.image, features)
+    if with_face:
+        app.face_verifier.embed(item.image)
+    dustbin.result()
+
+
+def drive_load(app, inputs, clients, duration, with_face):
+    """Closed loop: each client starts its next check as soon as the last one returns"""
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client(client_id):
+        sent = client_id
+        while time.time() < deadline:
+            item = inputs[sent % len(inputs)]
+            sent += 1
+            started = time.perf_counter()
+            try:
+                check_once(app, item, with_face)
+                ok = True
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                (latencies if ok else errors).append(elapsed)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.time() - started
+
+    ordered = sorted(latencies)
+    percentile = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000 if ordered else None
+    return {
+        "checks": len(latencies),
+        "errors": len(errors),
+        "throughput_per_s": len(latencies) / wall,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "mean_ms": statistics.mean(latencies) * 1000 if latencies else None,
+    }
+
+
+def main():
+    cpus = available_cpus()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--spec", action="append", help="Partition spec to compare (repeatable; 'off' = no scheduler)")
+    parser.add_argument("--clients", default="1,4,16")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--budget", type=int, default=cpus, help="CPU budget for models not named in a spec")
+    parser.add_argument("--with-face", action="store_true", help="Include a DeepFace embedding per check")
+    parser.add_argument("--images", default=TEST_IMAGE_DIR)
+    parser.add_argument("--synthetic", default=DEFAULT_SYNTHETIC)
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+
+    app = load_app()
+    app.model_registry.get("clip", app.MODEL_LOAD_TIMEOUT)
+    app.model_registry.get("yolo", app.MODEL_LOAD_TIMEOUT)
+    if args.with_face:
+        app.model_registry.get("face", app.MODEL_LOAD_TIMEOUT)
+    inputs = load_inputs(args.images, args.synthetic)
+
+    rows = []
+    for spec in args.spec or default_specs(cpus):
+        install_scheduler(app, spec, args.budget)
+        check_once(app, inputs[0], args.with_face)  # warm the partition's threads
+        for clients in (int(value) for value in args.clients.split(",")):
+            rows.append({"spec": spec or "auto", "clients": clients,
+                         **drive_load(app, inputs, clients, args.duration, args.with_face)})
+
+    if args.json:
+        print(json.dumps({"cpus": cpus, "budget": args.budget, "results": rows}, indent=2))
+        return
+    print(f"{cpus} CPUs, budget {args.budget}")
+    print(f"{'clients':>7} {'checks/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}  spec")
+    for row in rows:
+        print(
+            f"{row['clients']:>7} {row['throughput_per_s']:>9.2f} {row['p50_ms'] or 0:>8.1f} "
+            f"{row['p95_ms'] or 0:>8.1f} {row['p99_ms'] or 0:>8.1f} {row['errors']:>6}  {row['spec']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
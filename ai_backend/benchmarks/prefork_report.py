@@ -0,0 +1,207 @@
+"""Memory per worker and throughput scaling of the pre-fork (gunicorn) mode.
+
+For each worker count, starts ``gunicorn -c gunicorn.conf.py app:app``, waits
+for /health to report ready, reads every worker's Rss / Pss / private memory
+from /proc/<pid>/smaps_rollup, then drives /analyze_ai_only with a closed
+loop of client threads. Images are served from a local HTTP server with a
+random trailer appended after the image data, so every request has unique
+bytes and misses the result cache while decoding identically.
+
+Pss splits shared pages evenly between the processes mapping them, so
+"master Pss + workers x worker Pss" is the real footprint; Rss counts the
+copy-on-write weights once per worker.
+
+Usage:
+    python benchmarks/prefork_report.py [--workers 1,2,4,8] [--clients-per-worker 4] [--duration 30] [--json]
+"""
+import argparse
+import glob
+import http.server
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_IMAGE_DIR = os.path.join(BACKEND_DIR, "..", "client", "ai_backend", "test")
+
+
+def serve_images(paths):
+    """Local image server on an ephemeral port; GET /<i>?n=<k> returns image i with a unique trailer"""
+    images = []
+    for path in paths:
+        with open(path, "rb") as handle:
+            images.append(handle.read())
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            index = int(self.path.split("?")[0].strip("/")) % len(images)
+            body = images[index] + os.urandom(16)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, len(images)
+
+
+def memory_kb(pid):
+    """Rss / Pss / private (USS) of one process from smaps_rollup"""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as handle:
+        for line in handle:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                fields[parts[0][:-1]] = int(parts[1])
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def child_pids(pid):
+    pids = []
+    for path in glob.glob(f"/proc/{pid}/task/*/children"):
+        with open(path) as handle:
+            pids.extend(int(value) for value in handle.read().split())
+    return pids
+
+
+def wait_ready(base_url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url}/health", timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    return False
+
+
+def drive_load(base_url, image_base, image_count, clients, duration):
+    """Closed loop: each client sends its next request as soon as the last one returns"""
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client(client_id):
+        session = requests.Session()
+        sent = 0
+        while time.time() < deadline:
+            url = f"{image_base}/{(client_id + sent) % image_count}?n={client_id}-{sent}"
+            sent += 1
+            started = time.perf_counter()
+            try:
+                response = session.post(f"{base_url}/analyze_ai_only", json={"image_url": url}, timeout=120)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                (latencies if ok else errors).append(elapsed)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.time() - started
+
+    ordered = sorted(latencies)
+    percentile = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000 if ordered else None
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput_rps": len(latencies) / wall,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "mean_ms": statistics.mean(latencies) * 1000 if latencies else None,
+    }
+
+
+def run(workers, args, image_base, image_count):
+    port = args.port
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, GUNICORN_WORKERS=str(workers), GUNICORN_BIND=f"127.0.0.1:{port}")
+    master = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        if not wait_ready(base_url, args.ready_timeout):
+            raise RuntimeError(f"{workers} worker(s) not ready after {args.ready_timeout}s")
+        # Memory once warm and once more after load (private pages grow with use)
+        pids = child_pids(master.pid)
+        idle = [memory_kb(pid) for pid in pids]
+        load = drive_load(base_url, image_base, image_count, workers * args.clients_per_worker, args.duration)
+        # A worker killed under load (e.g. by the OOM killer) has no /proc entry left
+        loaded = [memory_kb(pid) for pid in pids if os.path.exists(f"/proc/{pid}")]
+        master_memory = memory_kb(master.pid)
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait(timeout=60)
+
+    if len(loaded) < len(pids):
+        print(f"Warning: {len(pids) - len(loaded)} of {workers} worker(s) died during the run", file=sys.stderr)
+    mean_mb = lambda rows, key: statistics.mean(row[key] for row in rows) / 1024 if rows else None
+    return {
+        "workers": workers,
+        "master_rss_mb": master_memory["rss"] / 1024,
+        "master_pss_mb": master_memory["pss"] / 1024,
+        "worker_rss_mb": mean_mb(loaded, "rss"),
+        "worker_pss_mb": mean_mb(loaded, "pss"),
+        "worker_private_mb_idle": mean_mb(idle, "private"),
+        "worker_private_mb": mean_mb(loaded, "private"),
+        "total_pss_mb": (master_memory["pss"] + sum(row["pss"] for row in loaded)) / 1024,
+        "workers_died": len(pids) - len(loaded),
+        **load,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--clients-per-worker", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--ready-timeout", type=float, default=600)
+    parser.add_argument("--images", default=TEST_IMAGE_DIR)
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+
+    server, image_count = serve_images(sorted(glob.glob(os.path.join(args.images, "*"))))
+    image_base = f"http://127.0.0.1:{server.server_address[1]}"
+    rows = [run(int(count), args, image_base, image_count) for count in args.workers.split(",")]
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    print(f"{'workers':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>6} "
+          f"{'worker Rss':>10} {'worker Pss':>10} {'private':>8} {'total Pss':>10}")
+    for row in rows:
+        print(
+            f"{row['workers']:>7} {row['throughput_rps']:>8.1f} {row['p50_ms'] or 0:>8.1f} {row['p95_ms'] or 0:>8.1f} "
+            f"{row['errors']:>6} {row['worker_rss_mb'] or 0:>10.0f} {row['worker_pss_mb'] or 0:>10.0f} "
+            f"{row['worker_private_mb'] or 0:>8.0f} {row['total_pss_mb']:>10.0f}"
+            + (f"  ({row['workers_died']} died)" if row["workers_died"] else "")
+        )
+
+
+if __name__ == "__main__":
+    main()
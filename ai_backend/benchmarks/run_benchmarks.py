@@ -0,0 +1,398 @@
+"""Per-stage micro-benchmarks with a stored baseline and regression gate.
+
+Runs each verification stage on the images in client/ai_backend/test plus
+synthetic JPEGs at several resolutions, and reports latency percentiles,
+throughput and peak memory per stage. Peak memory is the growth of the
+process high-water mark over the stage's warm-up and timed runs (VmHWM,
+reset between stages through /proc/self/clear_refs after malloc_trim), so
+it includes torch / ONNX Runtime allocations; where that isn't available
+it falls back to tracemalloc.
+
+Stages that need the models import app.py (offline: no MongoDB is needed
+and the result cache is disabled); a stage whose dependencies are missing
+is reported as skipped, not failed.
+
+    python benchmarks/run_benchmarks.py                          # run + compare with baseline.json
+    python benchmarks/run_benchmarks.py --stages decode,phash,duplicate_check
+    python benchmarks/run_benchmarks.py --update-baseline        # record this machine's baseline
+    python benchmarks/run_benchmarks.py --threshold 15 --json results.json
+
+Exit status is 1 when any stage's p50 latency (or peak memory, see
+--memory-threshold) is worse than the baseline by more than the threshold,
+and 2 when there is no baseline to compare with (a gate that can't compare
+doesn't pass); --allow-missing-baseline makes that a notice instead.
+Baselines are machine-specific: record one on the box that runs the gate.
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+TEST_IMAGE_DIR = os.path.join(BACKEND_DIR, "..", "client", "ai_backend", "test")
+DEFAULT_BASELINE = os.path.join(BACKEND_DIR, "benchmarks", "baseline.json")
+DEFAULT_SYNTHETIC = "640x480,1920x1080,4032x3024"
+
+
+# ==================== INPUTS ====================
+
+class BenchImage:
+    def __init__(self, name, data):
+        from image_pyramid import ImagePyramid, decode_reduced
+
+        self.name = name
+        self.data = data
+        self.image = decode_reduced(data)
+        self.pyramid = ImagePyramid(self.image)
+
+
+def synthetic_jpeg(width, height, seed=0):
+    """Noisy gradient JPEG; noise keeps the encoder and the detectors honest"""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    pixels = np.clip(gradient + rng.normal(0, 25, (height, width, 3)), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def load_inputs(image_dir, synthetic):
+    inputs = []
+    for path in sorted(glob.glob(os.path.join(image_dir, "*"))):
+        with open(path, "rb") as handle:
+            inputs.append(BenchImage(os.path.basename(path), handle.read()))
+    for index, size in enumerate(filter(None, synthetic.split(","))):
+        width, height = (int(v) for v in size.split("x"))
+        inputs.append(BenchImage(f"synthetic_{size}", synthetic_jpeg(width, height, seed=index)))
+    return inputs
+
+
+_app = None
+
+def load_app():
+    """Import app.py for model-backed stages, without MongoDB or caches in the way"""
+    global _app
+    if _app is None:
+        os.environ.setdefault("MONGODB_URI", "mongodb://127.0.0.1:27017/?serverSelectionTimeoutMS=200")
+        os.environ.setdefault("MODEL_LOADING", "eager")
+        os.environ.setdefault("CROSS_USER_CHECK_ENABLED", "false")
+        os.environ["RESULT_CACHE_MAX_ENTRIES"] = "0"
+        import app
+
+        _app = app
+    return _app
+
+
+# ==================== STAGES ====================
+# Each stage maps the inputs to a list of zero-argument calls and says how
+# many items one call processes (for throughput).
+
+def stage_decode(inputs):
+    from image_pyramid import decode_reduced
+
+    return [lambda item=item: decode_reduced(item.data) for item in inputs], 1
+
+
+def stage_pyramid(inputs):
+    from image_pyramid import ImagePyramid
+
+    def build(item):
+        pyramid = ImagePyramid(item.image)
+        return pyramid.detect, pyramid.clip, pyramid.analysis_gray, pyramid.phash_gray
+
+    return [lambda item=item: build(item) for item in inputs], 1
+
+
+def stage_phash(inputs):
+    import imagehash
+
+    grays = [item.pyramid.phash_gray for item in inputs]
+    return [lambda gray=gray: str(imagehash.phash(gray)) for gray in grays], 1
+
+
+def stage_clip_embedding(inputs):
+    app = load_app()
+    clips = [item.pyramid.clip for item in inputs]
+    return [lambda clip=clip: app.get_image_features_batch([clip]) for clip in clips], 1
+
+
+def stage_clip_batcher(inputs):
+    """get_clip_embedding_fast: one image through the micro-batcher (includes its wait window)"""
+    app = load_app()
+    clips = [item.pyramid.clip for item in inputs]
+    return [lambda clip=clip: app.get_clip_embedding_fast(clip) for clip in clips], 1
+
+
+def stage_clip_batch16(inputs):
+    app = load_app()
+    clips = [item.pyramid.clip for item in inputs]
+    batch = (clips * 16)[:16]
+    return [lambda: app.get_image_features_batch(batch)], 16
+
+
+def _features(app, inputs):
+    embeddings = app.get_image_features_batch([item.pyramid.clip for item in inputs])
+    return [
+        app.ImageFeatures(item.image, embedding=embeddings[i:i + 1], pyramid=item.pyramid)
+        for i, item in enumerate(inputs)
+    ]
+
+
+def stage_ai_detection(inputs):
+    app = load_app()
+    return [
+        lambda item=item, features=features: app.detect_ai_generated_fast(item.image, features)
+        for item, features in zip(inputs, _features(app, inputs))
+    ], 1
+
+
+def stage_ai_detection_batch16(inputs):
+    app = load_app()
+    batch = (_features(app, inputs) * 16)[:16]
+    return [lambda: app.detect_ai_generated_batch(batch)], 16
+
+
+def stage_dustbin_yolo(inputs):
+    import numpy as np
+
+    app = load_app()
+    arrays = [np.array(item.pyramid.detect) for item in inputs]
+    return [lambda array=array: app.detect_dustbin_yolo_batch([array]) for array in arrays], 1
+
+
+def stage_dustbin(inputs):
+    app = load_app()
+    return [
+        lambda item=item, features=features: app.detect_dustbin_fast(item.image, features)
+        for item, features in zip(inputs, _features(app, inputs))
+    ], 1
+
+
+def stage_face_embedding(inputs):
+    app = load_app()
+    app.model_registry.get("face")
+    return [lambda item=item: app.face_verifier.embed(item.image) for item in inputs], 1
+
+
+def stage_duplicate_check(inputs, history=2000):
+    """Query against a user with ``history`` stored images (no models needed)"""
+    import numpy as np
+    from duplicate_index import UserDuplicateIndex
+
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(history + 32, 512)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    phashes = [f"{value:016x}" for value in rng.integers(0, 2 ** 63, size=history + 32)]
+    index = UserDuplicateIndex()
+    for vector, phash in zip(vectors[:history], phashes[:history]):
+        index.add(vector, phash)
+    queries = list(zip(vectors[history:], phashes[history:]))
+    return [lambda q=q: index.query(q[0], q[1], 5, 0.93) for q in queries], 1
+
+
+STAGES = {
+    "decode": stage_decode,
+    "pyramid": stage_pyramid,
+    "phash": stage_phash,
+    "clip_embedding": stage_clip_embedding,
+    "clip_batcher": stage_clip_batcher,
+    "clip_batch16": stage_clip_batch16,
+    "ai_detection": stage_ai_detection,
+    "ai_detection_batch16": stage_ai_detection_batch16,
+    "dustbin_yolo": stage_dustbin_yolo,
+    "dustbin": stage_dustbin,
+    "face_embedding": stage_face_embedding,
+    "duplicate_check": stage_duplicate_check,
+}
+
+
+# ==================== MEASUREMENT ====================
+
+def _status_kb(field):
+    try:
+        with open("/proc/self/status") as handle:
+            for line in handle:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def release_free_memory():
+    """Return freed heap pages to the OS so earlier stages don't hide this one's peak"""
+    try:
+        import ctypes
+
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def reset_peak_rss():
+    """Reset VmHWM to the current RSS (Linux); False when unsupported"""
+    try:
+        with open("/proc/self/clear_refs", "w") as handle:
+            handle.write("5")
+        return _status_kb("VmHWM") is not None
+    except OSError:
+        return False
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def measure(calls, items_per_call, repeat, warmup):
+    # Peak covers the warm-up too: first-call allocations are part of the stage's cost
+    release_free_memory()
+    use_hwm = reset_peak_rss()
+    baseline_kb = _status_kb("VmRSS") if use_hwm else None
+    if not use_hwm:
+        tracemalloc.start()
+
+    for call in calls:
+        for _ in range(warmup):
+            call()
+
+    times = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for call in calls:
+            call_started = time.perf_counter()
+            call()
+            times.append(time.perf_counter() - call_started)
+    wall = time.perf_counter() - started
+
+    if use_hwm:
+        peak_mb = max(0, _status_kb("VmHWM") - baseline_kb) / 1024
+    else:
+        peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+
+    ordered = sorted(times)
+    return {
+        "samples": len(times),
+        "p50_ms": percentile(ordered, 0.50) * 1000,
+        "p95_ms": percentile(ordered, 0.95) * 1000,
+        "p99_ms": percentile(ordered, 0.99) * 1000,
+        "mean_ms": statistics.mean(times) * 1000,
+        "throughput_per_s": len(times) * items_per_call / wall,
+        "peak_mem_mb": peak_mb,
+        "peak_mem_source": "VmHWM" if use_hwm else "tracemalloc",
+    }
+
+
+def compare(results, baseline, threshold, memory_threshold):
+    """Regression messages for stages that got slower (or bigger) than the baseline"""
+    regressions = []
+    for stage, result in results.items():
+        reference = baseline.get("stages", {}).get(stage)
+        if not reference or "p50_ms" not in result or "p50_ms" not in reference:
+            continue
+        change = (result["p50_ms"] - reference["p50_ms"]) / reference["p50_ms"] * 100
+        result["p50_change_pct"] = change
+        if change > threshold:
+            regressions.append(f"{stage}: p50 {reference['p50_ms']:.2f} -> {result['p50_ms']:.2f} ms (+{change:.1f}%)")
+        if memory_threshold is not None and reference.get("peak_mem_mb", 0) > 1.0:
+            growth = (result["peak_mem_mb"] - reference["peak_mem_mb"]) / reference["peak_mem_mb"] * 100
+            if growth > memory_threshold:
+                regressions.append(
+                    f"{stage}: peak memory {reference['peak_mem_mb']:.1f} -> {result['peak_mem_mb']:.1f} MB (+{growth:.1f}%)"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stages", default=",".join(STAGES), help="Comma-separated subset of: " + ", ".join(STAGES))
+    parser.add_argument("--images", default=TEST_IMAGE_DIR)
+    parser.add_argument("--synthetic", default=DEFAULT_SYNTHETIC, help="Extra JPEG sizes WxH,... ('' to skip)")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=20.0, help="Allowed p50 slowdown in percent")
+    parser.add_argument("--memory-threshold", type=float, default=None, help="Allowed peak-memory growth in percent (off by default)")
+    parser.add_argument("--update-baseline", action="store_true", help="Write these results as the new baseline")
+    parser.add_argument("--allow-missing-baseline", action="store_true",
+                        help="Exit 0 when there is no baseline to compare with (local runs)")
+    parser.add_argument("--json", metavar="PATH", help="Also write the results to PATH")
+    args = parser.parse_args()
+
+    unknown = set(args.stages.split(",")) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(sorted(unknown))}")
+
+    inputs = load_inputs(args.images, args.synthetic)
+    print(f"{len(inputs)} input images, {args.repeat} repeats")
+
+    results = {}
+    for stage in args.stages.split(","):
+        try:
+            calls, items_per_call = STAGES[stage](inputs)
+        except ImportError as e:
+            results[stage] = {"skipped": f"missing dependency: {e.name or e}"}
+            continue
+        results[stage] = measure(calls, items_per_call, args.repeat, args.warmup)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "inputs": [item.name for item in inputs],
+        "repeat": args.repeat,
+        "stages": results,
+    }
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+    regressions = compare(results, baseline, args.threshold, args.memory_threshold) if baseline else []
+
+    width = max(len("stage"), *(len(stage) for stage in results))
+    print(f"{'stage':<{width}} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'items/s':>9} {'peak MB':>8} {'vs base':>8}")
+    for stage, result in results.items():
+        if "skipped" in result:
+            print(f"{stage:<{width}} skipped ({result['skipped']})")
+            continue
+        change = result.get("p50_change_pct")
+        print(
+            f"{stage:<{width}} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+            f"{result['throughput_per_s']:>9.1f} {result['peak_mem_mb']:>8.1f} "
+            f"{(f'{change:+.1f}%' if change is not None else '-'):>8}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as handle:
+            json.dump(report, handle, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, "w") as handle:
+            json.dump(report, handle, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return
+    if baseline is None:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to record one")
+        if not args.allow_missing_baseline:
+            sys.exit(2)
+        return
+    if regressions:
+        print(f"REGRESSIONS (threshold {args.threshold}%):")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print(f"No stage regressed more than {args.threshold}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""Selectable inference engines for the CLIP vision and text towers.
+
+``torch``      eager PyTorch CLIPModel (reference)
+``onnx``       exported ONNX graphs run with ONNX Runtime on CPU
+``onnx-int8``  the same graphs with dynamically quantized int8 weights
+
+All engines take the tensors produced by ``CLIPProcessor`` and return
+unnormalized projection embeddings as torch tensors, exactly like
+``CLIPModel.get_image_features`` / ``get_text_features``.
+
+Usage:
+    python clip_engine.py export [--out-dir clip_onnx]      # write vision/text .onnx + int8 variants
+    python clip_engine.py parity --engine onnx-int8         # compare against eager torch
+"""
+import argparse
+import glob
+import inspect
+import os
+import sys
+
+import numpy as np
+import torch
+from transformers import CLIPModel, CLIPProcessor
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MODEL_NAME = "openai/clip-vit-base-patch32"
+DEFAULT_ONNX_DIR = os.path.join(BASE_DIR, "clip_onnx")
+ENGINES = ("torch", "onnx", "onnx-int8")
+
+# Text prompts scored against every image (app.py and the parity check)
+AI_PROMPTS = [
+    "artificial intelligence generated image", "computer generated artwork",
+    "digital art created by AI", "synthetic image", "AI rendered picture"
+]
+REAL_PROMPTS = [
+    "real photograph", "natural photography", "authentic image",
+    "camera captured photo", "genuine photograph"
+]
+DUSTBIN_CLASSES = [
+    'trash can', 'garbage bin', 'waste basket', 'recycle bin',
+    'dustbin', 'rubbish bin', 'bin', 'container'
+]
+
+
+class TorchClipEngine:
+    """Eager PyTorch reference engine"""
+
+    def __init__(self, model_name=DEFAULT_MODEL_NAME):
+        self.name = "torch"
+        self.model = CLIPModel.from_pretrained(model_name)
+        self.model.eval()
+
+    def image_features(self, pixel_values):
+        with torch.no_grad():
+            return self.model.get_image_features(pixel_values=pixel_values)
+
+    def text_features(self, input_ids, attention_mask=None):
+        with torch.no_grad():
+            return self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+
+class OnnxClipEngine:
+    """ONNX Runtime engine over exported vision/text graphs"""
+
+    def __init__(self, model_dir=DEFAULT_ONNX_DIR, quantized=False, intra_op_threads=0):
+        import onnxruntime as ort
+
+        self.name = "onnx-int8" if quantized else "onnx"
+        suffix = "_int8" if quantized else ""
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        providers = ["CPUExecutionProvider"]
+        vision_path = os.path.join(model_dir, f"vision{suffix}.onnx")
+        text_path = os.path.join(model_dir, f"text{suffix}.onnx")
+        for path in (vision_path, text_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"{path} not found; run `python clip_engine.py export` first")
+        self.vision = ort.InferenceSession(vision_path, options, providers=providers)
+        self.text = ort.InferenceSession(text_path, options, providers=providers)
+
+    def image_features(self, pixel_values):
+        outputs = self.vision.run(None, {"pixel_values": to_numpy(pixel_values, np.float32)})
+        return torch.from_numpy(outputs[0])
+
+    def text_features(self, input_ids, attention_mask=None):
+        if attention_mask is None:
+            attention_mask = torch.ones_like(torch.as_tensor(input_ids))
+        outputs = self.text.run(None, {
+            "input_ids": to_numpy(input_ids, np.int64),
+            "attention_mask": to_numpy(attention_mask, np.int64)
+        })
+        return torch.from_numpy(outputs[0])
+
+
+def to_numpy(tensor, dtype):
+    if hasattr(tensor, "detach"):
+        tensor = tensor.detach().cpu().numpy()
+    return np.ascontiguousarray(tensor, dtype=dtype)
+
+
+def load_clip_engine(name="torch", model_name=DEFAULT_MODEL_NAME, onnx_dir=DEFAULT_ONNX_DIR, intra_op_threads=0):
+    """Engine instance for ``name`` (one of ENGINES)
+
+    ``intra_op_threads`` sizes ONNX Runtime's per-session thread pool (0: one
+    per core); the torch engine takes its thread count from the calling thread.
+    """
+    if name == "torch":
+        return TorchClipEngine(model_name)
+    if name == "onnx":
+        return OnnxClipEngine(onnx_dir, intra_op_threads=intra_op_threads)
+    if name == "onnx-int8":
+        return OnnxClipEngine(onnx_dir, quantized=True, intra_op_threads=intra_op_threads)
+    raise ValueError(f"Unknown CLIP engine {name!r}; expected one of {ENGINES}")
+
+
+# ==================== EXPORT ====================
+
+class _VisionTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model.get_image_features(pixel_values=pixel_values)
+
+
+class _TextTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+
+def export_onnx(model_name=DEFAULT_MODEL_NAME, out_dir=DEFAULT_ONNX_DIR, opset=17, quantize=True):
+    """Write vision.onnx / text.onnx (and *_int8.onnx) for OnnxClipEngine"""
+    model = CLIPModel.from_pretrained(model_name)
+    model.eval()
+    processor = CLIPProcessor.from_pretrained(model_name)
+    os.makedirs(out_dir, exist_ok=True)
+
+    size = processor.image_processor.crop_size["height"]
+    dummy_pixels = torch.zeros(1, 3, size, size)
+    dummy_text = processor(text=["a photo"], return_tensors="pt", padding=True)
+    vision_path = os.path.join(out_dir, "vision.onnx")
+    text_path = os.path.join(out_dir, "text.onnx")
+    # TorchScript exporter (dynamic_axes, single-file graphs); newer torch defaults to dynamo
+    legacy = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+
+    with torch.no_grad():
+        torch.onnx.export(
+            _VisionTower(model), (dummy_pixels,), vision_path, opset_version=opset,
+            input_names=["pixel_values"], output_names=["image_embeds"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}}, **legacy
+        )
+        torch.onnx.export(
+            _TextTower(model), (dummy_text["input_ids"], dummy_text["attention_mask"]), text_path, opset_version=opset,
+            input_names=["input_ids", "attention_mask"], output_names=["text_embeds"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "text_embeds": {0: "batch"}
+            }, **legacy
+        )
+    print(f"Exported {vision_path} and {text_path}")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        for path in (vision_path, text_path):
+            quantized_path = path.replace(".onnx", "_int8.onnx")
+            quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+            print(f"Quantized {quantized_path}")
+
+
+# ==================== PARITY CHECK ====================
+
+def parity_report(engine, reference, processor, images, prompt_groups, duplicate_threshold=0.93):
+    """Compare ``engine`` against ``reference`` on the same preprocessed inputs"""
+    pixel_values = processor(images=images, return_tensors="pt")["pixel_values"]
+    ref_images = torch.nn.functional.normalize(reference.image_features(pixel_values), dim=-1)
+    new_images = torch.nn.functional.normalize(engine.image_features(pixel_values), dim=-1)
+    image_cosines = (ref_images * new_images).sum(dim=-1)
+
+    report = {
+        "images": len(images),
+        "image_cosine_min": image_cosines.min().item(),
+        "image_cosine_mean": image_cosines.mean().item(),
+    }
+
+    # Pairwise image similarity drives the duplicate check
+    ref_pairs = ref_images @ ref_images.T
+    new_pairs = new_images @ new_images.T
+    off_diagonal = ~torch.eye(len(images), dtype=torch.bool)
+    report["pair_similarity_max_abs_delta"] = (ref_pairs - new_pairs)[off_diagonal].abs().max().item() if len(images) > 1 else 0.0
+    report["duplicate_decision_mismatches"] = int(
+        ((ref_pairs > duplicate_threshold) != (new_pairs > duplicate_threshold))[off_diagonal].sum().item()
+    )
+
+    for group, prompts in prompt_groups.items():
+        tokens = processor(text=prompts, return_tensors="pt", padding=True)
+        ref_text = torch.nn.functional.normalize(reference.text_features(tokens["input_ids"], tokens["attention_mask"]), dim=-1)
+        new_text = torch.nn.functional.normalize(engine.text_features(tokens["input_ids"], tokens["attention_mask"]), dim=-1)
+        report[f"{group}_text_cosine_min"] = (ref_text * new_text).sum(dim=-1).min().item()
+        # Image-vs-prompt scores, as used by the dustbin and AI checks
+        report[f"{group}_score_max_abs_delta"] = (ref_images @ ref_text.T - new_images @ new_text.T).abs().max().item()
+        report[f"{group}_best_match_mismatches"] = int(
+            ((ref_images @ ref_text.T).argmax(dim=-1) != (new_images @ new_text.T).argmax(dim=-1)).sum().item()
+        )
+    return report
+
+
+def command_export(args):
+    export_onnx(args.model, args.out_dir, opset=args.opset, quantize=not args.no_quantize)
+
+
+def command_parity(args):
+    from PIL import Image
+
+    processor = CLIPProcessor.from_pretrained(args.model)
+    reference = TorchClipEngine(args.model)
+    engine = load_clip_engine(args.engine, args.model, args.onnx_dir)
+
+    paths = sorted(glob.glob(os.path.join(args.images, "*")))
+    images = [Image.open(path).convert("RGB") for path in paths]
+    prompt_groups = {"dustbin": DUSTBIN_CLASSES, "ai": AI_PROMPTS + REAL_PROMPTS}
+    report = parity_report(engine, reference, processor, images, prompt_groups, args.duplicate_threshold)
+    for key, value in report.items():
+        print(f"{key:<40} {value:.6f}" if isinstance(value, float) else f"{key:<40} {value}")
+
+    failures = []
+    if report["image_cosine_min"] < args.min_cosine:
+        failures.append(f"image cosine {report['image_cosine_min']:.4f} < {args.min_cosine}")
+    for group in prompt_groups:
+        if report[f"{group}_score_max_abs_delta"] > args.max_score_delta:
+            failures.append(f"{group} score delta {report[f'{group}_score_max_abs_delta']:.4f} > {args.max_score_delta}")
+        if report[f"{group}_best_match_mismatches"]:
+            failures.append(f"{group} best-match prompt changed for {report[f'{group}_best_match_mismatches']} image(s)")
+    if report["duplicate_decision_mismatches"]:
+        failures.append(f"{report['duplicate_decision_mismatches']} duplicate decisions changed")
+
+    if failures:
+        print("PARITY FAILED: " + "; ".join(failures))
+        sys.exit(1)
+    print(f"PARITY OK: {args.engine} matches torch within tolerance")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CLIP inference engines")
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--onnx-dir", default=os.getenv("CLIP_ONNX_DIR", DEFAULT_ONNX_DIR))
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export = sub.add_parser("export", help="Export vision/text towers to ONNX (+ int8)")
+    export.add_argument("--out-dir", default=os.getenv("CLIP_ONNX_DIR", DEFAULT_ONNX_DIR))
+    export.add_argument("--opset", type=int, default=17)
+    export.add_argument("--no-quantize", action="store_true")
+    export.set_defaults(func=command_export)
+
+    parity = sub.add_parser("parity", help="Compare an engine against eager torch")
+    parity.add_argument("--engine", choices=ENGINES, default="onnx-int8")
+    parity.add_argument("--images", default=os.path.join(BASE_DIR, "..", "client", "ai_backend", "test"))
+    parity.add_argument("--min-cosine", type=float, default=0.99)
+    parity.add_argument("--max-score-delta", type=float, default=0.01)
+    parity.add_argument("--duplicate-threshold", type=float, default=0.93)
+    parity.set_defaults(func=command_parity)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""ThreadPoolExecutor that counts its own backlog.
+
+``queue_depth()`` is the number of tasks submitted but not yet started,
+kept by a counter raised in ``submit`` and lowered when a worker picks the
+task up (or when it is cancelled before it ever ran), so the metrics don't
+depend on the executor's private work queue.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class CountingThreadPoolExecutor(ThreadPoolExecutor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._depth_lock = threading.Lock()
+        self._queued = 0
+
+    def _dequeued(self):
+        with self._depth_lock:
+            self._queued -= 1
+
+    def submit(self, fn, /, *args, **kwargs):
+        def run():
+            self._dequeued()
+            return fn(*args, **kwargs)
+
+        with self._depth_lock:
+            self._queued += 1
+        try:
+            future = super().submit(run)
+        except BaseException:
+            self._dequeued()
+            raise
+        # Only a task still queued can be cancelled (cancel() or shutdown(cancel_futures=True))
+        future.add_done_callback(lambda done: done.cancelled() and self._dequeued())
+        return future
+
+    def queue_depth(self):
+        """Tasks submitted but not yet picked up by a worker"""
+        with self._depth_lock:
+            return self._queued
@@ -0,0 +1,234 @@
+"""In-memory per-user duplicate index.
+
+Each user's approved images are held as a contiguous float32 embedding
+matrix plus a uint64 array of packed pHashes, so a duplicate check is one
+matrix-vector product and one vectorized popcount instead of a Python loop
+over Mongo documents. Users are LRU-evicted; a miss reloads the user's full
+history (not just the last 100 images) through the supplied loader. With a
+``refresher``, every check first tops a resident user up with documents
+written since the newest one it holds, so images saved by other processes
+are seen without a full reload.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from embedding_codec import decode_embedding
+
+EMBEDDING_DIM = 512
+PHASH_BITS = 64
+# First allocation for a user with any images; capacity then doubles (2 KB per row)
+MIN_CAPACITY = 4
+
+# Per-byte popcount for numpy builds without np.bitwise_count
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def phash_to_int(phash):
+    """Pack a hex pHash string (or imagehash object) into an unsigned 64-bit int"""
+    if phash is None:
+        return None
+    return int(str(phash), 16) & ((1 << PHASH_BITS) - 1)
+
+
+def popcount64(values):
+    """Number of set bits in every element of a uint64 array"""
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+
+
+def to_embedding_vector(embedding, dim=EMBEDDING_DIM):
+    """Flatten a torch tensor / list / array embedding into a float32 vector"""
+    if embedding is None:
+        return None
+    if hasattr(embedding, "detach"):
+        embedding = embedding.detach().cpu().numpy()
+    vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    if vector.shape[0] != dim:
+        return None
+    return vector
+
+
+class UserDuplicateIndex:
+    """Embeddings and pHashes of one user's approved images"""
+
+    def __init__(self, dim=EMBEDDING_DIM, capacity=0):
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._size = 0
+        self._embeddings = np.zeros((capacity, dim), dtype=np.float32)
+        self._phashes = np.zeros(capacity, dtype=np.uint64)
+        self._has_phash = np.zeros(capacity, dtype=bool)
+        self._image_urls = []
+        self._doc_ids = set()
+        self.newest = None
+        self.loaded = threading.Event()
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self, needed):
+        capacity = self._embeddings.shape[0]
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2, MIN_CAPACITY)
+        embeddings = np.zeros((new_capacity, self.dim), dtype=np.float32)
+        embeddings[:self._size] = self._embeddings[:self._size]
+        phashes = np.zeros(new_capacity, dtype=np.uint64)
+        phashes[:self._size] = self._phashes[:self._size]
+        has_phash = np.zeros(new_capacity, dtype=bool)
+        has_phash[:self._size] = self._has_phash[:self._size]
+        self._embeddings, self._phashes, self._has_phash = embeddings, phashes, has_phash
+
+    def add(self, embedding, phash, image_url=None, doc_id=None, created_at=None):
+        """Append one image; a missing embedding or pHash simply never matches"""
+        vector = to_embedding_vector(embedding, self.dim)
+        packed = phash_to_int(phash)
+        with self._lock:
+            if doc_id is not None:
+                if doc_id in self._doc_ids:
+                    return
+                self._doc_ids.add(doc_id)
+            if created_at is not None and (self.newest is None or created_at > self.newest):
+                self.newest = created_at
+            self._grow(self._size + 1)
+            row = self._size
+            self._embeddings[row] = vector if vector is not None else 0.0
+            self._phashes[row] = packed if packed is not None else 0
+            self._has_phash[row] = packed is not None
+            self._image_urls.append(image_url)
+            self._size += 1
+
+    def add_document(self, doc):
+        """Append a Mongo user_images document"""
+        self.add(decode_embedding(doc), doc.get("phash"), doc.get("image_url"), doc.get("_id"), doc.get("created_at"))
+
+    def query(self, embedding, phash, phash_threshold, clip_threshold):
+        """Return (is_duplicate, method, score, matched_image_url)"""
+        vector = to_embedding_vector(embedding, self.dim)
+        packed = phash_to_int(phash)
+        with self._lock:
+            n = self._size
+            if n == 0:
+                return False, None, 0.0, None
+
+            if packed is not None:
+                distances = popcount64(self._phashes[:n] ^ np.uint64(packed))
+                distances = np.where(self._has_phash[:n], distances, PHASH_BITS + 1)
+                best = int(np.argmin(distances))
+                if distances[best] <= phash_threshold:
+                    score = 1.0 - float(distances[best]) / PHASH_BITS
+                    return True, "phash", score, self._image_urls[best]
+
+            if vector is not None:
+                similarities = self._embeddings[:n] @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] > clip_threshold:
+                    return True, "clip", float(similarities[best]), self._image_urls[best]
+
+        return False, None, 0.0, None
+
+
+class DuplicateIndexCache:
+    """LRU cache of UserDuplicateIndex objects keyed by user id.
+
+    ``loader(user_id)`` must yield the user's stored image documents; it is
+    called once per cache miss and concurrent misses for the same user wait
+    for that single load. ``refresher(user_id, since)`` (optional) yields
+    documents with ``created_at >= since``; already-held ids are skipped.
+    """
+
+    def __init__(self, loader, max_users=2048, phash_threshold=5, clip_threshold=0.93, dim=EMBEDDING_DIM,
+                 refresher=None):
+        self.loader = loader
+        self.refresher = refresher
+        self.max_users = max_users
+        self.phash_threshold = phash_threshold
+        self.clip_threshold = clip_threshold
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._synced = 0
+
+    def _get(self, user_id):
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None:
+                self._users.move_to_end(user_id)
+                self._hits += 1
+                owner = False
+            else:
+                index = UserDuplicateIndex(self.dim)
+                self._users[user_id] = index
+                self._misses += 1
+                owner = True
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+                    self._evictions += 1
+
+        if not owner:
+            index.loaded.wait()
+            return index
+
+        try:
+            for doc in self.loader(user_id):
+                index.add_document(doc)
+        except Exception as e:
+            print(f"Duplicate index load error for {user_id}: {e}")
+            # Drop the partial index so the next request retries the load
+            with self._lock:
+                if self._users.get(user_id) is index:
+                    del self._users[user_id]
+        finally:
+            index.loaded.set()
+        return index
+
+    def check(self, user_id, embedding, phash):
+        """Return (is_duplicate, method, score, matched_image_url) for a user"""
+        index = self._get(user_id)
+        if self.refresher is not None:
+            self._sync(user_id, index)
+        return index.query(embedding, phash, self.phash_threshold, self.clip_threshold)
+
+    def _sync(self, user_id, index):
+        try:
+            before = len(index)
+            for doc in self.refresher(user_id, index.newest):
+                index.add_document(doc)
+            with self._lock:
+                self._synced += len(index) - before
+        except Exception as e:
+            # Check against what we hold rather than failing the request
+            print(f"Duplicate index sync error for {user_id}: {e}")
+
+    def add(self, user_id, embedding, phash, image_url=None, doc_id=None, created_at=None):
+        """Record a newly approved image if the user is resident.
+
+        Non-resident users pick the image up from the loader on their next miss.
+        """
+        with self._lock:
+            index = self._users.get(user_id)
+        if index is not None:
+            index.add(embedding, phash, image_url, doc_id, created_at)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "max_users": self.max_users,
+                "images": sum(len(index) for index in self._users.values()),
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "synced": self._synced,
+            }
@@ -0,0 +1,67 @@
+"""Storage formats for CLIP embeddings in the user_images collection.
+
+``list``     BSON array of 512 doubles (legacy, ~5 KB per image)
+``float16``  BSON Binary of 512 little-endian float16 values (1 KB)
+``int8``     BSON Binary of 512 int8 values plus ``clip_embedding_scale`` (512 B)
+
+Binary formats record ``clip_embedding_format`` next to the bytes, so
+``decode_embedding`` can read documents in any format during a rollout.
+"""
+import numpy as np
+from bson.binary import Binary
+
+EMBEDDING_FORMATS = ("list", "float16", "int8")
+
+# Fields a reader must project to decode any format
+EMBEDDING_FIELDS = {"clip_embedding": 1, "clip_embedding_format": 1, "clip_embedding_scale": 1}
+
+
+def to_vector(embedding):
+    """Flatten a torch tensor / list / array into a float32 vector"""
+    if hasattr(embedding, "detach"):
+        embedding = embedding.detach().cpu().numpy()
+    return np.asarray(embedding, dtype=np.float32).reshape(-1)
+
+
+def encode_embedding(embedding, storage_format="list"):
+    """Document fields storing ``embedding`` in ``storage_format``"""
+    vector = to_vector(embedding)
+    if storage_format == "list":
+        return {"clip_embedding": vector.tolist()}
+    if storage_format == "float16":
+        return {
+            "clip_embedding": Binary(vector.astype("<f2").tobytes()),
+            "clip_embedding_format": "float16"
+        }
+    if storage_format == "int8":
+        # Symmetric per-vector quantization; the scale maps 127 back to max |x|
+        scale = float(np.abs(vector).max()) / 127.0 or 1.0
+        quantized = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+        return {
+            "clip_embedding": Binary(quantized.tobytes()),
+            "clip_embedding_format": "int8",
+            "clip_embedding_scale": scale
+        }
+    raise ValueError(f"Unknown embedding storage format: {storage_format}")
+
+
+def decode_embedding(doc):
+    """float32 vector from a user_images document in any format, or None"""
+    value = doc.get("clip_embedding")
+    if value is None:
+        return None
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        storage_format = doc.get("clip_embedding_format", "float16")
+        if storage_format == "int8":
+            return np.frombuffer(value, dtype=np.int8).astype(np.float32) * np.float32(doc.get("clip_embedding_scale", 1.0))
+        if storage_format == "float16":
+            return np.frombuffer(value, dtype="<f2").astype(np.float32)
+        raise ValueError(f"Unknown embedding storage format: {storage_format}")
+    return np.asarray(value, dtype=np.float32).reshape(-1)
+
+
+def embedding_format(doc):
+    """Storage format of a document's embedding"""
+    if isinstance(doc.get("clip_embedding"), (bytes, bytearray, memoryview)):
+        return doc.get("clip_embedding_format", "float16")
+    return "list"
@@ -0,0 +1,145 @@
+"""In-memory face verification with cached profile embeddings.
+
+Faces are detected and embedded straight from decoded arrays with
+``DeepFace.represent``; nothing is written to disk. The profile side of a
+comparison is cached per user, keyed by a hash of the profile image bytes,
+so a submission costs one detection + one embedding + a cosine distance.
+A profile URL seen again within ``source_ttl`` seconds is not even
+re-downloaded; after that its bytes are re-hashed and the embedding is
+reused if they are unchanged.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from deepface import DeepFace
+
+FACE_MODEL_NAME = "VGG-Face"
+FACE_DETECTOR_BACKEND = "opencv"
+# DeepFace's cosine threshold for VGG-Face
+FACE_DISTANCE_THRESHOLD = 0.68
+
+
+def represent_faces(pil_image, model_name=FACE_MODEL_NAME, detector_backend=FACE_DETECTOR_BACKEND):
+    """[(embedding, face_area)] for every face in an RGB PIL image"""
+    bgr = np.ascontiguousarray(np.asarray(pil_image.convert("RGB"))[:, :, ::-1])
+    faces = DeepFace.represent(
+        img_path=bgr,
+        model_name=model_name,
+        detector_backend=detector_backend,
+        enforce_detection=False
+    )
+    return [
+        (np.asarray(face["embedding"], dtype=np.float32),
+         face.get("facial_area", {}).get("w", 0) * face.get("facial_area", {}).get("h", 0))
+        for face in faces
+    ]
+
+
+def cosine_distance(a, b):
+    return 1.0 - float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-12))
+
+
+class FaceVerifier:
+    """Face matching against per-user cached profile embeddings (LRU by user)"""
+
+    def __init__(self, read_bytes, decode, max_users=1024, source_ttl=600.0,
+                 threshold=FACE_DISTANCE_THRESHOLD, model_name=FACE_MODEL_NAME,
+                 detector_backend=FACE_DETECTOR_BACKEND, run_model=None):
+        self.read_bytes = read_bytes
+        self.decode = decode
+        self.max_users = max_users
+        self.source_ttl = source_ttl
+        self.threshold = threshold
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        # run_model(fn, *args) executes the DeepFace call, e.g. in a CPU partition
+        self.run_model = run_model
+        self._lock = threading.Lock()
+        self._profiles = OrderedDict()
+        self._source_hits = 0
+        self._content_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def embed(self, pil_image):
+        if self.run_model is not None:
+            return self.run_model(represent_faces, pil_image, self.model_name, self.detector_backend)
+        return represent_faces(pil_image, self.model_name, self.detector_backend)
+
+    def profile_embedding(self, user_id, source):
+        """Embedding of the largest face in the user's profile image"""
+        url = source if isinstance(source, str) else None
+        with self._lock:
+            entry = self._profiles.get(user_id)
+            if (entry is not None and url is not None and entry["url"] == url
+                    and time.monotonic() - entry["checked_at"] <= self.source_ttl):
+                self._profiles.move_to_end(user_id)
+                self._source_hits += 1
+                return entry["embedding"]
+
+        data = self.read_bytes(source)
+        content_hash = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            entry = self._profiles.get(user_id)
+            if entry is not None and entry["content_hash"] == content_hash:
+                entry.update(url=url, checked_at=time.monotonic())
+                self._profiles.move_to_end(user_id)
+                self._content_hits += 1
+                return entry["embedding"]
+
+        faces = self.embed(self.decode(data))
+        if not faces:
+            raise ValueError("No face representation for profile image")
+        embedding = max(faces, key=lambda face: face[1])[0]
+
+        with self._lock:
+            self._profiles[user_id] = {
+                "url": url,
+                "content_hash": content_hash,
+                "embedding": embedding,
+                "checked_at": time.monotonic()
+            }
+            self._profiles.move_to_end(user_id)
+            self._misses += 1
+            while len(self._profiles) > self.max_users:
+                self._profiles.popitem(last=False)
+                self._evictions += 1
+        return embedding
+
+    def verify(self, pil_image, reference_embedding):
+        """Closest face in ``pil_image`` against a reference embedding"""
+        faces = self.embed(pil_image)
+        if not faces:
+            return {"verified": False, "distance": None, "threshold": self.threshold}
+        distance = min(cosine_distance(embedding, reference_embedding) for embedding, _ in faces)
+        return {
+            "verified": distance <= self.threshold,
+            "distance": distance,
+            "threshold": self.threshold
+        }
+
+    def verify_images(self, pil_image1, pil_image2):
+        """Uncached comparison of two images (largest face in the second)"""
+        reference = self.embed(pil_image2)
+        if not reference:
+            return {"verified": False, "distance": None, "threshold": self.threshold}
+        return self.verify(pil_image1, max(reference, key=lambda face: face[1])[0])
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._profiles.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cached_profiles": len(self._profiles),
+                "max_users": self.max_users,
+                "source_ttl_seconds": self.source_ttl,
+                "source_hits": self._source_hits,
+                "content_hits": self._content_hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
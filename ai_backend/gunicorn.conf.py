@@ -0,0 +1,84 @@
+"""Pre-fork serving: gunicorn -c gunicorn.conf.py app:app
+
+The master imports app.py once (preload_app) and loads CLIP, YOLO, the
+prompt embeddings and the pHash index eagerly; app.prepare_for_fork() then
+gc.freeze()s the heap and the workers fork from it. Tensor storage is never
+written after loading, so those pages stay shared copy-on-write: each extra
+worker costs its private heap (request buffers, per-process caches, torch
+scratch memory), not another copy of the weights. Compare Pss / private
+memory, not Rss, when sizing: Rss counts shared pages in every worker.
+
+Not shared:
+  * VGG-Face runs on TensorFlow, which isn't fork-safe once initialized, so
+    it is loaded by each worker after fork (MODEL_WORKER_ONLY=face).
+    MODEL_WORKER_ONLY= shares it too, at your own risk.
+  * With CLIP_ENGINE=onnx / onnx-int8 each worker recreates its ONNX Runtime
+    sessions (their thread pools don't survive fork).
+  * The per-user duplicate index is per worker; DUPLICATE_INDEX_SYNC=true
+    (set here) tops it up from MongoDB on each check so a sibling worker's
+    saves are seen. The cross-user pHash index only sees sibling inserts on
+    restart; the cross-user CLIP check reads the shared on-disk ANN delta.
+  * Job queue workers (POST /jobs) run in every worker and share the SQLite
+    job database, so JOB_WORKERS is per worker.
+
+Each worker gets CPU_COUNT / workers torch threads unless TORCH_NUM_THREADS
+is set, and its per-model inference partitions (app.py, INFERENCE_PARTITIONS)
+split that same share unless INFERENCE_CPU_BUDGET is set, so N workers don't
+oversubscribe the box. Explicit cores= pins apply to every worker alike.
+
+Memory per worker and the throughput curve for this box:
+    python benchmarks/prefork_report.py --workers 1,2,4,8
+
+Measured with it on a 1-CPU, 6 GB sandbox (MONGODB_URI=mongomock://,
+/analyze_ai_only, 4 clients per worker, 20 s). These are RANDOM-WEIGHT
+numbers: the real checkpoints couldn't be downloaded there, so randomly
+initialised models of the same architectures (CLIP ViT-B/32, YOLOv8n,
+VGG-Face) stood in. Parameter memory matches; latency is only indicative.
+
+    workers  req/s  p50 ms  worker Pss MB  worker private MB  total Pss MB
+          1    7.1     591           2125               1555          3372
+          2    6.6    1052           1960               1528          4291
+          3   0.04    4527           1743               1500          3787 *
+
+    * one worker OOM-killed mid-run; memory is for the two that survived
+
+About 1.5 GB of each worker is private, almost all of it the per-worker
+VGG-Face: importing TensorFlow and building that model alone takes ~2.0 GB
+private in a fresh process. With one core, a second worker adds no
+throughput. On 6 GB, three workers don't fit: the kernel OOM-killed workers
+(~2.5 GB anon RSS each) and 12 of 48 requests failed. Budget ~1.5 GB per
+worker on top of the master's shared pages.
+"""
+import multiprocessing
+import os
+
+# The master must finish loading before it forks; see app.prepare_for_fork
+os.environ.setdefault("MODEL_LOADING", "eager")
+os.environ.setdefault("MODEL_WORKER_ONLY", "face")
+os.environ.setdefault("DUPLICATE_INDEX_SYNC", "true")
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", str(max(1, multiprocessing.cpu_count() // 4))))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+preload_app = True
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+
+
+def when_ready(server):
+    import app
+
+    app.prepare_for_fork()
+
+
+def post_fork(server, worker):
+    import torch
+
+    import app
+
+    per_worker = max(1, multiprocessing.cpu_count() // server.cfg.workers)
+    torch.set_num_threads(int(os.getenv("TORCH_NUM_THREADS", "0")) or per_worker)
+    # Each worker's inference partitions split its share of the cores
+    os.environ.setdefault("INFERENCE_CPU_BUDGET", str(per_worker))
+    app.reinit_after_fork()
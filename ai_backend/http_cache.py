@@ -0,0 +1,198 @@
+"""Disk cache of downloaded image bytes, keyed by URL and shared by processes.
+
+Each entry is one file, ``<root>/<key[:2]>/<key>``, holding a length-prefixed
+JSON header (URL, ETag, Last-Modified, freshness deadline) followed by the
+body. Entries are written to a temporary file and ``os.replace``d into place,
+so concurrent workers only ever see whole entries. A file's mtime is its
+last use: hits touch it, and when the directory grows past ``max_bytes`` the
+least recently used files are deleted down to ``low_water`` of the limit
+(one process at a time, under an flock).
+
+Freshness follows the response: ``Cache-Control: no-store`` is never
+cached, ``no-cache`` is always revalidated, ``max-age`` sets the lifetime,
+and anything else is served without revalidation for ``fresh_seconds``.
+A stale entry is revalidated with If-None-Match / If-Modified-Since, so an
+unchanged image costs a 304 instead of its body.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import time
+
+HEADER_LENGTH = struct.Struct(">I")
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+def response_lifetime(headers, default):
+    """Seconds a response may be served without revalidation; None if it must not be stored"""
+    cache_control = headers.get("Cache-Control", "").lower()
+    if "no-store" in cache_control:
+        return None
+    if "no-cache" in cache_control:
+        return 0
+    match = _MAX_AGE.search(cache_control)
+    return int(match.group(1)) if match else default
+
+
+class CacheEntry:
+    __slots__ = ("meta", "body")
+
+    def __init__(self, meta, body):
+        self.meta = meta
+        self.body = body
+
+    @property
+    def fresh(self):
+        return time.time() < self.meta["fresh_until"]
+
+    def validators(self):
+        """Conditional request headers for revalidation"""
+        headers = {}
+        if self.meta.get("etag"):
+            headers["If-None-Match"] = self.meta["etag"]
+        if self.meta.get("last_modified"):
+            headers["If-Modified-Since"] = self.meta["last_modified"]
+        return headers
+
+
+class DiskHttpCache:
+    def __init__(self, root, max_bytes=512 * 1024 * 1024, fresh_seconds=60, low_water=0.8):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.fresh_seconds = fresh_seconds
+        self.low_water = low_water
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "revalidated": 0, "misses": 0, "stores": 0, "evictions": 0}
+        # Approximate (other processes write too); a full scan corrects it on eviction
+        self._size = self._scan_size()
+
+    def _path(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.root, key[:2], key)
+
+    def _count(self, stat, amount=1):
+        with self._lock:
+            self._stats[stat] += amount
+
+    def get(self, url):
+        """The stored entry for ``url`` (fresh or stale), or None"""
+        path = self._path(url)
+        try:
+            with open(path, "rb") as handle:
+                data = handle.read()
+            meta_length = HEADER_LENGTH.unpack_from(data)[0]
+            meta = json.loads(data[HEADER_LENGTH.size:HEADER_LENGTH.size + meta_length])
+        except (OSError, ValueError, struct.error):
+            return None
+        if meta.get("url") != url:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return CacheEntry(meta, data[HEADER_LENGTH.size + meta_length:])
+
+    def put(self, url, body, headers):
+        """Store a 200 response; skipped when it's uncacheable"""
+        lifetime = response_lifetime(headers, self.fresh_seconds)
+        etag, last_modified = headers.get("ETag"), headers.get("Last-Modified")
+        if lifetime is None or (lifetime == 0 and not etag and not last_modified):
+            return
+        self._write(url, body, {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fresh_until": time.time() + lifetime,
+        })
+        self._count("stores")
+
+    def revalidated(self, url, entry, headers):
+        """Record a 304: extend the entry's lifetime (validators may be updated)"""
+        lifetime = response_lifetime(headers, self.fresh_seconds)
+        if lifetime is None:
+            return
+        meta = dict(entry.meta, fresh_until=time.time() + lifetime)
+        meta["etag"] = headers.get("ETag") or meta.get("etag")
+        meta["last_modified"] = headers.get("Last-Modified") or meta.get("last_modified")
+        self._write(url, entry.body, meta)
+
+    def record(self, outcome):
+        """Count a lookup outcome ("hits", "revalidated" or "misses")"""
+        self._count(outcome)
+
+    def _write(self, url, body, meta):
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        header = json.dumps(meta).encode()
+        tmp_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+        try:
+            with open(tmp_path, "wb") as handle:
+                handle.write(HEADER_LENGTH.pack(len(header)))
+                handle.write(header)
+                handle.write(body)
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Image cache write error: {e}")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._size += HEADER_LENGTH.size + len(header) + len(body) - replaced
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _entries(self):
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if ".tmp" in entry.name:
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield entry.path, stat.st_size, stat.st_mtime
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Delete least recently used entries until the cache is under low_water * max_bytes"""
+        with open(os.path.join(self.root, ".evict.lock"), "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # another process is already evicting
+            entries = sorted(self._entries(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * self.low_water
+            evicted = 0
+            for path, size, _ in entries:
+                if total <= target:
+                    break
+                try:
+                    os.unlink(path)
+                    evicted += 1
+                except FileNotFoundError:
+                    pass
+                total -= size
+        with self._lock:
+            self._size = total
+            self._stats["evictions"] += evicted
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, bytes=self._size, max_bytes=self.max_bytes)
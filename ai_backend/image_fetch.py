@@ -0,0 +1,95 @@
+"""Pooled, size-capped image downloads.
+
+One ``requests.Session`` keeps a pool of persistent connections per host,
+so repeated fetches from the same object store skip the TCP/TLS handshake.
+Bodies are streamed with a byte cap and rejected early when the declared
+Content-Length is already too large. ``fetch_many`` downloads a batch
+concurrently and decodes each image on its download thread as soon as its
+bytes arrive, overlapping decode with the remaining downloads.
+
+With a ``cache`` (http_cache.DiskHttpCache), fresh entries are served from
+disk and stale ones are revalidated with a conditional GET.
+"""
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from counting_executor import CountingThreadPoolExecutor
+
+
+class ImageTooLargeError(ValueError):
+    pass
+
+
+class ImageFetcher:
+    def __init__(self, max_bytes=20 * 1024 * 1024, timeout=10, pool_connections=16, pool_maxsize=32,
+                 max_workers=8, retries=2, chunk_size=64 * 1024, cache=None):
+        self.max_bytes = max_bytes
+        self.cache = cache
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=Retry(total=retries, backoff_factor=0.2, status_forcelist=(502, 503, 504),
+                              allowed_methods=frozenset(["GET"]))
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = CountingThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-fetch")
+
+    def fetch(self, url):
+        """Download ``url`` into bytes (or reuse the cached copy), aborting once it exceeds ``max_bytes``"""
+        if self.cache is None:
+            return self._download(url)[0]
+        entry = self.cache.get(url)
+        if entry is not None and entry.fresh:
+            self.cache.record("hits")
+            return entry.body
+        body, response = self._download(url, entry.validators() if entry is not None else None)
+        if body is None:
+            self.cache.record("revalidated")
+            self.cache.revalidated(url, entry, response.headers)
+            return entry.body
+        self.cache.record("misses")
+        self.cache.put(url, body, response.headers)
+        return body
+
+    def _download(self, url, conditional=None):
+        """(body, response); body is None on a 304 to a conditional request"""
+        with self.session.get(url, timeout=self.timeout, stream=True, headers=conditional) as response:
+            if conditional and response.status_code == 304:
+                return None, response
+            response.raise_for_status()
+            declared = response.headers.get("Content-Length")
+            if declared and declared.isdigit() and int(declared) > self.max_bytes:
+                raise ImageTooLargeError(f"Image is {declared} bytes, limit is {self.max_bytes}")
+            body = bytearray()
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                body.extend(chunk)
+                if len(body) > self.max_bytes:
+                    raise ImageTooLargeError(f"Image exceeds {self.max_bytes} bytes")
+            return bytes(body), response
+
+    def submit(self, fn, *args, **kwargs):
+        """Run ``fn`` on the download pool"""
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def queue_depth(self):
+        """Downloads waiting for a free worker"""
+        return self._executor.queue_depth()
+
+    def fetch_many(self, sources, decode=None, fetch=None):
+        """Start fetching every source concurrently; one Future per source, in order.
+
+        ``fetch`` defaults to ``self.fetch``; ``decode`` (if given) runs on the
+        bytes in the same worker, right after that source's download finishes.
+        """
+        fetch = fetch or self.fetch
+
+        def load(source):
+            data = fetch(source)
+            return decode(data) if decode is not None else data
+
+        return [self._executor.submit(load, source) for source in sources]
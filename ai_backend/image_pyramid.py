@@ -0,0 +1,95 @@
+"""Reduced-resolution decode and a per-image pyramid shared by all stages.
+
+No stage looks at more than ~640 px: YOLO letterboxes to 640, CLIP resizes
+the short side to 224, the AI analysis works on 256x256 grayscale and pHash
+on 32x32 grayscale. ``decode_reduced`` asks the JPEG decoder for the smallest
+DCT scale (1/2, 1/4, 1/8) that still covers those sizes and box-reduces other
+formats, so a 12 MP phone photo never materializes at full size.
+``ImagePyramid`` then derives each stage's input once.
+"""
+import io
+import math
+import threading
+
+from PIL import Image
+
+DETECT_SIZE = 640   # long side fed to YOLO
+CLIP_SIZE = 224     # short side fed to the CLIP processor
+ANALYSIS_SIZE = 256  # square grayscale for the statistical / FFT checks
+PHASH_SIZE = 32     # imagehash.phash works on 32x32 grayscale
+
+
+def required_size(width, height, min_long=DETECT_SIZE, min_short=CLIP_SIZE):
+    """Smallest (w, h) with the same aspect that keeps long >= min_long and short >= min_short"""
+    long_side, short_side = max(width, height), min(width, height)
+    scale = max(min_long / long_side, min_short / short_side)
+    if scale >= 1.0:
+        return width, height
+    return math.ceil(width * scale), math.ceil(height * scale)
+
+
+def decode_reduced(data, min_long=DETECT_SIZE, min_short=CLIP_SIZE):
+    """Decode image bytes to RGB at no more than ~2x the largest stage resolution"""
+    image = Image.open(io.BytesIO(data))
+    target = required_size(image.width, image.height, min_long, min_short)
+    if target != image.size and image.format == "JPEG":
+        # DCT-domain downscale: decoded size stays >= target
+        image.draft("RGB", target)
+    image = image.convert("RGB")
+
+    factor = min(image.width // target[0], image.height // target[1])
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image
+
+
+class ImagePyramid:
+    """Stage-sized views of one decoded image, each built at most once"""
+
+    def __init__(self, base):
+        self.base = base
+        self._levels = {}
+        # Reentrant: the grayscale levels are built from the detect level
+        self._lock = threading.RLock()
+
+    def _level(self, name, build):
+        level = self._levels.get(name)
+        if level is None:
+            with self._lock:
+                level = self._levels.get(name)
+                if level is None:
+                    level = build()
+                    self._levels[name] = level
+        return level
+
+    @property
+    def detect(self):
+        """RGB with long side <= DETECT_SIZE, for object detection"""
+        def build():
+            width, height = self.base.size
+            scale = DETECT_SIZE / max(width, height)
+            if scale >= 1.0:
+                return self.base
+            return self.base.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.BILINEAR)
+        return self._level("detect", build)
+
+    @property
+    def clip(self):
+        """RGB with short side == CLIP_SIZE (bicubic, like the CLIP processor)"""
+        def build():
+            width, height = self.base.size
+            scale = CLIP_SIZE / min(width, height)
+            if scale >= 1.0:
+                return self.base
+            return self.base.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.BICUBIC)
+        return self._level("clip", build)
+
+    @property
+    def analysis_gray(self):
+        """ANALYSIS_SIZE x ANALYSIS_SIZE grayscale"""
+        return self._level("analysis", lambda: self.detect.convert("L").resize((ANALYSIS_SIZE, ANALYSIS_SIZE)))
+
+    @property
+    def phash_gray(self):
+        """PHASH_SIZE x PHASH_SIZE grayscale, matching imagehash.phash's own resize"""
+        return self._level("phash", lambda: self.detect.convert("L").resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS))
@@ -0,0 +1,139 @@
+"""Write path for approved image records.
+
+``write`` stores one document and ``write_many`` a batch with a single
+``insert_many(ordered=False)``. Ids are assigned client-side, so callers can
+index a document before it reaches MongoDB and a retried insert can't
+create a second copy (it fails with a duplicate-key error instead).
+
+Modes:
+  sync      every call inserts before returning (default; an approved
+            response means the record is durable)
+  buffered  write-behind: documents are queued and flushed by a background
+            thread once ``max_batch`` are pending or every ``flush_interval``
+            seconds. A crash loses at most the unflushed buffer. ``pending``
+            exposes queued documents so readers (the duplicate index loader)
+            can merge them with what's already in MongoDB.
+"""
+import atexit
+import os
+import threading
+from collections import deque
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+WRITE_MODES = ("sync", "buffered")
+DUPLICATE_KEY_ERROR = 11000
+
+
+class ImageWriter:
+    def __init__(self, collection, mode="sync", max_batch=64, flush_interval=0.2, max_pending=10000):
+        """``collection`` is a callable returning the current collection (it's replaced after fork)"""
+        if mode not in WRITE_MODES:
+            raise ValueError(f"mode must be one of {WRITE_MODES}")
+        self.collection = collection
+        self.mode = mode
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        self._stats = {"written": 0, "batches": 0, "failed": 0, "flush_errors": 0}
+        if mode == "buffered":
+            atexit.register(self.flush)
+
+    def _ensure_flusher(self):
+        # Started lazily so a forked worker gets its own thread
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self._flush_loop, name="image-writer", daemon=True).start()
+
+    def write(self, doc):
+        """Store one document; returns its id"""
+        doc.setdefault("_id", ObjectId())
+        if self.mode == "sync":
+            self.collection().insert_one(doc)
+            with self._lock:
+                self._stats["written"] += 1
+            return doc["_id"]
+        self._enqueue([doc])
+        return doc["_id"]
+
+    def write_many(self, docs):
+        """Store a batch; returns {index: error} for documents that failed (sync mode only)"""
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+        if not docs:
+            return {}
+        if self.mode == "buffered":
+            self._enqueue(docs)
+            return {}
+        return self._insert(docs)
+
+    def _enqueue(self, docs):
+        self._ensure_flusher()
+        with self._lock:
+            self._pending.extend(docs)
+            pending = len(self._pending)
+        if pending >= self.max_pending:
+            # Backpressure: MongoDB is falling behind, flush on the caller's thread
+            self.flush()
+        elif pending >= self.max_batch:
+            self._wake.set()
+
+    def _insert(self, docs):
+        """insert_many(ordered=False); returns {index: error} for rejected documents"""
+        try:
+            self.collection().insert_many(docs, ordered=False)
+            errors = {}
+        except BulkWriteError as e:
+            errors = {
+                error["index"]: error.get("errmsg", "write error")
+                for error in e.details.get("writeErrors", [])
+                # Already stored by an earlier attempt
+                if error.get("code") != DUPLICATE_KEY_ERROR
+            }
+        with self._lock:
+            self._stats["written"] += len(docs) - len(errors)
+            self._stats["failed"] += len(errors)
+            self._stats["batches"] += 1
+        for index, message in errors.items():
+            print(f"Image record {docs[index]['_id']} rejected: {message}")
+        return errors
+
+    def flush(self):
+        """Write everything queued so far; on a connection error the batch stays queued"""
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._pending[i] for i in range(min(self.max_batch, len(self._pending)))]
+                if not batch:
+                    return
+                try:
+                    self._insert(batch)
+                except Exception as e:
+                    with self._lock:
+                        self._stats["flush_errors"] += 1
+                    print(f"Image write flush error: {e}")
+                    return
+                with self._lock:
+                    for _ in batch:
+                        self._pending.popleft()
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def pending(self, user_id=None):
+        """Documents queued but not yet in MongoDB (optionally for one user)"""
+        with self._lock:
+            return [doc for doc in self._pending if user_id is None or doc.get("user_id") == user_id]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, mode=self.mode, pending=len(self._pending))
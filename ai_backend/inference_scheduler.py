@@ -0,0 +1,167 @@
+"""Per-model CPU partitions for concurrent inference.
+
+Every model call goes through ``InferenceScheduler.run(model, fn, ...)``,
+which executes it on that model's own small thread pool:
+
+  concurrency  pool size: at most this many calls of the model run at once,
+               the rest queue
+  cores        optional CPU set the pool threads are pinned to, e.g. "0-7"
+               or "0-3,8-11"; threads they start (OpenMP / ONNX Runtime
+               workers created from a pinned thread) inherit the mask
+  threads      intra-op thread budget for engines that size their own pool
+               per session: app.py passes the CLIP partition's threads to
+               ONNX Runtime (intra_op_num_threads)
+
+PyTorch's intra-op thread count is not per thread. On the OpenMP build a
+torch.set_num_threads on one pool thread changes torch.get_num_threads() on
+every other worker thread (last call wins), so it can't differ between
+partitions and the scheduler leaves it alone: it is set per process
+(gunicorn.conf.py's post_fork), and torch models are kept apart by
+concurrency and cores. TensorFlow (face) likewise only honours those two.
+
+All of it comes from one spec string (INFERENCE_PARTITIONS in app.py), for
+example:
+
+    clip:threads=8,concurrency=1,cores=0-7;yolo:concurrency=2,cores=8-11;face:cores=12-15
+
+Models not named in the spec get a share of the CPU budget from
+DEFAULT_SHARES, concurrency 1 and no pinning. A call made from a pool thread
+of the same model (nesting) runs inline instead of queueing behind itself.
+
+Throughput / latency of different partitions on this box:
+    python benchmarks/partition_report.py
+"""
+import os
+import threading
+import time
+
+from counting_executor import CountingThreadPoolExecutor
+
+DEFAULT_SHARES = {"clip": 0.5, "yolo": 0.25, "face": 0.25}
+PARTITION_KEYS = ("threads", "concurrency", "cores")
+
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def parse_cores(text):
+    """'0-3,8' -> [0, 1, 2, 3, 8]"""
+    cores = []
+    for part in text.replace(" ", "").split(","):
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        cores.extend(range(int(start), int(end or start) + 1))
+    return sorted(set(cores))
+
+
+def parse_partitions(spec, cpu_budget, shares=DEFAULT_SHARES):
+    """{model: {"threads", "concurrency", "cores"}} from a spec string (see module docstring)"""
+    partitions = {
+        model: {"threads": max(1, int(cpu_budget * share)), "concurrency": 1, "cores": None}
+        for model, share in shares.items()
+    }
+    for entry in filter(None, (part.strip() for part in (spec or "").split(";"))):
+        model, _, options = entry.partition(":")
+        partition = partitions.setdefault(model.strip(), {"threads": 1, "concurrency": 1, "cores": None})
+        # cores may hold commas ("0-3,8"), so split key=value pairs on the keys
+        key = None
+        for token in options.split(","):
+            name, sep, value = token.partition("=")
+            if sep and name.strip() in PARTITION_KEYS:
+                key = name.strip()
+                partition[key] = value.strip()
+            elif key == "cores":
+                partition[key] += "," + token.strip()
+            else:
+                raise ValueError(f"Bad inference partition option {token!r} for {model!r}; expected one of {PARTITION_KEYS}")
+    for model, partition in partitions.items():
+        partition["threads"] = int(partition["threads"])
+        partition["concurrency"] = int(partition["concurrency"])
+        if isinstance(partition["cores"], str):
+            partition["cores"] = parse_cores(partition["cores"])
+        if partition["threads"] < 1 or partition["concurrency"] < 1:
+            raise ValueError(f"Inference partition {model!r} needs threads >= 1 and concurrency >= 1")
+    return partitions
+
+
+class InferenceScheduler:
+    def __init__(self, partitions, enabled=True):
+        self.partitions = partitions
+        self.enabled = enabled
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._executors = {}
+        self._pid = None
+        self._stats = {model: {"calls": 0, "running": 0, "wait_seconds": 0.0, "busy_seconds": 0.0} for model in partitions}
+
+    def _executor(self, model):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Pool threads don't survive fork()
+                self._executors = {}
+                self._pid = os.getpid()
+            executor = self._executors.get(model)
+            if executor is None:
+                executor = self._executors[model] = CountingThreadPoolExecutor(
+                    max_workers=self.partitions[model]["concurrency"],
+                    thread_name_prefix=f"infer-{model}",
+                    initializer=self._init_thread, initargs=(model,)
+                )
+            return executor
+
+    def _init_thread(self, model):
+        self._local.model = model
+        partition = self.partitions[model]
+        if partition["cores"]:
+            try:
+                os.sched_setaffinity(0, partition["cores"])
+            except (AttributeError, OSError) as e:
+                print(f"Could not pin {model} inference to cores {partition['cores']}: {e}")
+
+    def run(self, model, fn, *args, **kwargs):
+        """Run ``fn(*args, **kwargs)`` inside ``model``'s partition and return its result"""
+        if not self.enabled or model not in self.partitions or getattr(self._local, "model", None) == model:
+            return fn(*args, **kwargs)
+        submitted = time.perf_counter()
+        return self._executor(model).submit(self._call, model, submitted, fn, args, kwargs).result()
+
+    def _call(self, model, submitted, fn, args, kwargs):
+        started = time.perf_counter()
+        stats = self._stats[model]
+        with self._lock:
+            stats["calls"] += 1
+            stats["running"] += 1
+            stats["wait_seconds"] += started - submitted
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                stats["running"] -= 1
+                stats["busy_seconds"] += time.perf_counter() - started
+
+    def shutdown(self):
+        """Stop the pool threads once queued calls finish"""
+        with self._lock:
+            executors, self._executors = self._executors, {}
+        for executor in executors.values():
+            executor.shutdown(wait=True)
+
+    def queue_depth(self, model):
+        executor = self._executors.get(model) if self._pid == os.getpid() else None
+        return executor.queue_depth() if executor is not None else 0
+
+    def stats(self):
+        with self._lock:
+            snapshot = {model: dict(stats) for model, stats in self._stats.items()}
+        return {
+            "enabled": self.enabled,
+            "models": {
+                model: dict(snapshot[model], **self.partitions[model], queued=self.queue_depth(model))
+                for model in self.partitions
+            },
+        }
@@ -0,0 +1,297 @@
+"""Durable verification job queue on SQLite, plus the worker pool that drains it.
+
+Jobs survive restarts and are shared by every process using the same
+database file (pre-fork workers included): ``claim`` moves up to N queued
+jobs to ``running`` inside one ``BEGIN IMMEDIATE`` transaction, so two
+workers never get the same job. A claimed job carries a lease; if its
+worker dies, the job is claimable again once the lease expires, or failed
+if that was its last attempt. A claim is identified by its attempt number,
+so a worker that overran its lease can't overwrite the outcome of the
+worker that took the job over. Failed jobs are retried with backoff up to
+``max_attempts``, unless the pool's ``retryable`` calls the error
+permanent. The database file is created on first use.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB_PATH = os.path.join(BASE_DIR, "jobs.sqlite3")
+
+JOB_STATUSES = ("queued", "running", "done", "failed")
+LEASE_EXPIRED = "lease expired"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    callback_url TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created_at REAL NOT NULL,
+    available_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, available_at);
+"""
+
+
+class JobQueue:
+    def __init__(self, path=DEFAULT_DB_PATH, lease_seconds=300.0, max_attempts=3, retry_backoff=5.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._local = threading.local()
+        self._schema_ready = False
+
+    def _connect(self):
+        # One connection per thread (and per process: reopened after fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if not self._schema_ready:
+                conn.executescript(_SCHEMA)
+                self._schema_ready = True
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def submit(self, payload, callback_url=None):
+        """Queue a job; returns its id"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO jobs (id, status, payload, callback_url, created_at, available_at) VALUES (?, 'queued', ?, ?, ?, ?)",
+            (job_id, json.dumps(payload), callback_url, now, now)
+        )
+        return job_id
+
+    def claim(self, limit, worker_id):
+        """Atomically take up to ``limit`` runnable jobs (queued, or running with an expired lease).
+
+        In the same transaction, jobs whose lease expired on their last allowed
+        attempt are marked failed ("lease expired") instead of being claimed
+        again, so a job that kills or hangs its worker every time stops after
+        ``max_attempts``. Those come back too, with ``status == "failed"``, so
+        the caller can report them; the rest have ``status == "running"``.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, self.max_attempts)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, lease_until = NULL WHERE id = ?",
+                [(LEASE_EXPIRED, now, row["id"]) for row in expired]
+            )
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE (status = 'queued' AND available_at <= ?) "
+                "OR (status = 'running' AND lease_until < ? AND attempts < ?) ORDER BY available_at LIMIT ?",
+                (now, now, self.max_attempts, limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET status = 'running', worker = ?, started_at = ?, lease_until = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                [(worker_id, now, now + self.lease_seconds, row["id"]) for row in rows]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        failed = [dict(row, payload=json.loads(row["payload"]), status="failed", error=LEASE_EXPIRED,
+                       finished_at=now, lease_until=None) for row in expired]
+        claimed = [dict(row, payload=json.loads(row["payload"]), status="running", attempts=row["attempts"] + 1,
+                        started_at=now) for row in rows]
+        return failed + claimed
+
+    def complete(self, job_id, result, attempts):
+        """Mark claim ``attempts`` of a job done; False if that claim was lost (lease expired, job reclaimed)"""
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = 'done', result = ?, error = NULL, finished_at = ?, lease_until = NULL "
+            "WHERE id = ? AND status = 'running' AND attempts = ?",
+            (json.dumps(result), time.time(), job_id, attempts)
+        )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id, error, attempts, retry=True):
+        """Record a failure of claim ``attempts``; requeues with backoff until ``max_attempts``.
+
+        ``retry=False`` (a permanent error) fails the job at once.
+        Returns True if retried, False if failed for good, None if the claim was lost.
+        """
+        now = time.time()
+        if retry and attempts < self.max_attempts:
+            cursor = self._connect().execute(
+                "UPDATE jobs SET status = 'queued', error = ?, available_at = ?, lease_until = NULL "
+                "WHERE id = ? AND status = 'running' AND attempts = ?",
+                (error, now + self.retry_backoff * attempts, job_id, attempts)
+            )
+            retried = True
+        else:
+            cursor = self._connect().execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, lease_until = NULL "
+                "WHERE id = ? AND status = 'running' AND attempts = ?",
+                (error, now, job_id, attempts)
+            )
+            retried = False
+        return retried if cursor.rowcount == 1 else None
+
+    def get(self, job_id):
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def counts(self):
+        rows = self._connect().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in JOB_STATUSES}
+        counts.update({row["status"]: row["n"] for row in rows})
+        return counts
+
+    def oldest_queued_age(self):
+        row = self._connect().execute("SELECT MIN(created_at) AS oldest FROM jobs WHERE status = 'queued'").fetchone()
+        return time.time() - row["oldest"] if row["oldest"] is not None else 0.0
+
+    def purge(self, older_than_seconds):
+        """Delete finished jobs older than the retention window"""
+        cursor = self._connect().execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+            (time.time() - older_than_seconds,)
+        )
+        return cursor.rowcount
+
+
+class JobWorkerPool:
+    """Threads that claim jobs in batches and run ``handler(payload) -> result``.
+
+    Each of ``workers`` loops claims up to ``batch_size`` jobs and runs them
+    concurrently, so a batch's model calls can coalesce (e.g. in a
+    micro-batcher), then claims the next batch. ``on_finished(job, result,
+    error, retried)`` (optional) runs after each job, e.g. for callbacks and
+    metrics, including jobs ``claim`` failed because their last lease expired.
+    ``retryable(exc)`` (optional) decides whether a failed job is requeued;
+    without it every error is retried.
+    """
+
+    def __init__(self, queue, handler, workers=4, batch_size=4, poll_interval=0.5, on_finished=None,
+                 retention_seconds=7 * 24 * 3600, retryable=None):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.on_finished = on_finished
+        self.retryable = retryable
+        self.retention_seconds = retention_seconds
+        self._threads = []
+        self._executor = None
+        self._pid = None
+        self._wake = threading.Event()
+        self._processed = 0
+        self._failed = 0
+        self._lost = 0
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start (or, after fork, restart) the worker threads; a no-op while they are running"""
+        with self._start_lock:
+            if self._pid != os.getpid():
+                # Threads and the executor don't survive fork()
+                self._threads = []
+                self._executor = ThreadPoolExecutor(max_workers=self.workers * self.batch_size, thread_name_prefix="job")
+                self._pid = os.getpid()
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            for i in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._loop, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def notify(self):
+        """Wake idle workers after a submit instead of waiting for the next poll"""
+        self._wake.set()
+
+    def _loop(self):
+        worker_id = f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+        last_purge = 0.0
+        while True:
+            try:
+                jobs = self.queue.claim(self.batch_size, worker_id)
+            except Exception as e:
+                print(f"Job claim error: {e}")
+                jobs = []
+            if not jobs:
+                if time.time() - last_purge > 3600:
+                    last_purge = time.time()
+                    try:
+                        self.queue.purge(self.retention_seconds)
+                    except Exception as e:
+                        print(f"Job purge error: {e}")
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            for job in jobs:
+                if job["status"] == "failed":
+                    self._finished(job, None, job["error"], False)
+            for future in [self._executor.submit(self._run, job) for job in jobs if job["status"] == "running"]:
+                future.result()
+
+    def _run(self, job):
+        result, error, retried = None, None, False
+        try:
+            result = self.handler(job["payload"])
+            owned = self.queue.complete(job["id"], result, job["attempts"])
+        except Exception as e:
+            error = str(e)
+            retry = self.retryable is None or self.retryable(e)
+            retried = self.queue.fail(job["id"], error, job["attempts"], retry=retry)
+            owned = retried is not None
+        if not owned:
+            # Ran past its lease; the worker that reclaimed the job reports it
+            print(f"Job {job['id']} attempt {job['attempts']} lost its lease; outcome dropped")
+            with self._lock:
+                self._lost += 1
+            return
+        self._finished(job, result, error, retried)
+
+    def _finished(self, job, result, error, retried):
+        with self._lock:
+            self._processed += 1
+            if error is not None and not retried:
+                self._failed += 1
+        if self.on_finished is not None:
+            try:
+                self.on_finished(job, result, error, retried)
+            except Exception as e:
+                print(f"Job completion hook error: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "alive_workers": sum(thread.is_alive() for thread in self._threads),
+                "batch_size": self.batch_size,
+                "processed": self._processed,
+                "failed": self._failed,
+                "lost_leases": self._lost,
+            }
@@ -0,0 +1,158 @@
+"""Micro-batching queue shared by concurrent request threads.
+
+Request threads submit single items; a background thread collects whatever
+is pending for up to ``max_wait_ms`` (or until ``max_batch_size`` items are
+queued) and runs them through ``batch_fn`` in one call. Each caller gets its
+own row of the batch output back through a ``Future``.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """Coalesce single-item calls into batched calls to ``batch_fn``.
+
+    ``batch_fn`` receives a list of items and must return a sequence with one
+    output per item, in the same order.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=16, max_wait_ms=5.0, max_queue_size=256, name="batcher"):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_queue_size = max_queue_size
+        self.name = name
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._thread = None
+
+        self._batches = 0
+        self._items = 0
+        self._last_batch_size = 0
+        self._max_seen_batch_size = 0
+        self._total_queue_wait = 0.0
+        self._total_batch_time = 0.0
+        self._failures = 0
+
+    # ---------------- public API ----------------
+
+    def submit(self, item, timeout=None):
+        """Queue ``item`` and return a Future for its row of the batch output.
+
+        Blocks while the queue is full; raises ``queue.Full`` if ``timeout``
+        expires first.
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()), timeout=timeout)
+        return future
+
+    def run(self, item, timeout=None):
+        """Submit ``item`` and wait for its result."""
+        return self.submit(item, timeout=timeout).result(timeout=timeout)
+
+    def stats(self):
+        """Snapshot of queue depth, configured limits and observed batch sizes."""
+        with self._stats_lock:
+            batches = self._batches
+            items = self._items
+            return {
+                "name": self.name,
+                "queue_depth": self._queue.qsize(),
+                "max_queue_size": self.max_queue_size,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "batches": batches,
+                "items": items,
+                "failures": self._failures,
+                "last_batch_size": self._last_batch_size,
+                "max_observed_batch_size": self._max_seen_batch_size,
+                "avg_batch_size": (items / batches) if batches else 0.0,
+                "avg_queue_wait_ms": (self._total_queue_wait / items * 1000) if items else 0.0,
+                "avg_batch_time_ms": (self._total_batch_time / batches * 1000) if batches else 0.0,
+            }
+
+    # ---------------- worker ----------------
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        """Block for the first item, then gather more until full or the wait expires."""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                # Take whatever is already waiting without sleeping further
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._run_batch(batch)
+            except Exception as e:  # never let the worker thread die
+                print(f"{self.name} worker error: {e}")
+
+    def _run_batch(self, batch):
+        started = time.perf_counter()
+        pending = [(item, future, queued_at) for item, future, queued_at in batch
+                   if future.set_running_or_notify_cancel()]
+        if not pending:
+            return
+
+        items = [item for item, _, _ in pending]
+        try:
+            outputs = self.batch_fn(items)
+        except Exception as e:
+            if len(pending) == 1:
+                self._record(pending, started, failed=True)
+                pending[0][1].set_exception(e)
+                return
+            # One bad item should not fail its neighbours: retry individually
+            print(f"{self.name} batch of {len(pending)} failed ({e}), retrying items one by one")
+            for entry in pending:
+                item, future, _ = entry
+                try:
+                    future.set_result(self.batch_fn([item])[0])
+                except Exception as item_error:
+                    future.set_exception(item_error)
+            self._record(pending, started, failed=True)
+            return
+
+        for (_, future, _), output in zip(pending, outputs):
+            future.set_result(output)
+        self._record(pending, started)
+
+    def _record(self, pending, started, failed=False):
+        now = time.perf_counter()
+        with self._stats_lock:
+            self._batches += 1
+            self._items += len(pending)
+            self._last_batch_size = len(pending)
+            self._max_seen_batch_size = max(self._max_seen_batch_size, len(pending))
+            self._total_queue_wait += sum(started - queued_at for _, _, queued_at in pending)
+            self._total_batch_time += now - started
+            if failed:
+                self._failures += 1
@@ -0,0 +1,86 @@
+"""Rewrite stored CLIP embeddings in user_images into another storage format.
+
+Usage:
+    python migrate_embeddings.py --format float16 [--batch-size 500] [--dry-run]
+    python migrate_embeddings.py --format list      # roll back to BSON arrays
+
+Documents already in the target format are skipped, so the script can be
+re-run safely and interrupted at any point.
+"""
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+
+from embedding_codec import EMBEDDING_FIELDS, EMBEDDING_FORMATS, decode_embedding, embedding_format, encode_embedding
+
+
+def pending_filter(target_format):
+    """Documents whose embedding is not yet stored as ``target_format``"""
+    if target_format == "list":
+        return {"clip_embedding": {"$type": "binData"}}
+    return {
+        "clip_embedding": {"$exists": True, "$ne": None},
+        "$or": [
+            {"clip_embedding": {"$type": "array"}},
+            {"clip_embedding_format": {"$ne": target_format}}
+        ]
+    }
+
+
+def migrate(collection, target_format, batch_size=500, dry_run=False, limit=None):
+    cursor = collection.find(pending_filter(target_format), {"_id": 1, **EMBEDDING_FIELDS}).batch_size(batch_size)
+    if limit:
+        cursor = cursor.limit(limit)
+
+    operations, migrated, skipped = [], 0, 0
+    started = time.time()
+    for doc in cursor:
+        if embedding_format(doc) == target_format:
+            skipped += 1
+            continue
+        vector = decode_embedding(doc)
+        fields = encode_embedding(vector, target_format)
+        update = {"$set": fields}
+        stale = [name for name in ("clip_embedding_format", "clip_embedding_scale") if name not in fields]
+        if stale:
+            update["$unset"] = {name: "" for name in stale}
+        operations.append(UpdateOne({"_id": doc["_id"]}, update))
+
+        if len(operations) >= batch_size:
+            if not dry_run:
+                collection.bulk_write(operations, ordered=False)
+            migrated += len(operations)
+            operations = []
+            print(f"  {migrated} documents migrated ({time.time() - started:.1f}s)")
+
+    if operations:
+        if not dry_run:
+            collection.bulk_write(operations, ordered=False)
+        migrated += len(operations)
+    return migrated, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate stored CLIP embeddings between storage formats")
+    parser.add_argument("--format", choices=EMBEDDING_FORMATS, required=True)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    load_dotenv()
+    mongodb_uri = os.getenv("MONGODB_URI")
+    if not mongodb_uri:
+        raise RuntimeError("MONGODB_URI environment variable not set")
+    collection = MongoClient(mongodb_uri)["bingo_app"]["user_images"]
+
+    print(f"Migrating embeddings to {args.format}{' (dry run)' if args.dry_run else ''}...")
+    migrated, skipped = migrate(collection, args.format, args.batch_size, args.dry_run, args.limit)
+    print(f"Done: {migrated} migrated, {skipped} already in {args.format}")
+
+
+if __name__ == "__main__":
+    main()
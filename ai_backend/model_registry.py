@@ -0,0 +1,121 @@
+"""Background / lazy model loading with warm-up and per-model readiness.
+
+Each model is registered with a loader and an optional warm-up callable
+that runs one inference on the loaded value, so the first real request
+doesn't pay for lazy kernel initialization. ``start(background=True)``
+loads everything in registration order on a daemon thread while the HTTP
+server binds; ``get`` blocks until the model is ready (loading it inline
+if nothing started it yet). Load and warm-up times are kept for /health.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class ModelUnavailableError(RuntimeError):
+    pass
+
+
+class _Slot:
+    def __init__(self, name, loader, warmup, required):
+        self.name = name
+        self.loader = loader
+        self.warmup = warmup
+        self.required = required
+        self.state = "pending"
+        self.value = None
+        self.error = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._slots = OrderedDict()
+        self._thread = None
+        self.started_at = time.monotonic()
+
+    def register(self, name, loader, warmup=None, required=True):
+        """Register ``loader() -> value``; ``warmup(value)`` runs once after loading.
+
+        A failed optional model resolves to None instead of raising.
+        """
+        self._slots[name] = _Slot(name, loader, warmup, required)
+
+    def _load(self, slot):
+        with slot.lock:
+            if slot.state != "pending":
+                return
+            slot.state = "loading"
+        try:
+            started = time.perf_counter()
+            value = slot.loader()
+            slot.load_seconds = time.perf_counter() - started
+            if slot.warmup is not None:
+                slot.state = "warming"
+                started = time.perf_counter()
+                slot.warmup(value)
+                slot.warmup_seconds = time.perf_counter() - started
+            slot.value = value
+            slot.state = "ready"
+            print(f"Model {slot.name} ready (load {slot.load_seconds:.2f}s, warm-up {slot.warmup_seconds or 0:.2f}s)")
+        except Exception as e:
+            slot.error = str(e)
+            slot.state = "failed"
+            print(f"{'Error' if slot.required else 'Warning'}: could not load model {slot.name}: {e}")
+        finally:
+            slot.done.set()
+
+    def start(self, background=True, skip=()):
+        """Load every registered model except ``skip``, on a daemon thread unless ``background`` is False"""
+        def load_all():
+            for slot in list(self._slots.values()):
+                if slot.name not in skip:
+                    self._load(slot)
+
+        if not background:
+            load_all()
+            return
+        # A loader thread started before fork() does not exist in the child
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=load_all, name="model-loader", daemon=True)
+            self._thread.start()
+
+    def reset(self, name):
+        """Forget a loaded model so the next start()/get() loads it again"""
+        slot = self._slots[name]
+        self._slots[name] = _Slot(name, slot.loader, slot.warmup, slot.required)
+
+    def get(self, name, timeout=None):
+        """The loaded model, waiting for (or triggering) its load"""
+        slot = self._slots[name]
+        if slot.state == "pending":
+            self._load(slot)
+        if not slot.done.wait(timeout):
+            raise ModelUnavailableError(f"Model {name} is still {slot.state}")
+        if slot.state == "failed":
+            if slot.required:
+                raise ModelUnavailableError(f"Model {name} failed to load: {slot.error}")
+            return None
+        return slot.value
+
+    def ready(self):
+        """True once every required model is loaded and warmed up"""
+        return all(slot.state == "ready" for slot in self._slots.values() if slot.required)
+
+    def failed(self):
+        return [slot.name for slot in self._slots.values() if slot.required and slot.state == "failed"]
+
+    def status(self):
+        return {
+            slot.name: {
+                "state": slot.state,
+                "required": slot.required,
+                "load_seconds": slot.load_seconds,
+                "warmup_seconds": slot.warmup_seconds,
+                "error": slot.error,
+            }
+            for slot in self._slots.values()
+        }
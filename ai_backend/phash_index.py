@@ -0,0 +1,285 @@
+"""Hamming-space index over 64-bit perceptual hashes (multi-index hashing).
+
+Each hash is split into four 16-bit substrings, and every substring position
+has its own sorted table. If two hashes are within Hamming distance ``k``,
+at least one substring differs by at most ``k // 4`` bits (pigeonhole), so a
+query only probes the table entries whose substring is within that radius and
+then verifies the few candidates with a vectorized popcount. Lookups touch
+roughly ``N / 2**16`` entries per probe instead of all ``N``.
+
+Inserts land in a small unsorted buffer that is scanned exactly and merged
+into the sorted tables once it grows past ``merge_threshold``.
+
+Usage:
+    python phash_index.py bench [--sizes 1000000 10000000] [--k 5]
+"""
+import argparse
+import threading
+import time
+from itertools import combinations
+
+import numpy as np
+
+from duplicate_index import phash_to_int, popcount64
+
+CHUNKS = 4
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+def split_chunks(hashes):
+    """(CHUNKS, n) uint16 substrings of a uint64 array"""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    return np.stack([
+        ((hashes >> np.uint64(CHUNK_BITS * c)) & np.uint64(CHUNK_MASK)).astype(np.uint16)
+        for c in range(CHUNKS)
+    ])
+
+
+def neighbours16(value, radius):
+    """All 16-bit values within ``radius`` bits of ``value``"""
+    values = [value]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), r):
+            flipped = value
+            for bit in bits:
+                flipped ^= 1 << bit
+            values.append(flipped)
+    return np.array(values, dtype=np.uint16)
+
+
+class PHashIndex:
+    """Multi-index hashing over packed 64-bit pHashes with optional doc/user payloads"""
+
+    def __init__(self, merge_threshold=4096):
+        self.merge_threshold = merge_threshold
+        self._lock = threading.Lock()
+        # Over-allocated row storage; only the first ``_count`` rows are live
+        self._count = 0
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._doc_ids = None
+        self._user_refs = np.zeros(0, dtype=np.int32)
+        self._users = []
+        self._user_lookup = {}
+        # Per-chunk sorted substrings and the row each one belongs to
+        self._keys = [np.zeros(0, dtype=np.uint16) for _ in range(CHUNKS)]
+        self._rows = [np.zeros(0, dtype=np.int64) for _ in range(CHUNKS)]
+        self._sorted_count = 0
+        self.ready = threading.Event()
+
+    def __len__(self):
+        return self._count
+
+    # ---------------- writes ----------------
+
+    def _user_ref(self, user_id):
+        if user_id is None:
+            return -1
+        ref = self._user_lookup.get(user_id)
+        if ref is None:
+            ref = len(self._users)
+            self._users.append(user_id)
+            self._user_lookup[user_id] = ref
+        return ref
+
+    def add_many(self, hashes, doc_ids=None, user_ids=None):
+        """Bulk insert packed uint64 hashes with optional parallel payloads"""
+        hashes = np.asarray(hashes, dtype=np.uint64).reshape(-1)
+        with self._lock:
+            start = self._count
+            end = start + len(hashes)
+            if doc_ids is not None and self._doc_ids is None:
+                self._doc_ids = np.zeros(len(self._hashes), dtype="S24")
+            self._reserve(end)
+            self._hashes[start:end] = hashes
+            if self._doc_ids is not None:
+                self._doc_ids[start:end] = doc_ids if doc_ids is not None else b""
+            refs = [self._user_ref(u) for u in user_ids] if user_ids is not None else -1
+            self._user_refs[start:end] = refs
+            self._count = end
+            if end - self._sorted_count >= self.merge_threshold or start == 0:
+                self._merge()
+        return start
+
+    def _reserve(self, needed):
+        """Grow row storage geometrically so single inserts stay O(1) amortized"""
+        capacity = len(self._hashes)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        self._hashes = np.resize(self._hashes, capacity)
+        self._user_refs = np.resize(self._user_refs, capacity)
+        if self._doc_ids is not None:
+            self._doc_ids = np.resize(self._doc_ids, capacity)
+
+    def add(self, phash, doc_id=None, user_id=None):
+        """Insert one hex pHash string"""
+        packed = phash_to_int(phash)
+        if packed is None:
+            return None
+        return self.add_many(
+            [packed],
+            [str(doc_id)] if doc_id is not None else None,
+            [user_id] if user_id is not None else None
+        )
+
+    def _merge(self):
+        """Fold the unsorted tail into the per-chunk sorted tables"""
+        total = self._count
+        if total == self._sorted_count:
+            return
+        new_rows = np.arange(self._sorted_count, total, dtype=np.int64)
+        new_chunks = split_chunks(self._hashes[self._sorted_count:total])
+        for c in range(CHUNKS):
+            order = np.argsort(new_chunks[c], kind="stable")
+            keys, rows = new_chunks[c][order], new_rows[order]
+            if self._sorted_count == 0:
+                self._keys[c], self._rows[c] = keys, rows
+            else:
+                positions = np.searchsorted(self._keys[c], keys, side="right")
+                self._keys[c] = np.insert(self._keys[c], positions, keys)
+                self._rows[c] = np.insert(self._rows[c], positions, rows)
+        self._sorted_count = total
+
+    # ---------------- queries ----------------
+
+    def _candidate_rows(self, packed, radius, keys, rows, sorted_count, total):
+        query_chunks = split_chunks(np.array([packed], dtype=np.uint64))[:, 0]
+        candidates = []
+        for c in range(CHUNKS):
+            probes = neighbours16(int(query_chunks[c]), radius)
+            lo = np.searchsorted(keys[c], probes, side="left")
+            hi = np.searchsorted(keys[c], probes, side="right")
+            for start, end in zip(lo, hi):
+                if end > start:
+                    candidates.append(rows[c][start:end])
+        if total > sorted_count:
+            candidates.append(np.arange(sorted_count, total, dtype=np.int64))
+        if not candidates:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(candidates))
+
+    def search(self, phash, max_distance, exclude_user=None, limit=None):
+        """Entries within ``max_distance`` bits, closest first, as dicts"""
+        packed = phash_to_int(phash)
+        if packed is None:
+            return []
+        with self._lock:
+            hashes, doc_ids, user_refs = self._hashes, self._doc_ids, self._user_refs
+            keys, rows = list(self._keys), list(self._rows)
+            sorted_count, total = self._sorted_count, self._count
+            users = self._users
+            exclude_ref = self._user_lookup.get(exclude_user, -2) if exclude_user is not None else -2
+
+        candidates = self._candidate_rows(packed, max_distance // CHUNKS, keys, rows, sorted_count, total)
+        if not len(candidates):
+            return []
+        distances = popcount64(hashes[candidates] ^ np.uint64(packed))
+        keep = distances <= max_distance
+        if exclude_user is not None:
+            keep &= user_refs[candidates] != exclude_ref
+        candidates, distances = candidates[keep], distances[keep]
+        order = np.argsort(distances, kind="stable")[:limit]
+        return [
+            {
+                "distance": int(distances[i]),
+                "doc_id": doc_ids[candidates[i]].decode() if doc_ids is not None else None,
+                "user_id": users[user_refs[candidates[i]]] if user_refs[candidates[i]] >= 0 else None,
+                "row": int(candidates[i])
+            }
+            for i in order
+        ]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hashes": self._count,
+                "unsorted": self._count - self._sorted_count,
+                "users": len(self._users),
+                "ready": self.ready.is_set()
+            }
+
+
+def load_from_collection(index, collection, batch_size=10000):
+    """Bulk-load every active pHash from the user_images collection"""
+    hashes, doc_ids, user_ids = [], [], []
+    cursor = collection.find(
+        {"status": "active", "phash": {"$exists": True, "$ne": None}},
+        {"_id": 1, "user_id": 1, "phash": 1}
+    ).batch_size(batch_size)
+    for doc in cursor:
+        hashes.append(phash_to_int(doc["phash"]))
+        doc_ids.append(str(doc["_id"]))
+        user_ids.append(doc.get("user_id"))
+        if len(hashes) >= batch_size * 10:
+            index.add_many(hashes, doc_ids, user_ids)
+            hashes, doc_ids, user_ids = [], [], []
+    if hashes:
+        index.add_many(hashes, doc_ids, user_ids)
+    index.ready.set()
+    return len(index)
+
+
+# ==================== BENCHMARK ====================
+
+def command_bench(args):
+    rng = np.random.default_rng(0)
+    for size in args.sizes:
+        hashes = rng.integers(0, np.iinfo(np.int64).max, size, dtype=np.int64).astype(np.uint64)
+        hashes ^= rng.integers(0, 2, size, dtype=np.int64).astype(np.uint64) << np.uint64(63)
+
+        index = PHashIndex()
+        t = time.perf_counter()
+        index.add_many(hashes)
+        build_time = time.perf_counter() - t
+
+        # Queries are stored hashes with a few bits flipped (near-duplicate uploads)
+        picks = rng.choice(size, args.queries, replace=False)
+        queries = []
+        for pick in picks:
+            flipped = int(hashes[pick])
+            for bit in rng.choice(64, rng.integers(0, args.k + 1), replace=False):
+                flipped ^= 1 << int(bit)
+            queries.append(f"{flipped:016x}")
+
+        index_times, scan_times, found = [], [], 0
+        for query, pick in zip(queries, picks):
+            t = time.perf_counter()
+            hits = index.search(query, args.k)
+            index_times.append(time.perf_counter() - t)
+            found += any(hit["row"] == pick for hit in hits)
+        for query in queries[:args.scan_queries]:
+            t = time.perf_counter()
+            distances = popcount64(hashes ^ np.uint64(int(query, 16)))
+            np.nonzero(distances <= args.k)
+            scan_times.append(time.perf_counter() - t)
+
+        insert_t = time.perf_counter()
+        for value in rng.integers(0, np.iinfo(np.int64).max, args.inserts, dtype=np.int64):
+            index.add(f"{int(value):016x}")
+        insert_time = (time.perf_counter() - insert_t) / args.inserts
+
+        print(
+            f"n={size:>9,d} k={args.k} build={build_time:.2f}s "
+            f"index p50={np.percentile(index_times, 50) * 1000:.3f}ms p99={np.percentile(index_times, 99) * 1000:.3f}ms "
+            f"scan p50={np.percentile(scan_times, 50) * 1000:.2f}ms "
+            f"insert={insert_time * 1e6:.1f}us recall={found / len(queries):.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pHash multi-index hashing index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="Index lookups vs a full popcount scan")
+    bench.add_argument("--sizes", type=int, nargs="+", default=[1000000, 10000000])
+    bench.add_argument("--k", type=int, default=5)
+    bench.add_argument("--queries", type=int, default=500)
+    bench.add_argument("--scan-queries", type=int, default=20)
+    bench.add_argument("--inserts", type=int, default=2000)
+    bench.set_defaults(func=command_bench)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Content-addressed cache of per-stage verification results.
+
+Entries are keyed by a hash of the raw image bytes plus a version string
+covering the models and thresholds, and hold one value per stage (AI
+verdict, dustbin result, pHash, embedding). Entries expire after a TTL and
+the cache is LRU-bounded by entry count. Concurrent requests for the same
+key and stage are coalesced: one thread computes, the others wait for its
+result, so a retry storm costs a single inference.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def content_key(data, version):
+    """Cache key for raw image bytes under a model/threshold version"""
+    return f"{hashlib.sha256(data).hexdigest()}:{version}"
+
+
+class ResultCache:
+    """Thread-safe LRU + TTL cache of {stage: value} dicts with request coalescing"""
+
+    def __init__(self, max_entries=2048, ttl_seconds=3600.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+
+    def _live_entry(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if now - entry["created_at"] > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        return entry
+
+    def get_or_compute(self, key, stage, compute, should_cache=None):
+        """Cached value of ``stage`` for ``key``, computing it at most once at a time"""
+        if self.max_entries <= 0:
+            return compute()
+
+        with self._lock:
+            entry = self._live_entry(key, time.monotonic())
+            if entry is not None and stage in entry["stages"]:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry["stages"][stage]
+            future = self._inflight.get((key, stage))
+            if future is not None:
+                self._coalesced += 1
+                owner = False
+            else:
+                future = Future()
+                self._inflight[(key, stage)] = future
+                self._misses += 1
+                owner = True
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = compute()
+        except Exception as e:
+            with self._lock:
+                self._inflight.pop((key, stage), None)
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._inflight.pop((key, stage), None)
+            if should_cache is None or should_cache(value):
+                self._store(key, stage, value)
+        future.set_result(value)
+        return value
+
+    def _store(self, key, stage, value):
+        now = time.monotonic()
+        entry = self._live_entry(key, now)
+        if entry is None:
+            entry = {"created_at": now, "stages": {}}
+            self._entries[key] = entry
+        entry["stages"][stage] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "inflight": len(self._inflight),
+                "hits": self._hits,
+                "misses": self._misses,
+                "coalesced": self._coalesced,
+                "evictions": self._evictions,
+            }
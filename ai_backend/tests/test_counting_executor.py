@@ -0,0 +1,44 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from counting_executor import CountingThreadPoolExecutor
+
+
+def test_queue_depth_counts_tasks_not_yet_started():
+    release = threading.Event()
+    running = threading.Event()
+    executor = CountingThreadPoolExecutor(max_workers=1)
+    try:
+        blocker = executor.submit(lambda: (running.set(), release.wait(10)))
+        assert running.wait(10)
+        queued = [executor.submit(lambda n=n: n) for n in range(3)]
+        assert executor.queue_depth() == 3
+        release.set()
+        assert [future.result(10) for future in queued] == [0, 1, 2]
+        assert blocker.result(10)
+        assert executor.queue_depth() == 0
+    finally:
+        release.set()
+        executor.shutdown(wait=True)
+
+
+def test_cancelled_tasks_leave_the_queue():
+    release = threading.Event()
+    running = threading.Event()
+    executor = CountingThreadPoolExecutor(max_workers=1)
+    try:
+        executor.submit(lambda: (running.set(), release.wait(10)))
+        assert running.wait(10)
+        pending = executor.submit(lambda: None)
+        assert executor.queue_depth() == 1
+        assert pending.cancel()
+        assert executor.queue_depth() == 0
+        executor.submit(lambda: None)
+        executor.shutdown(wait=False, cancel_futures=True)
+        assert executor.queue_depth() == 0
+    finally:
+        release.set()
+        executor.shutdown(wait=True)
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from duplicate_index import MIN_CAPACITY, UserDuplicateIndex
+
+
+def unit(seed):
+    vector = np.random.default_rng(seed).standard_normal(512).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_empty_index_allocates_nothing():
+    index = UserDuplicateIndex()
+    assert index._embeddings.nbytes == 0
+    assert index.query(unit(0), "ffffffffffffffff", 5, 0.93) == (False, None, 0.0, None)
+
+
+def test_capacity_grows_geometrically():
+    index = UserDuplicateIndex()
+    capacities = []
+    for n in range(40):
+        index.add(unit(n), None, image_url=f"img-{n}")
+        capacities.append(index._embeddings.shape[0])
+    assert capacities[0] == MIN_CAPACITY
+    assert sorted(set(capacities)) == [MIN_CAPACITY * 2 ** k for k in range(5)]
+    assert len(index) == 40
+
+
+def test_rows_survive_growth():
+    index = UserDuplicateIndex()
+    for n in range(10):
+        index.add(unit(n), f"{n:016x}", image_url=f"img-{n}")
+    assert index.query(unit(3), None, 5, 0.93)[3] == "img-3"
+    assert index.query(None, f"{7:016x}", 0, 0.93)[:2] == (True, "phash")
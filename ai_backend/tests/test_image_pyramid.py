@@ -0,0 +1,37 @@
+import os
+import sys
+import threading
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_pyramid import ANALYSIS_SIZE, CLIP_SIZE, DETECT_SIZE, PHASH_SIZE, ImagePyramid
+
+
+def read_with_timeout(pyramid, name, timeout=10):
+    """Read one level on a thread so a lock deadlock fails the test instead of hanging it"""
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(level=getattr(pyramid, name)), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), f"reading {name} on a fresh pyramid deadlocked"
+    return result["level"]
+
+
+@pytest.mark.parametrize("name, size", [
+    ("detect", (DETECT_SIZE, 512)),
+    ("clip", (280, CLIP_SIZE)),
+    ("analysis_gray", (ANALYSIS_SIZE, ANALYSIS_SIZE)),
+    ("phash_gray", (PHASH_SIZE, PHASH_SIZE)),
+])
+def test_each_level_builds_on_a_fresh_pyramid(name, size):
+    pyramid = ImagePyramid(Image.new("RGB", (1000, 800)))
+    assert read_with_timeout(pyramid, name).size == size
+
+
+def test_levels_are_built_once():
+    pyramid = ImagePyramid(Image.new("RGB", (1000, 800)))
+    assert read_with_timeout(pyramid, "phash_gray") is pyramid.phash_gray
+    assert read_with_timeout(pyramid, "detect") is pyramid.detect
@@ -0,0 +1,96 @@
+import itertools
+import os
+import sys
+
+import numpy as np
+from pymongo.errors import BulkWriteError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from duplicate_index import DuplicateIndexCache
+from image_writer import DUPLICATE_KEY_ERROR, ImageWriter
+
+
+class FakeCollection:
+    """insert_many(ordered=False) with MongoDB's duplicate-key reporting"""
+
+    def __init__(self):
+        self.docs = {}
+        self.fail_next = None
+
+    def insert_many(self, docs, ordered=True):
+        if self.fail_next is not None:
+            error, self.fail_next = self.fail_next, None
+            raise error
+        errors = []
+        for index, doc in enumerate(docs):
+            if doc["_id"] in self.docs:
+                errors.append({"index": index, "code": DUPLICATE_KEY_ERROR, "errmsg": "E11000 duplicate key"})
+            else:
+                self.docs[doc["_id"]] = dict(doc)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(docs) - len(errors)})
+
+    def insert_one(self, doc):
+        self.insert_many([doc])
+
+    def find(self, query, projection=None):
+        return [doc for doc in self.docs.values() if doc["user_id"] == query["user_id"]]
+
+
+def image_doc(user_id, seed):
+    vector = np.random.default_rng(seed).standard_normal(512).astype(np.float32)
+    return {"user_id": user_id, "image_url": f"img-{seed}", "phash": f"{seed:016x}",
+            "clip_embedding": (vector / np.linalg.norm(vector)).tolist()}
+
+
+def buffered_writer(collection):
+    # Long interval: the test flushes explicitly
+    return ImageWriter(lambda: collection, mode="buffered", max_batch=64, flush_interval=3600)
+
+
+def test_buffered_flush_counts_an_already_stored_document_as_written():
+    collection = FakeCollection()
+    writer = buffered_writer(collection)
+    first = image_doc("alice", 1)
+    writer.write(first)
+    writer.flush()
+    # A retried save of the same record (same client-side _id) plus a new one
+    writer.write_many([dict(first), image_doc("alice", 2)])
+    writer.flush()
+
+    stats = writer.stats()
+    assert (stats["written"], stats["failed"], stats["pending"]) == (3, 0, 0)
+    assert len(collection.docs) == 2
+
+
+def test_flush_keeps_the_batch_queued_on_connection_errors():
+    collection = FakeCollection()
+    writer = buffered_writer(collection)
+    writer.write(image_doc("alice", 1))
+    collection.fail_next = ConnectionError("server selection timeout")
+    writer.flush()
+    assert writer.stats()["pending"] == 1 and writer.stats()["flush_errors"] == 1
+    writer.flush()
+    assert writer.stats()["pending"] == 0 and len(collection.docs) == 1
+
+
+def test_index_loader_sees_queued_documents_before_and_after_the_flush():
+    collection = FakeCollection()
+    writer = buffered_writer(collection)
+
+    def loader(user_id):
+        # As app.load_user_duplicate_records: the buffer first, then MongoDB
+        return itertools.chain(writer.pending(user_id), collection.find({"user_id": user_id}))
+
+    queued = image_doc("alice", 7)
+    writer.write(queued)
+    writer.write(image_doc("bob", 8))
+    before = DuplicateIndexCache(loader)
+    assert before.check("alice", queued["clip_embedding"], None)[:2] == (True, "clip")
+    assert before.stats()["images"] == 1
+
+    writer.flush()
+    after = DuplicateIndexCache(loader)
+    assert after.check("alice", None, queued["phash"])[:2] == (True, "phash")
+    assert after.stats()["images"] == 1
@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from job_queue import LEASE_EXPIRED, JobQueue, JobWorkerPool
+
+
+def expire_leases(queue):
+    queue._connect().execute("UPDATE jobs SET lease_until = ? WHERE status = 'running'", (time.time() - 1,))
+
+
+def test_expired_lease_is_reclaimed_until_max_attempts(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), max_attempts=3)
+    job_id = queue.submit({"n": 1})
+
+    for attempt in range(1, 4):
+        jobs = queue.claim(10, "worker")
+        assert [(job["id"], job["status"], job["attempts"]) for job in jobs] == [(job_id, "running", attempt)]
+        # The worker dies or hangs: its lease runs out without complete() or fail()
+        expire_leases(queue)
+
+    jobs = queue.claim(10, "worker")
+    assert [(job["id"], job["status"], job["error"]) for job in jobs] == [(job_id, "failed", LEASE_EXPIRED)]
+    stored = queue.get(job_id)
+    assert (stored["status"], stored["attempts"], stored["error"]) == ("failed", 3, LEASE_EXPIRED)
+    assert queue.claim(10, "worker") == []
+    # The dead attempt can't overwrite the failure
+    assert queue.complete(job_id, {"ok": True}, 3) is False
+
+
+def test_pool_reports_jobs_failed_by_lease_expiry(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), max_attempts=1)
+    job_id = queue.submit({"n": 1})
+    queue.claim(1, "dead-worker")
+    expire_leases(queue)
+
+    finished = []
+    pool = JobWorkerPool(queue, lambda payload: payload, workers=1, batch_size=1, poll_interval=0.05,
+                         on_finished=lambda job, result, error, retried: finished.append((job["id"], error, retried)))
+    pool.start()
+    deadline = time.time() + 10
+    while not finished and time.time() < deadline:
+        time.sleep(0.05)
+    assert finished == [(job_id, LEASE_EXPIRED, False)]
+    assert pool.stats()["failed"] == 1
+
+
+def run_one(queue, handler, retryable):
+    finished = []
+    pool = JobWorkerPool(queue, handler, workers=1, batch_size=1, poll_interval=0.05, retryable=retryable,
+                         on_finished=lambda job, result, error, retried: finished.append(retried))
+    pool.start()
+    deadline = time.time() + 10
+    while not finished and time.time() < deadline:
+        time.sleep(0.05)
+    return finished
+
+
+class Permanent(Exception):
+    pass
+
+
+def fail_with(error):
+    def handler(payload):
+        raise error
+    return handler
+
+
+def test_permanent_errors_fail_without_retry(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), max_attempts=3)
+    job_id = queue.submit({"n": 1})
+    retryable = lambda error: not isinstance(error, Permanent)
+    assert run_one(queue, fail_with(Permanent("404 Not Found")), retryable) == [False]
+    stored = queue.get(job_id)
+    assert (stored["status"], stored["attempts"], stored["error"]) == ("failed", 1, "404 Not Found")
+
+
+def test_transient_errors_are_retried(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), max_attempts=3, retry_backoff=60)
+    job_id = queue.submit({"n": 1})
+    retryable = lambda error: not isinstance(error, Permanent)
+    assert run_one(queue, fail_with(TimeoutError("read timed out")), retryable) == [True]
+    assert queue.get(job_id)["status"] == "queued"
@@ -0,0 +1,69 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from duplicate_index import popcount64
+from phash_index import PHashIndex
+
+
+def random_hashes(rng, n):
+    return rng.integers(0, 2 ** 63, n, dtype=np.int64).astype(np.uint64) ^ (
+        rng.integers(0, 2, n, dtype=np.int64).astype(np.uint64) << np.uint64(63))
+
+
+def flip_bits(rng, value, count):
+    for bit in rng.choice(64, count, replace=False):
+        value ^= 1 << int(bit)
+    return value
+
+
+def near_duplicates(rng, seeds, n, max_flips):
+    """Hashes a few bits from one of ``seeds``, so queries have many neighbours within radius"""
+    picks = rng.choice(seeds, n)
+    return np.array([flip_bits(rng, int(seed), rng.integers(0, max_flips + 1)) for seed in picks], dtype=np.uint64)
+
+
+def brute_force(hashes, query, k):
+    return set(np.flatnonzero(popcount64(hashes ^ np.uint64(query)) <= k).tolist())
+
+
+@pytest.mark.parametrize("k", [0, 3, 5, 7])
+def test_radius_search_matches_brute_force_across_tail_merges(k):
+    rng = np.random.default_rng(k)
+    seeds = random_hashes(rng, 50)
+    bulk = np.concatenate([random_hashes(rng, 3000), near_duplicates(rng, seeds, 2000, 8)])
+    singles = near_duplicates(rng, seeds, 5000, 8)
+
+    index = PHashIndex(merge_threshold=4096)
+    index.add_many(bulk)
+    stored = list(bulk)
+    queries = [int(seed) for seed in seeds[:10]] + [flip_bits(rng, int(seed), 3) for seed in seeds[10:20]]
+    # Inserts one at a time: queries land before, at and after the 4096-row tail merge
+    checkpoints = {0, 1, 4095, 4096, 4097, len(singles)}
+    for i in range(len(singles) + 1):
+        if i in checkpoints:
+            hashes = np.array(stored, dtype=np.uint64)
+            for query in queries:
+                found = {hit["row"] for hit in index.search(f"{query:016x}", k)}
+                assert found == brute_force(hashes, query, k), (i, k, index.stats())
+        if i < len(singles):
+            index.add(f"{int(singles[i]):016x}")
+            stored.append(singles[i])
+    assert index.stats()["unsorted"] < 4096
+
+
+def test_results_are_closest_first_and_exclude_the_user():
+    index = PHashIndex()
+    base = 0x0123456789ABCDEF
+    index.add(f"{base ^ 0b111:016x}", doc_id="far", user_id="alice")
+    index.add(f"{base:016x}", doc_id="same-user", user_id="bob")
+    index.add(f"{base ^ 0b1:016x}", doc_id="near", user_id="carol")
+
+    hits = index.search(f"{base:016x}", 5)
+    assert [(hit["doc_id"], hit["distance"]) for hit in hits] == [("same-user", 0), ("near", 1), ("far", 3)]
+    hits = index.search(f"{base:016x}", 5, exclude_user="bob", limit=1)
+    assert [(hit["doc_id"], hit["user_id"]) for hit in hits] == [("near", "carol")]
@@ -0,0 +1,132 @@
+import os
+import sys
+import threading
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import result_cache
+from result_cache import ResultCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(result_cache, "time", types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def counting(value):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return value
+    return compute, calls
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = ResultCache(ttl_seconds=60)
+    compute, calls = counting("verdict")
+    assert cache.get_or_compute("key", "ai", compute) == "verdict"
+    clock.now += 59
+    assert cache.get_or_compute("key", "ai", compute) == "verdict"
+    assert len(calls) == 1
+    clock.now += 2
+    assert cache.get_or_compute("key", "ai", compute) == "verdict"
+    assert len(calls) == 2
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = ResultCache(max_entries=2)
+    for key in ("a", "b"):
+        cache.get_or_compute(key, "ai", lambda: key)
+    cache.get_or_compute("a", "ai", lambda: "recomputed")  # hit: "a" becomes most recent
+    cache.get_or_compute("c", "ai", lambda: "c")
+    compute, calls = counting("a")
+    assert cache.get_or_compute("a", "ai", compute) == "a" and calls == []
+    compute, calls = counting("b again")
+    assert cache.get_or_compute("b", "ai", compute) == "b again" and calls == [1]
+    assert cache.stats()["evictions"] == 2
+
+
+def test_concurrent_misses_compute_once():
+    cache = ResultCache()
+    release = threading.Event()
+    started = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(10)
+        return "embedding"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("key", "clip", compute)))
+               for _ in range(8)]
+    threads[0].start()
+    assert started.wait(10)
+    for thread in threads[1:]:
+        thread.start()
+    while cache.stats()["coalesced"] < 7:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join(10)
+    assert results == ["embedding"] * 8
+    assert len(calls) == 1
+    assert cache.stats()["coalesced"] == 7
+
+
+def test_errors_reach_waiters_and_are_not_cached():
+    cache = ResultCache()
+    release = threading.Event()
+    started = threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(10)
+        raise RuntimeError("model still loading")
+
+    errors = []
+
+    def call():
+        try:
+            cache.get_or_compute("key", "ai", failing)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    owner = threading.Thread(target=call)
+    owner.start()
+    assert started.wait(10)
+    waiter = threading.Thread(target=call)
+    waiter.start()
+    while cache.stats()["coalesced"] < 1:
+        pass
+    release.set()
+    owner.join(10)
+    waiter.join(10)
+    assert errors == ["model still loading"] * 2
+    assert cache.stats()["inflight"] == 0
+    assert cache.get_or_compute("key", "ai", lambda: "ok") == "ok"
+
+
+def test_should_cache_false_is_not_stored():
+    cache = ResultCache()
+    compute, calls = counting({"error": "decode failed"})
+    for _ in range(2):
+        cache.get_or_compute("key", "ai", compute, should_cache=lambda value: "error" not in value)
+    assert len(calls) == 2
+    assert cache.stats()["entries"] == 0
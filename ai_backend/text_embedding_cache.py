@@ -0,0 +1,79 @@
+"""On-disk cache of precomputed CLIP text embeddings.
+
+Prompt embeddings only change when the model weights, the inference engine
+or the prompt list change, so they are computed once and stored as .npy
+files named by a hash of exactly those inputs. The model revision is the
+Hugging Face snapshot commit already in the local cache (no network call).
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_DIR = os.path.join(BASE_DIR, "text_embedding_cache")
+
+
+def model_revision(model_name, revision=None):
+    """Snapshot commit of a locally cached Hugging Face model, or ``revision`` / "unresolved" """
+    try:
+        from huggingface_hub import try_to_load_from_cache
+
+        path = try_to_load_from_cache(model_name, "config.json", revision=revision)
+        if isinstance(path, str):
+            # .../models--org--name/snapshots/<commit>/config.json
+            return os.path.basename(os.path.dirname(path))
+    except Exception:
+        pass
+    return revision or "unresolved"
+
+
+def file_fingerprint(path):
+    """Size + mtime of a model file (e.g. an exported ONNX graph)"""
+    try:
+        stat = os.stat(path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+    except OSError:
+        return "missing"
+
+
+def cache_key(key_parts, prompts):
+    payload = json.dumps({"key": key_parts, "prompts": list(prompts)}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:24]
+
+
+class TextEmbeddingCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    def path_for(self, key_parts, prompts):
+        return os.path.join(self.cache_dir, f"{cache_key(key_parts, prompts)}.npy")
+
+    def load_or_compute(self, key_parts, prompts, compute):
+        """float32 array of ``compute(prompts)``, read from disk when the key matches"""
+        path = self.path_for(key_parts, prompts)
+        try:
+            embeddings = np.load(path)
+            if embeddings.shape[0] == len(prompts):
+                self.hits += 1
+                return embeddings
+        except (OSError, ValueError):
+            pass
+
+        self.misses += 1
+        embeddings = np.ascontiguousarray(compute(prompts), dtype=np.float32)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as handle:
+                np.save(handle, embeddings)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: could not persist text embeddings to {path}: {e}")
+        return embeddings
+
+    def stats(self):
+        return {"cache_dir": self.cache_dir, "hits": self.hits, "misses": self.misses}
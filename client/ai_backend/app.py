@@ -6,14 +6,16 @@ from PIL import Image
 import requests
 import imagehash
 import io, os
+from gallery import Gallery
 
 app = Flask(__name__)
 CORS(app)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32")
-processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+CLIP_MODEL_NAME = "openai/clip-vit-base-patch32"
+model = CLIPModel.from_pretrained(CLIP_MODEL_NAME)
+processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
 
 previous_images = [
     os.path.join(BASE_DIR, "test", "ChatGPT-Image-Jun-3-2025-014543-PM.webp"),
@@ -40,12 +42,19 @@ def get_clip_embedding(pil_image):
 #Normalization ensures that all embeddings lie on the unit hypersphere (length = 1).
 #This is important because cosine similarity works best with unit vectors.
 
-def is_duplicate_phash(img1, img2, threshold=5):
-    hash1 = imagehash.phash(img1)
-    hash2 = imagehash.phash(img2)
-    diff = abs(hash1 - hash2)
-    print(f"[pHash] Hamming Distance: {diff}")
-    return diff <= threshold
+# Gallery pHashes + embeddings, precomputed into embeddings_manifest.json / embeddings.npy
+# (python gallery.py build); startup only recomputes new or modified files
+gallery = Gallery(CLIP_MODEL_NAME)
+
+def gallery_features(path):
+    img = load_image(path)
+    return imagehash.phash(img), get_clip_embedding(img)[0].numpy()
+
+def refresh_gallery(force=False):
+    return gallery.refresh(previous_images, gallery_features, force=force)
+
+if os.getenv("GALLERY_REFRESH_ON_START", "true").lower() == "true":
+    print(f"[Gallery] {refresh_gallery()} of {len(previous_images)} images (re)computed")
 
 @app.route("/check_duplicate", methods=["POST"])
 def check_duplicate():
@@ -56,24 +65,20 @@ def check_duplicate():
 
     try:
         current_img = load_image(image_url)
-        current_emb = get_clip_embedding(current_img)
-
-        for prev_path in previous_images:
-            prev_img = load_image(prev_path)
-
-            # pHash check
-            if is_duplicate_phash(current_img, prev_img):
-                return jsonify({"duplicate": True, "method": "phash", "similarity": 1.0})
-
-            # CLIP check
-            prev_emb = get_clip_embedding(prev_img)
-            sim = torch.nn.functional.cosine_similarity(current_emb, prev_emb).item()
-            print(f"[CLIP] Similarity with {prev_path}: {sim:.4f}")
-
-            if sim > 0.93:
-                return jsonify({"duplicate": True, "method": "clip", "similarity": sim})
-
-        return jsonify({"duplicate": False, "similarity": sim})
+        current_hash = imagehash.phash(current_img)
+        current_emb = get_clip_embedding(current_img)[0].numpy()
+
+        # pHash and CLIP against the whole gallery at once
+        method, index, similarities = gallery.query(current_hash, current_emb)
+        if method == "phash":
+            print(f"[pHash] Match with {gallery.entries[index]['path']}")
+            return jsonify({"duplicate": True, "method": "phash", "similarity": 1.0})
+        if method == "clip":
+            sim = float(similarities[index])
+            print(f"[CLIP] Similarity with {gallery.entries[index]['path']}: {sim:.4f}")
+            return jsonify({"duplicate": True, "method": "clip", "similarity": sim})
+
+        return jsonify({"duplicate": False, "similarity": float(similarities.max()) if len(similarities) else 0.0})
 
     except Exception as e:
         print("[ERROR]", str(e))
@@ -0,0 +1,158 @@
+"""Precomputed reference gallery for /check_duplicate.
+
+pHashes and normalized CLIP embeddings of the gallery images are kept on
+disk: ``embeddings.npy`` holds the (N, 512) float32 embedding matrix and
+``embeddings_manifest.json`` the manifest (path, size, mtime, sha256 and
+pHash per row, plus the model name); both are build outputs and
+gitignored. ``refresh`` reuses every row whose file is unchanged: same size
+and mtime, or same sha256 after a touch. It only decodes and embeds new or
+modified files, and rewrites the store atomically when anything changed.
+A lookup is then one matrix-vector product plus one vectorized popcount
+against the whole gallery.
+
+Build (or rebuild) the store without starting the server:
+    python gallery.py build [--force]
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MANIFEST = os.path.join(BASE_DIR, "embeddings_manifest.json")
+DEFAULT_MATRIX = os.path.join(BASE_DIR, "embeddings.npy")
+EMBEDDING_DIM = 512
+
+# Per-byte popcount for numpy builds without np.bitwise_count
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount64(values):
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_atomic(path, write):
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as handle:
+        write(handle)
+    os.replace(tmp_path, path)
+
+
+class Gallery:
+    def __init__(self, model_name, manifest_path=DEFAULT_MANIFEST, matrix_path=DEFAULT_MATRIX):
+        self.model_name = model_name
+        self.manifest_path = manifest_path
+        self.matrix_path = matrix_path
+        self._lock = threading.Lock()
+        self.entries = []
+        self.phashes = np.zeros(0, dtype=np.uint64)
+        self.embeddings = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+
+    def _load_store(self):
+        """Rows of the on-disk store keyed by path; empty if missing, unreadable or built with another model"""
+        try:
+            with open(self.manifest_path) as handle:
+                manifest = json.load(handle)
+            if manifest.get("model") != self.model_name:
+                return {}
+            matrix = np.load(self.matrix_path, mmap_mode="r")
+            if matrix.shape != (len(manifest["files"]), EMBEDDING_DIM):
+                return {}
+        except (OSError, ValueError, KeyError):
+            return {}
+        return {entry["path"]: (entry, matrix[row]) for row, entry in enumerate(manifest["files"])}
+
+    def refresh(self, paths, compute, force=False):
+        """Sync the store with ``paths``; ``compute(path) -> (phash_hex, embedding)`` runs only for stale files.
+
+        Returns the number of files (re)computed.
+        """
+        with self._lock:
+            stored = {} if force else self._load_store()
+            entries, vectors, computed = [], [], 0
+            for path in paths:
+                key = os.path.relpath(path, BASE_DIR)
+                stat = os.stat(path)
+                entry, vector = stored.get(key, (None, None))
+                if entry is not None and (entry["size"], entry["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+                    sha256 = file_sha256(path)
+                    if entry["sha256"] == sha256:
+                        # Touched or copied, same bytes
+                        entry = dict(entry, mtime_ns=stat.st_mtime_ns)
+                    else:
+                        entry = None
+                if entry is None:
+                    phash, vector = compute(path)
+                    entry = {
+                        "path": key,
+                        "size": stat.st_size,
+                        "mtime_ns": stat.st_mtime_ns,
+                        "sha256": file_sha256(path),
+                        "phash": str(phash),
+                    }
+                    computed += 1
+                entries.append(entry)
+                vectors.append(np.asarray(vector, dtype=np.float32).reshape(EMBEDDING_DIM))
+
+            embeddings = np.stack(vectors) if vectors else np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+            if entries != [entry for entry, _ in stored.values()]:
+                # Matrix first: a reader pairing the new manifest with the old matrix fails the shape check
+                _write_atomic(self.matrix_path, lambda handle: np.save(handle, embeddings))
+                _write_atomic(self.manifest_path, lambda handle: handle.write(
+                    json.dumps({"model": self.model_name, "files": entries}, indent=2).encode()
+                ))
+
+            self.entries = entries
+            self.phashes = np.array([int(entry["phash"], 16) for entry in entries], dtype=np.uint64)
+            self.embeddings = embeddings
+            return computed
+
+    def query(self, phash, embedding, phash_threshold=5, clip_threshold=0.93):
+        """First gallery match as (method, index, similarities), or (None, None, similarities)
+
+        Gallery order decides, and within one image pHash wins over CLIP, as
+        in the original per-image loop.
+        """
+        entries, phashes, embeddings = self.entries, self.phashes, self.embeddings
+        similarities = embeddings @ np.asarray(embedding, dtype=np.float32).reshape(EMBEDDING_DIM)
+        distances = popcount64(phashes ^ np.uint64(int(str(phash), 16)))
+        phash_match = distances <= phash_threshold
+        matches = np.flatnonzero(phash_match | (similarities > clip_threshold))
+        if len(matches) == 0:
+            return None, None, similarities
+        index = int(matches[0])
+        return ("phash" if phash_match[index] else "clip"), index, similarities
+
+    def stats(self):
+        return {"images": len(self.entries), "model": self.model_name}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the /check_duplicate reference gallery")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--force", action="store_true", help="Recompute every image")
+    args = parser.parse_args()
+
+    os.environ["GALLERY_REFRESH_ON_START"] = "false"
+    import app
+
+    computed = app.refresh_gallery(force=args.force)
+    print(f"Gallery: {len(app.gallery.entries)} images, {computed} (re)computed -> {app.gallery.matrix_path}")
+
+
+if __name__ == "__main__":
+    main()